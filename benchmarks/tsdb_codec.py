@@ -0,0 +1,188 @@
+"""
+Micro-benchmark for the TSDB record encoding layer.
+
+This compares :func:`delphin.tsdb.split` and :func:`delphin.tsdb.join`
+against the previous per-column implementations on synthetic lines
+shaped like the *item*, *parse*, and *result* relations. Run it from
+the repository root:
+
+    python benchmarks/tsdb_codec.py [--lines N] [--repeat N]
+"""
+
+import argparse
+import random
+import timeit
+
+from delphin import tsdb
+
+FIELDS = {
+    'item': [
+        tsdb.Field('i-id', ':integer', (':key',)),
+        tsdb.Field('i-origin', ':string'),
+        tsdb.Field('i-register', ':string'),
+        tsdb.Field('i-format', ':string'),
+        tsdb.Field('i-difficulty', ':integer'),
+        tsdb.Field('i-category', ':string'),
+        tsdb.Field('i-input', ':string'),
+        tsdb.Field('i-tokens', ':string'),
+        tsdb.Field('i-gloss', ':string'),
+        tsdb.Field('i-translation', ':string'),
+        tsdb.Field('i-wf', ':integer'),
+        tsdb.Field('i-length', ':integer'),
+        tsdb.Field('i-comment', ':string'),
+        tsdb.Field('i-author', ':string'),
+        tsdb.Field('i-date', ':date'),
+    ],
+    'parse': [
+        tsdb.Field('parse-id', ':integer', (':key',)),
+        tsdb.Field('run-id', ':integer', (':key',)),
+        tsdb.Field('i-id', ':integer', (':key',)),
+    ] + [tsdb.Field(f'p-int-{i}', ':integer') for i in range(20)] + [
+        tsdb.Field('total', ':float'),
+        tsdb.Field('p-input', ':string'),
+        tsdb.Field('p-tokens', ':string'),
+        tsdb.Field('error', ':string'),
+    ],
+    'result': [
+        tsdb.Field('parse-id', ':integer', (':key',)),
+        tsdb.Field('result-id', ':integer'),
+        tsdb.Field('time', ':integer'),
+        tsdb.Field('r-ctasks', ':integer'),
+        tsdb.Field('r-ftasks', ':integer'),
+        tsdb.Field('r-etasks', ':integer'),
+        tsdb.Field('size', ':integer'),
+        tsdb.Field('derivation', ':string'),
+        tsdb.Field('mrs', ':string'),
+        tsdb.Field('flags', ':string'),
+    ],
+}
+
+WORDS = ('the dog cat barks meows chased a big small quickly '
+         'Abrams Browne slept arrived "quoted" (x1 / x2)').split()
+
+
+# Previous implementations, kept for comparison #######################
+
+def old_escape(string):
+    return (string
+            .replace('\\', '\\\\')
+            .replace('\n', '\\n')
+            .replace(tsdb.FIELD_DELIMITER, '\\s'))
+
+
+def old_unescape(string):
+    chars = []
+    esc = False
+    for c in string:
+        if esc:
+            if c == '\\':
+                chars.append('\\')
+            elif c == 's':
+                chars.append('@')
+            elif c == 'n':
+                chars.append('\n')
+            else:
+                raise tsdb.TSDBError('invalid escape sequence: \\' + c)
+            esc = False
+        elif c == '\\':
+            esc = True
+        else:
+            chars.append(c)
+    return ''.join(chars)
+
+
+def old_split(line, fields=None):
+    raw_values = [old_unescape(col) if col else None
+                  for col in line.rstrip('\n').split(tsdb.FIELD_DELIMITER)]
+    if fields:
+        return tuple(tsdb.cast(f.datatype, col)
+                     for col, f in zip(raw_values, fields))
+    return tuple(raw_values)
+
+
+def old_join(values, fields):
+    raw_values = [tsdb.format(f.datatype, val, default=f.default)
+                  for f, val in zip(fields, values)]
+    return tsdb.FIELD_DELIMITER.join(map(old_escape, raw_values))
+
+
+# Data generation ####################################################
+
+def _text(rng, n):
+    return ' '.join(rng.choice(WORDS) for _ in range(n))
+
+
+def _value(rng, field, escapes):
+    if field.datatype == ':integer':
+        return rng.randint(-1, 100000)
+    elif field.datatype == ':float':
+        return rng.random() * 100
+    elif field.datatype == ':date':
+        return '1-feb-2018 15:00'
+    elif field.name in ('mrs', 'derivation', 'p-tokens', 'i-tokens'):
+        text = _text(rng, 200)
+        if escapes:
+            text = text.replace('(', '\n(')  # pretty-printed
+        return text
+    elif rng.random() < 0.3:
+        return None
+    return _text(rng, rng.randint(1, 8))
+
+
+def make_lines(name, count, escapes, seed=1):
+    rng = random.Random(seed)
+    fields = FIELDS[name]
+    records = [tuple(_value(rng, f, escapes) for f in fields)
+               for _ in range(count)]
+    lines = [tsdb.join(record, fields) + '\n' for record in records]
+    return records, lines
+
+
+# Benchmark ##########################################################
+
+def bench(label, func, repeat):
+    best = min(timeit.repeat(func, number=1, repeat=repeat))
+    print(f'  {label:<28} {best * 1000:9.2f} ms')
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--lines', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    for name, fields in FIELDS.items():
+        for escapes in (False, True):
+            if escapes and name != 'result':
+                continue
+            records, lines = make_lines(name, args.lines, escapes)
+            assert [old_split(line) for line in lines] == [
+                tsdb.split(line) for line in lines]
+            title = name + (' (with escapes)' if escapes else '')
+            print(f'{title}: {args.lines} lines')
+            # bind the loop's values as defaults so each lambda keeps
+            # the data of its own iteration
+            pairs = [
+                ('split',
+                 lambda lines=lines: [old_split(ln) for ln in lines],
+                 lambda lines=lines: [tsdb.split(ln) for ln in lines]),
+                ('split+cast',
+                 lambda lines=lines, fields=fields: [
+                     old_split(ln, fields) for ln in lines],
+                 lambda lines=lines, fields=fields: [
+                     tsdb.split(ln, fields) for ln in lines]),
+                ('join',
+                 lambda records=records, fields=fields: [
+                     old_join(rec, fields) for rec in records],
+                 lambda records=records, fields=fields: [
+                     tsdb.join(rec, fields) for rec in records]),
+            ]
+            for label, old, new in pairs:
+                t_old = bench(label + ' (old)', old, args.repeat)
+                t_new = bench(label + ' (new)', new, args.repeat)
+                print(f'  {"speedup":<28} {t_old / t_new:9.2f}x')
+
+
+if __name__ == '__main__':
+    main()
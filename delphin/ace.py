@@ -4,10 +4,13 @@ An interface for the ACE processor.
 """
 
 import argparse
+import hashlib
+import json
 import locale
 import logging
 import os
 import re
+import time
 from datetime import datetime
 from getpass import getuser  # portable way to get username
 from pathlib import Path
@@ -79,6 +82,8 @@ class ACEProcess(interface.Processor):
         full_forest (bool): if `True` and *tsdbinfo* is `True`, output
             the full chart for each parse result
         stderr (file): stream used for ACE's stderr
+        cache (:class:`ResponseCache`): if given, responses are
+            looked up in and stored in this cache
     """
 
     _cmdargs: List[str] = []
@@ -91,8 +96,11 @@ class ACEProcess(interface.Processor):
                  env: Optional[Mapping[str, str]] = None,
                  tsdbinfo: bool = True,
                  full_forest: bool = False,
-                 stderr: Optional[IO[Any]] = None):
+                 stderr: Optional[IO[Any]] = None,
+                 cache: Optional['ResponseCache'] = None):
         self.grm = str(Path(grm).expanduser())
+        self.cache = cache
+        self._cache_context = ''
 
         self.cmdargs = cmdargs or []
         # validate the arguments
@@ -150,6 +158,14 @@ class ACEProcess(interface.Processor):
         })
         if self._p.poll() is not None and self._p.returncode != 0:
             raise ACEProcessError("ACE process closed on startup")
+        if self.cache is not None:
+            # responses only depend on the grammar image loaded by
+            # this process, the ACE version, and the arguments
+            self._cache_context = json.dumps([
+                _grammar_digest(self.grm),
+                self.ace_version,
+                type(self).__name__,
+                self._cmdargs + self.cmdargs])
 
     def __enter__(self):
         return self
@@ -268,9 +284,18 @@ class ACEProcess(interface.Processor):
             raise TypeError('interact() argument must be a string, '
                             f'not {type(datum).__name__!r}')
         validated = self._validate_input(datum)
-        if validated:
+        cached = None
+        if validated and self.cache is not None:
+            key = json.dumps([self._cache_context, validated])
+            cached = self.cache._get(key)
+        if cached is not None:
+            result = cached
+            result['run'] = self.run_info
+        elif validated:
             self.send(validated)
             result = self.receive()
+            if self.cache is not None and not result.get('ERRORS'):
+                self.cache._put(key, result)
         else:
             result, lines = _make_response(
                 [('NOTE: PyDelphin could not validate the input and '
@@ -364,9 +389,11 @@ class ACETransferer(ACEProcess):
                  cmdargs: Optional[List[str]] = None,
                  executable: Optional[util.PathLike] = None,
                  env: Optional[Mapping[str, str]] = None,
-                 stderr: Optional[IO[Any]] = None):
+                 stderr: Optional[IO[Any]] = None,
+                 cache: Optional['ResponseCache'] = None):
         super().__init__(grm, cmdargs=cmdargs, executable=executable, env=env,
-                         tsdbinfo=False, full_forest=False, stderr=stderr)
+                         tsdbinfo=False, full_forest=False, stderr=stderr,
+                         cache=cache)
 
     def _validate_input(self, datum):
         return _possible_mrs(datum)
@@ -395,9 +422,11 @@ class ACEGenerator(ACEProcess):
                  executable: Optional[util.PathLike] = None,
                  env: Optional[Mapping[str, str]] = None,
                  tsdbinfo: bool = True,
-                 stderr: Optional[IO[Any]] = None):
+                 stderr: Optional[IO[Any]] = None,
+                 cache: Optional['ResponseCache'] = None):
         super().__init__(grm, cmdargs=cmdargs, executable=executable, env=env,
-                         tsdbinfo=tsdbinfo, full_forest=False, stderr=stderr)
+                         tsdbinfo=tsdbinfo, full_forest=False, stderr=stderr,
+                         cache=cache)
 
     def _validate_input(self, datum):
         return _possible_mrs(datum)
@@ -433,6 +462,140 @@ class ACEGenerator(ACEProcess):
         return response
 
 
+class ResponseCache:
+    """
+    A persistent cache of the responses of ACE processes.
+
+    Responses are stored as files in the directory at *path*, named
+    by a hash of the input and of the context of the ACE process:
+    the contents of the grammar image, the ACE version, the kind of
+    process, and its command-line arguments. A process using the
+    cache replays the stored response for an input instead of sending
+    it to ACE, so responses are reused by later processes with the
+    same grammar, such as in repeated regression runs, but a changed
+    grammar image never matches the stored responses. Replayed
+    responses get the run information of the process that replays
+    them. Responses with errors are not stored.
+
+    The stored responses are limited to *max_bytes* bytes in total,
+    and the least recently used ones are removed first.
+
+    A response cache is used by passing it as the *cache* argument
+    of :class:`ACEProcess` or its subclasses.
+
+    Args:
+        path: directory where responses are stored
+        max_bytes: the maximum total size of the stored responses
+    Example:
+        >>> cache = ace.ResponseCache('~/.cache/ace')
+        >>> with ace.ACEParser('erg.dat', cache=cache) as parser:
+        ...     response = parser.interact('Dogs sleep.')
+    """
+
+    def __init__(self,
+                 path: util.PathLike,
+                 max_bytes: int = 256 * 1024 * 1024) -> None:
+        self.path = Path(path).expanduser()
+        self.max_bytes = max_bytes
+        self._nbytes: Optional[int] = None  # computed when needed
+
+    def clear(self) -> None:
+        """Remove all stored responses."""
+        if self.path.is_dir():
+            for file in self.path.glob('*' + _RESPONSE_SUFFIX):
+                file.unlink()
+        self._nbytes = 0
+
+    def _file(self, key: str) -> Path:
+        digest = hashlib.sha256(key.encode('utf-8')).hexdigest()
+        return self.path / (digest + _RESPONSE_SUFFIX)
+
+    def _get(self, key: str) -> Optional[interface.Response]:
+        file = self._file(key)
+        try:
+            with file.open(encoding='utf-8') as fh:
+                stored_key, data = json.load(fh)
+            _touch(file)  # mark the response as recently used
+        except (OSError, ValueError):
+            return None
+        if stored_key != key:
+            return None
+        return interface.Response(data)
+
+    def _put(self, key: str, response: interface.Response) -> None:
+        data = {k: v for k, v in response.items() if k != 'run'}
+        try:
+            content = json.dumps([key, data])
+        except (TypeError, ValueError):
+            return  # not all responses can be stored
+        file = self._file(key)
+        temp = file.with_name(f'{file.name}.{os.getpid()}.tmp')
+        try:
+            self.path.mkdir(parents=True, exist_ok=True)
+            if self._nbytes is None:
+                self._nbytes = sum(
+                    f.stat().st_size
+                    for f in self.path.glob('*' + _RESPONSE_SUFFIX))
+            if file.exists():
+                self._nbytes -= file.stat().st_size
+            temp.write_text(content, encoding='utf-8')
+            os.replace(temp, file)
+            _touch(file)
+            self._nbytes += file.stat().st_size
+        except OSError:
+            if temp.exists():
+                temp.unlink()
+            return
+        if self._nbytes > self.max_bytes:
+            self._evict()
+
+    def _evict(self) -> None:
+        """Remove the least recently used responses until under the limit."""
+        stats = []
+        for file in self.path.glob('*' + _RESPONSE_SUFFIX):
+            try:
+                stats.append((file.stat(), file))
+            except OSError:
+                pass
+        stats.sort(key=lambda pair: pair[0].st_mtime_ns)
+        nbytes = sum(st.st_size for st, _ in stats)
+        for st, file in stats:
+            if nbytes <= self.max_bytes:
+                break
+            try:
+                file.unlink()
+            except OSError:
+                continue
+            nbytes -= st.st_size
+        self._nbytes = nbytes
+
+
+_RESPONSE_SUFFIX = '.response'
+# grammar image digests; maps paths to (size, mtime, digest)
+_grammar_digests: Dict[str, Tuple[int, int, str]] = {}
+
+
+def _touch(path: Path) -> None:
+    # file systems may record modification times more coarsely
+    now = time.time_ns()
+    os.utime(path, ns=(now, now))
+
+
+def _grammar_digest(grm: str) -> str:
+    """Return a hash of the contents of the grammar image at *grm*."""
+    st = os.stat(grm)
+    memo = _grammar_digests.get(grm)
+    if memo is not None and memo[:2] == (st.st_size, st.st_mtime_ns):
+        return memo[2]
+    sha = hashlib.sha256()
+    with open(grm, 'rb') as fh:
+        for chunk in iter(lambda: fh.read(1024 * 1024), b''):
+            sha.update(chunk)
+    digest = sha.hexdigest()
+    _grammar_digests[grm] = (st.st_size, st.st_mtime_ns, digest)
+    return digest
+
+
 def compile(cfg_path: util.PathLike,
             out_path: util.PathLike,
             executable: Optional[util.PathLike] = None,
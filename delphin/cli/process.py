@@ -43,7 +43,10 @@ def call_process(args):
         all_items=args.all_items,
         result_id=args.p,
         gzip=args.gzip,
-        executable=args.executable)
+        executable=args.executable,
+        jobs=args.jobs,
+        resume=args.resume,
+        cache=args.cache)
 
 
 # process subparser
@@ -95,3 +98,13 @@ parser.add_argument(
 parser.add_argument(
     '--executable', metavar='PATH', default='ace',
     help='path to ACE executable (default: ace)')
+parser.add_argument(
+    '-j', '--jobs', metavar='N', type=int, default=1,
+    help='number of ACE processes to run concurrently (default: 1)')
+parser.add_argument(
+    '--resume', action='store_true',
+    help='continue an interrupted run, skipping processed items')
+parser.add_argument(
+    '--cache', metavar='DIR',
+    help='cache ACE responses in DIR and reuse them while the grammar '
+         'is unchanged')
@@ -22,9 +22,19 @@ COMMAND_INFO = {
 
 
 def call_select(args):
+    if args.explain or args.analyze:
+        plan = select(
+            args.QUERY,
+            args.TESTSUITE,
+            explain=True,
+            analyze=args.analyze)
+        for i, step in enumerate(plan, 1):
+            print(_format_step(i, step))
+        return
     rows = select(
         args.QUERY,
-        args.TESTSUITE)
+        args.TESTSUITE,
+        cache=args.cache)
     try:
         for row in rows:
             print(tsdb.join(row))
@@ -32,9 +42,53 @@ def call_select(args):
         logger.info('broken pipe')
 
 
+def _format_step(i, step):
+    operation = step['operation']
+    if operation in ('scan', 'join'):
+        header = f'{operation} {step["relation"]}'
+        if operation == 'join':
+            header += f' (build: {step["build"]})'
+        lines = [f'columns: {" ".join(step["columns"])}']
+        if step['condition']:
+            lines.append(f'condition: {step["condition"]}')
+        lines.append(f'estimated rows: {step["rows"]}')
+    elif operation == 'filter':
+        header = operation
+        lines = [f'condition: {step["condition"]}']
+    elif operation == 'aggregate':
+        header = operation
+        lines = [f'group: {" ".join(step["group"])}',
+                 f'columns: {" ".join(step["columns"])}']
+    else:
+        header = f'{operation} {step["limit"]} offset {step["offset"]}'
+        lines = []
+    if 'actual_rows' in step:
+        actual = [f'rows: {step["actual_rows"]}']
+        if 'read' in step:
+            actual.append(f'read: {step["read"]}')
+            actual.append(f'hashed: {step["hashed"]}')
+        actual.append(f'time: {step["time"]:.3f}s')
+        lines.append(', '.join(actual))
+    return '\n'.join([f'{i}. {header}'] + [f'   {line}' for line in lines])
+
+
 # Arguments for the select command
 parser.set_defaults(func=call_select)
 parser.add_argument(
     'QUERY', help='TSQL selection (e.g., \'i-input where readings = 0\')')
 parser.add_argument(
     'TESTSUITE', help='path to the testsuite directory to select data from')
+parser.add_argument(
+    '--cache',
+    metavar='DIR',
+    help='cache query results in DIR and reuse them while the '
+         'testsuite is unchanged')
+parser.add_argument(
+    '--explain',
+    action='store_true',
+    help='print the execution plan of the query instead of the results')
+parser.add_argument(
+    '--analyze',
+    action='store_true',
+    help='like --explain, but run the query and print the number of '
+         'rows and the time of each step')
@@ -3,6 +3,7 @@
 PyDelphin API counterparts to the ``delphin`` commands.
 """
 
+import contextlib
 import logging
 import sys
 import tempfile
@@ -230,7 +231,7 @@ def _read(path, source_codec, select, kwargs):
             # ts = itsdb.TestSuite(path)
             xs = [
                 next(iter(source_codec.loads(r[0], **kwargs)), None)
-                for r in tsql.select(select, db)
+                for r in tsql.select(select, db, stream=True)
             ]
         else:
             xs = list(source_codec.load(path, **kwargs))
@@ -270,7 +271,12 @@ def _iter_convert(converter, xs):
 ###############################################################################
 # SELECT ######################################################################
 
-def select(query: str, path: util.PathLike, record_class=None):
+def select(query: str,
+           path: util.PathLike,
+           record_class=None,
+           cache: Optional[util.PathLike] = None,
+           explain: bool = False,
+           analyze: bool = False):
     """
     Select data from [incr tsdb()] test suites.
 
@@ -279,11 +285,24 @@ def select(query: str, path: util.PathLike, record_class=None):
             `'* from item where readings > 0'`)
         path (str, ~pathlib.Path): path to a TSDB test suite
         record_class: alternative class for records in the selection
+        cache (str, ~pathlib.Path): if given, a directory for caching
+            query results (see :class:`delphin.tsql.ResultCache`)
+        explain (bool): if `True`, return the steps of the execution
+            plan of the query instead of the selected data (see
+            :func:`delphin.tsql.explain`)
+        analyze (bool): if `True` and *explain* is `True`, run the
+            query and include the row counts and timings in the plan
     Yields:
         selected data from the test suite
     """
     db = tsdb.Database(path, autocast=True)
-    return tsql.select(query, db, record_class=record_class)
+    if explain:
+        return tsql.explain(query, db, analyze=analyze)
+    result_cache = None
+    if cache is not None:
+        result_cache = tsql.ResultCache(path=cache)
+    return tsql.select(query, db, record_class=record_class, stream=True,
+                       cache=result_cache)
 
 
 ###############################################################################
@@ -460,7 +479,7 @@ def _mkprof_from_database(destination, db, schema, where, full, gzip):
             # (e.g., if the filter and table cannot be joined)
             try:
                 records = _tsql_distinct(
-                    tsql.select(f'* from {table} {where}', db))
+                    tsql.select(f'* from {table} {where}', db, stream=True))
             except tsql.TSQLError:
                 records = list(db[table])
         else:
@@ -521,15 +540,28 @@ def _mkprof_summarize(destination, schema):
     def _red(s):
         return f'\x1b[1;31m{s}\x1b[0m' if isatty else s
 
-    fmt = '{:>8} bytes\t{}'
+    fmt = '{:>8} bytes\t{:>8}\t{}'
     for filename in ['relations'] + list(schema):
         path = destination.joinpath(filename)
+        if filename == 'relations':
+            rows = ''
+        else:
+            rows = _mkprof_rows(destination, filename)
         if path.is_file():
             stat = path.stat()
-            print(fmt.format(stat.st_size, filename))
+            print(fmt.format(stat.st_size, rows, filename))
         elif path.with_suffix('.gz').is_file():
             stat = path.with_suffix('.gz').stat()
-            print(fmt.format(stat.st_size, _red(filename + '.gz')))
+            print(fmt.format(stat.st_size, rows, _red(filename + '.gz')))
+
+
+def _mkprof_rows(destination, name):
+    # the statistics were just written with the relation, if at all
+    try:
+        stats = tsdb.get_statistics(destination, name, build=False)
+    except tsdb.TSDBError:
+        return ''
+    return '' if stats is None else f'{stats.rows} rows'
 
 
 ###############################################################################
@@ -538,7 +570,8 @@ def _mkprof_summarize(destination, schema):
 def process(grammar, testsuite, source=None, select=None,
             generate=False, transfer=False, full_forest=False,
             options=None, all_items=False, result_id=None, gzip=False,
-            executable='ace', stderr=None, report_progress=True):
+            executable='ace', stderr=None, report_progress=True, jobs=1,
+            resume=False, cache=None):
     """
     Process the [incr tsdb()] profile *testsuite* with *grammar*.
 
@@ -592,6 +625,14 @@ def process(grammar, testsuite, source=None, select=None,
         report_progress (bool): print a progress bar to stderr if
             `True` and logging verbosity is at WARNING or lower;
             (default: `True`)
+        jobs (int): number of ACE processes used to process items
+            concurrently (default: 1)
+        resume (bool): if `True`, continue an interrupted run by only
+            processing the items of *testsuite* that were not
+            processed yet (default: `False`)
+        cache (str, ~pathlib.Path): if given, a directory for caching
+            ACE responses and reusing them while the grammar is
+            unchanged
     """
     from delphin import ace
 
@@ -600,11 +641,15 @@ def process(grammar, testsuite, source=None, select=None,
 
     if not grammar.is_file():
         raise CommandError(f'{grammar} is not a file')
+    if jobs < 1:
+        raise CommandError(f'invalid number of jobs: {jobs}')
 
     kwargs = {
         'stderr': stderr,
         'executable': executable,
     }
+    if cache is not None:
+        kwargs['cache'] = ace.ResponseCache(path=cache)
     if sum(1 if mode else 0 for mode in (generate, transfer, full_forest)) > 1:
         raise CommandError("'generate', 'transfer', and 'full-forest' "
                            "are mutually exclusive")
@@ -648,7 +693,8 @@ def process(grammar, testsuite, source=None, select=None,
 
         process_kwargs = {'selector': (relation, column),
                           'source': tmp,
-                          'gzip': gzip}
+                          'gzip': gzip,
+                          'resume': resume}
         bar = None
         if (report_progress
                 and len(tmp[relation])
@@ -656,8 +702,11 @@ def process(grammar, testsuite, source=None, select=None,
             bar = ProgressBar('Processing', max=len(tmp[relation]))
             process_kwargs['callback'] = lambda _: bar.next()
 
-        with processor(grammar, cmdargs=options, **kwargs) as cpu:
-            target.process(cpu, **process_kwargs)
+        with contextlib.ExitStack() as stack:
+            cpus = [stack.enter_context(
+                        processor(grammar, cmdargs=options, **kwargs))
+                    for _ in range(jobs)]
+            target.process(cpus, **process_kwargs)
             if bar:
                 bar.finish()
 
@@ -830,10 +879,13 @@ def compare(testsuite: Union[util.PathLike, itsdb.TestSuite],
     # https://github.com/delph-in/pydelphin/issues/258
     i_inputs = dict(tsql.select(input_select, testsuite))  # type: ignore
 
+    # stream the (possibly large) MRS selections and merge them in
+    # bounded memory
     matched_rows = itsdb.match_rows(
-        tsql.select(select, testsuite),  # type: ignore
-        tsql.select(select, gold),       # type: ignore
-        0)
+        tsql.select(select, testsuite, stream=True),  # type: ignore
+        tsql.select(select, gold, stream=True),       # type: ignore
+        0,
+        stream=True)
 
     for (key, testrows, goldrows) in matched_rows:
         (test_unique, shared, gold_unique) = mrs.compare_bags(
@@ -3,9 +3,15 @@
 """
 
 import collections
+import heapq
 import itertools
+import json
 import logging
+import os
+import pickle
+import queue
 import tempfile
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
 from typing import (
@@ -35,6 +41,8 @@ logger = logging.getLogger(__name__)
 ##############################################################################
 # Module variables
 
+CHECKPOINT_FILENAME = 'process.checkpoint'
+
 _default_task_selectors = {
     'parse': ('item', 'i-input'),
     'transfer': ('result', 'mrs'),
@@ -234,12 +242,7 @@ class FieldMapper:
             if 'end' not in last_run:
                 last_run['end'] = datetime.now()
 
-            for run_id in sorted(self._runs):
-                run = self._runs[run_id]
-                d = {'run-id': run.get('run-id', -1)}
-                for key in self._run_keys:
-                    if key in run:
-                        d[key] = run[key]
+            for d in self._run_rows():
                 inserts.append(('run', d))
 
         # reset for next task
@@ -249,53 +252,151 @@ class FieldMapper:
 
         return inserts
 
+    def _run_rows(self) -> List[tsdb.ColumnMap]:
+        """Return the rows of the runs seen so far."""
+        rows = []
+        for run_id in sorted(self._runs):
+            run = self._runs[run_id]
+            d = {'run-id': run.get('run-id', -1)}
+            for key in self._run_keys:
+                if key in run:
+                    d[key] = run[key]
+            rows.append(d)
+        return rows
+
     def collect(self, ts: 'TestSuite') -> Iterator[interface.Response]:
         """
         Map from test suites to response objects.
 
-        The data in the test suite must be ordered.
+        After a scan of their key columns, the 'item', 'parse', and
+        'result' tables are joined in a single streaming pass when
+        the rows of 'parse' follow the order of the items they belong
+        to and the rows of 'result' follow the order of their parses,
+        as when they were written by :meth:`TestSuite.process`.
+        Otherwise the rows of a table are found by their positions,
+        which are read by seeking (see :func:`tsdb.get_line_index`)
+        or, for gzipped tables that cannot be indexed, kept in memory.
+        """
+        items = ts['item']
+        parses = ts['parse']
+        results = ts['result']
+
+        # the order is checked on raw values, which is cheaper and
+        # only rejects orders that would merge with cast values
+        item_ids = _column(items, 'i-id', cast=False)
+        if _is_merge_ordered(item_ids(),
+                             _column(parses, 'i-id', cast=False)()):
+            parse_join = _merge_join(parses, 'i-id')
+            parse_ids = _column(parses, 'parse-id', cast=False)
+        else:
+            parse_join = _index_join(parses, 'i-id')
+            parse_ids = None
+        if (parse_ids is not None
+                and _is_merge_ordered(
+                    parse_ids(), _column(results, 'parse-id', cast=False)())):
+            result_join = _merge_join(results, 'parse-id')
+        else:
+            result_join = _index_join(results, 'parse-id')
 
-        .. note::
+        for item in items:
+            d: Dict[str, tsdb.Value] = dict(zip(item.keys(), item))
+            for parse in parse_join(d['i-id']):
+                response = interface.Response(d)
+                response.update(parse)
+                response['results'] = result_join(parse['parse-id'])
+                yield response
 
-           This method stores the 'item', 'parse', and 'result' tables
-           in memory during operation, so it is not recommended when a
-           test suite is very large as it may exhaust the system's
-           available memory.
-        """
 
-        # type checking this function is a mess; it needs a better fix
+_ColumnMaps = List[Dict[str, tsdb.Value]]
 
-        def get_i_id(row: 'Row') -> int:
-            i_id = row['i-id']
-            assert isinstance(i_id, int)
-            return i_id
 
-        def get_parse_id(row: 'Row') -> int:
-            parse_id = row['parse-id']
-            assert isinstance(parse_id, int)
-            return parse_id
+def _column(table: 'Table',
+            name: str,
+            cast: bool = True) -> Callable[[], Iterator[tsdb.Value]]:
+    """Return a function iterating over the values of a column."""
+    index = table.column_index(name)
 
-        parse_map: Dict[int, List[Dict[str, tsdb.Value]]] = {}
-        rows  = typing_cast(Sequence['Row'], ts['parse'])
-        for key, grp in itertools.groupby(rows, key=get_i_id):
-            parse_map[key] = [dict(zip(row.keys(), row)) for row in grp]
+    def values() -> Iterator[tsdb.Value]:
+        for row in table.select(name, cast=cast):
+            yield row[0]
 
-        result_map: Dict[int, List[Dict[str, tsdb.Value]]] = {}
-        rows  = typing_cast(Sequence['Row'], ts['result'])
-        for key, grp in itertools.groupby(rows, key=get_parse_id):
-            result_map[key] = [dict(zip(row.keys(), row)) for row in grp]
+    def raw_values() -> Iterator[tsdb.Value]:
+        # field delimiters are always escaped within values, so the
+        # line only needs to be split up to the column
+        with tsdb.open(table.dir, table.name,
+                       encoding=table.encoding) as lines:
+            for line in lines:
+                value = line.split(tsdb.FIELD_DELIMITER, index + 1)[index]
+                yield value.rstrip('\n') or None
 
-        for item in ts['item']:
-            d: Dict[str, tsdb.Value] = dict(zip(item.keys(), item))
-            i_id = d['i-id']
-            assert isinstance(i_id, int)
-            for parse in parse_map.get(i_id, []):
-                response = interface.Response(d)
-                response.update(parse)
-                parse_id = parse['parse-id']
-                assert isinstance(parse_id, int)
-                response['results'] = result_map.get(parse_id, [])
-                yield response
+    if cast or table.cache or table._in_transaction:
+        return values
+    return raw_values
+
+
+def _is_merge_ordered(keys: Iterable[tsdb.Value],
+                      foreign_keys: Iterable[tsdb.Value]) -> bool:
+    """
+    Return `True` if *foreign_keys* can be merged with *keys*.
+
+    The foreign keys can be merged if they are consumed in order by
+    grouping the consecutive foreign keys equal to each key.
+    """
+    marker = object()
+    foreign = iter(foreign_keys)
+    next_key = next(foreign, marker)
+    for key in keys:
+        while next_key == key:
+            next_key = next(foreign, marker)
+        if next_key is marker:
+            break
+    return next_key is marker
+
+
+def _merge_join(
+    table: 'Table',
+    name: str
+) -> Callable[[tsdb.Value], _ColumnMaps]:
+    """Return a function joining keys in order with rows of *table*."""
+    index = table.column_index(name)
+    rows = iter(table)
+    next_row = next(rows, None)
+
+    def join(key: tsdb.Value) -> _ColumnMaps:
+        nonlocal next_row
+        joined = []
+        while next_row is not None and next_row[index] == key:
+            joined.append(dict(zip(next_row.keys(), next_row)))
+            next_row = next(rows, None)
+        return joined
+
+    return join
+
+
+def _index_join(
+    table: 'Table',
+    name: str
+) -> Callable[[tsdb.Value], _ColumnMaps]:
+    """Return a function joining keys with rows of *table* by position."""
+    if table.cache or tsdb.get_line_index(table.dir, table.name) is not None:
+        positions: Dict[tsdb.Value, List[int]] = {}
+        for i, key in enumerate(_column(table, name)()):
+            positions.setdefault(key, []).append(i)
+
+        def join(key: tsdb.Value) -> _ColumnMaps:
+            rows = table._rows_at(positions.get(key, []))
+            return [dict(zip(row.keys(), row)) for row in rows]
+    else:
+        # without random access, keep the rows of the table in memory
+        row_maps: Dict[tsdb.Value, _ColumnMaps] = {}
+        for row in table:
+            row_maps.setdefault(row[name], []).append(
+                dict(zip(row.keys(), row)))
+
+        def join(key: tsdb.Value) -> _ColumnMaps:
+            return row_maps.get(key, [])
+
+    return join
 
 
 ##############################################################################
@@ -311,6 +412,12 @@ class Row(tsdb.Record):
     unexpected results for value retrieval by field names
     (`row[field_name]`).
 
+    The column values are only formatted as raw strings when the
+    :attr:`data` attribute is first used, and values retrieved by
+    index or field name are formatted and cast individually, so rows
+    read from a table cost little more than the split line until
+    their values are used.
+
     Args:
         fields: column descriptions; an iterable of
             :class:`tsdb.Field` objects
@@ -322,7 +429,7 @@ class Row(tsdb.Record):
         data: The raw column values.
     """
 
-    __slots__ = 'fields', 'data', '_field_index'
+    __slots__ = 'fields', '_values', '_formatted', '_field_index'
 
     def __init__(self,
                  fields: tsdb.Fields,
@@ -335,10 +442,25 @@ class Row(tsdb.Record):
         if field_index is None:
             field_index = tsdb.make_field_index(fields)
         self.fields = fields
-        self.data = tuple(tsdb.format(f.datatype, val)
-                          for f, val in zip(fields, data))
+        self._values: Tuple[tsdb.Value, ...] = tuple(data)
+        # once formatted, the raw strings replace the original values
+        self._formatted = False
         self._field_index = field_index
 
+    @property
+    def data(self) -> Tuple[str, ...]:
+        if not self._formatted:
+            self._values = tuple(tsdb.get_codec(self.fields).format(
+                self._values, defaults=False))
+            self._formatted = True
+        return typing_cast(Tuple[str, ...], self._values)
+
+    def _raw_value(self, index: int) -> str:
+        """Return the raw value at *index* without formatting all values."""
+        if self._formatted:
+            return typing_cast(str, self._values[index])
+        return tsdb.format(self.fields[index].datatype, self._values[index])
+
     def __repr__(self) -> str:
         return '<{} object ({}) at {}>'.format(
             type(self).__name__,
@@ -357,9 +479,7 @@ class Row(tsdb.Record):
         return len(self.fields)
 
     def __iter__(self) -> Iterator[tsdb.Value]:
-        datatypes = tuple(field.datatype for field in self.fields)
-        for datatype, raw_value in zip(datatypes, self.data):
-            yield tsdb.cast(datatype, raw_value)
+        return iter(tsdb.get_codec(self.fields).cast(self.data))
 
     @overload
     def __getitem__(self, key: int) -> tsdb.Value:
@@ -377,15 +497,14 @@ class Row(tsdb.Record):
         if isinstance(key, slice):
             fields = self.fields[key]
             raw_values = self.data[key]
-            return tuple(tsdb.cast(field.datatype, raw)
-                         for field, raw in zip(fields, raw_values))
+            return tsdb.get_codec(fields).cast(raw_values)
         else:
             if isinstance(key, str):
                 index = self._field_index[key]
             else:
                 index = key
             field = self.fields[index]
-            raw_value = self.data[index]
+            raw_value = self._raw_value(index)
             return tsdb.cast(field.datatype, raw_value)
 
     def keys(self) -> List[str]:
@@ -411,23 +530,34 @@ class Table(tsdb.Relation):
         fields: the table schema; an iterable of :class:`tsdb.Field`
             objects
         encoding: character encoding of the table file
+        line_index: if `True`, use a persistent line index (see
+            :func:`tsdb.get_line_index`) for random access to rows
+        cache: if `True`, read rows from the decoded data in the
+            shared relation cache (see :func:`tsdb.set_relation_cache_size`)
+            instead of from the table file
     Attributes:
         dir: The path to the database directory.
         name: The name of the table.
         fields: The table's schema.
         encoding: The character encoding of table files.
+        line_index: Whether a line index is used for random access.
+        cache: Whether rows are read from the shared relation cache.
     """
 
     def __init__(self,
                  dir: util.PathLike,
                  name: str,
                  fields: tsdb.Fields,
-                 encoding: str = 'utf-8') -> None:
+                 encoding: str = 'utf-8',
+                 line_index: bool = False,
+                 cache: bool = False) -> None:
         self.dir = Path(dir).expanduser()
         self.name = name
         self.fields: Sequence[tsdb.Field] = fields
         self._field_index = tsdb.make_field_index(fields)
         self.encoding = encoding
+        self.line_index = line_index
+        self.cache = cache
         try:
             tsdb.get_path(self.dir, name)
         except tsdb.TSDBError:
@@ -455,25 +585,52 @@ class Table(tsdb.Relation):
 
     def _sync_with_file(self) -> None:
         """Clear in-memory structures so table is synced with the file."""
-        self._rows = []
-        i = -1
-        with tsdb.open(self.dir,
-                       self.name,
-                       encoding=self.encoding) as lines:
-            for _ in lines:
-                i += 1
-                self._rows.append(None)
-        self._persistent_count = i + 1
-        self._volatile_index = i + 1
+        offsets = None
+        stats = None
+        if self.cache:
+            count = self._cached_relation().count
+        else:
+            stats = tsdb.get_statistics(
+                self.dir, self.name, self.fields, build=False)
+            if self.line_index:
+                offsets = tsdb.get_line_index(self.dir, self.name)
+            if stats is not None:
+                count = stats.rows
+            elif offsets is not None:
+                count = len(offsets)
+            else:
+                count = 0
+                with tsdb.open(self.dir,
+                               self.name,
+                               encoding=self.encoding) as lines:
+                    for _ in lines:
+                        count += 1
+        self._rows = [None] * count
+        self._persistent_count = count
+        self._volatile_index = count
+
+    def _cached_relation(self):
+        """Return the table's decoded data from the relation cache."""
+        return tsdb._read_columns(
+            self.dir, self.name, self.fields, self.encoding)
+
+    def _cached_records(self) -> Iterator[tsdb.RawRecord]:
+        """Yield the raw records of the table's decoded data."""
+        relation = self._cached_relation()
+        return relation.select_raw(range(len(self.fields)))
 
     def __iter__(self) -> Iterator[Row]:
+        if self.cache:
+            for _, row in self._enum_rows(self._cached_records()):
+                yield row
+            return
         if self._file is not None:
             self._file.close()
         fh: IO[str] = tsdb.open(self.dir, self.name,
                                 encoding=self.encoding)
         self._file = fh
 
-        for _, row in self._enum_rows(fh):
+        for _, row in self._enum_rows(map(tsdb.split, fh)):
             yield row
 
     @overload
@@ -492,12 +649,39 @@ class Table(tsdb.Relation):
 
     def _iterslice(self, slice: slice) -> List[Row]:
         """Yield rows from a slice index."""
+        if self.line_index or self.cache:
+            return self._seekslice(slice)
         with tsdb.open(self.dir, self.name, encoding=self.encoding) as fh:
-            rows = [row for _, row in self._enum_rows(fh, slice)]
+            records = map(tsdb.split, fh)
+            rows = [row for _, row in self._enum_rows(records, slice)]
             if slice.step is not None and slice.step < 0:
                 rows = list(reversed(rows))
             return rows
 
+    def _seekslice(self, slice: slice) -> List[Row]:
+        """Get rows from a slice index by seeking to on-disk rows."""
+        return self._rows_at(range(*slice.indices(len(self._rows))))
+
+    def _rows_at(self, indices: Sequence[int]) -> List[Row]:
+        """Get the rows at non-negative *indices* by seeking."""
+        rows = self._rows
+        linenos = [i for i in indices if rows[i] is None]
+        records: Iterator[tsdb.RawRecord]
+        if self.cache:
+            records = map(self._cached_relation().raw_record, linenos)
+        else:
+            records = map(tsdb.split, tsdb.read_lines(
+                self.dir, self.name, linenos, encoding=self.encoding))
+        result: List[Row] = []
+        for i in indices:
+            row = rows[i]
+            if row is None:
+                row = Row(self.fields,
+                          next(records),
+                          field_index=self._field_index)
+            result.append(row)
+        return result
+
     def _getitem(self, index: int) -> Row:
         """Get a single non-slice index."""
         row = self._rows[index]
@@ -505,6 +689,8 @@ class Table(tsdb.Relation):
             # need to handle negative indices manually
             if index < 0:
                 index = len(self._rows) + index
+            if self.line_index or self.cache:
+                return self._seekslice(slice(index, index + 1))[0]
             with tsdb.open(self.dir,
                            self.name,
                            encoding=self.encoding) as lines:
@@ -616,7 +802,13 @@ class Table(tsdb.Relation):
                           values,
                           field_index=self._field_index)
 
-    def select(self, *names: str, cast: bool = True) -> Iterator[tsdb.Record]:
+    def select(
+            self,
+            *names: str,
+            cast: bool = True,
+            where: Optional[Callable[[tsdb.RawRecord], bool]] = None,
+            where_columns: Optional[Iterable[str]] = None,
+    ) -> Iterator[tsdb.Record]:
         """
         Select fields given by *names* from each row in the table.
 
@@ -625,6 +817,12 @@ class Table(tsdb.Relation):
         If *cast* is `False`, simple tuples of raw data are returned
         instead of :class:`Row` objects.
 
+        If *where* is given, only rows for which it returns a true
+        value are selected. It is called with a tuple of the raw
+        values of *where_columns*, or of all columns if
+        *where_columns* is `None`, as with
+        :meth:`tsdb.Database.select_from`.
+
         Yields:
             Row
         Examples:
@@ -640,16 +838,32 @@ class Table(tsdb.Relation):
         indices = tuple(map(self._field_index.__getitem__, names))
         fields = tuple(map(self.fields.__getitem__, indices))
         field_index = tsdb.make_field_index(fields)
-        with tsdb.open(self.dir, self.name, encoding=self.encoding) as fh:
-            for _, row in self._enum_rows(fh):
-                data = tuple(row.data[i] for i in indices)
+        if where_columns is None:
+            where_indices: Sequence[int] = range(len(self.fields))
+        else:
+            where_indices = [self._field_index[name]
+                             for name in where_columns]
+        if self.cache:
+            rows = self._enum_rows(self._cached_records())
+        else:
+            fh = tsdb.open(self.dir, self.name, encoding=self.encoding)
+            rows = self._enum_rows(map(tsdb.split, fh))
+        try:
+            for _, row in rows:
+                if where is not None and not where(
+                        tuple([row._raw_value(i) for i in where_indices])):
+                    continue
+                data = tuple([row._raw_value(i) for i in indices])
                 if cast:
                     yield Row(fields, data, field_index=field_index)
                 else:
                     yield data
+        finally:
+            if not self.cache:
+                fh.close()
 
     def _enum_rows(self,
-                   fh: IO[str],
+                   records: Iterator[tsdb.RawRecord],
                    _slice: Optional[slice] = None
                    ) -> Iterator[Tuple[int, Row]]:
         """Enumerate on-disk and in-memory rows."""
@@ -661,11 +875,11 @@ class Table(tsdb.Relation):
 
         file_exhausted = False
         for i, row in enumerate(self._rows):
-            # always read next line until EOF to keep in sync
+            # always read next record until EOF to keep in sync
             if not file_exhausted:
-                line: Optional[str] = None
+                record: Optional[tsdb.RawRecord] = None
                 try:
-                    line = next(fh)
+                    record = next(records)
                 except StopIteration:
                     file_exhausted = True
             # now skip if it's not a requested index
@@ -673,10 +887,8 @@ class Table(tsdb.Relation):
                 continue
             # proceed only if we have a row in memory or on disk
             if row is None:
-                if line is not None:
-                    row = Row(fields,
-                              tsdb.split(line),
-                              field_index=field_index)
+                if record is not None:
+                    row = Row(fields, record, field_index=field_index)
                 else:
                     continue
             yield (i, row)
@@ -693,17 +905,25 @@ class TestSuite(tsdb.Database):
             to a relations file; if not given, the relations file
             under *path* will be used
         encoding: the character encoding of the files in the test suite
+        line_index: if `True`, tables use persistent line indexes
+            for random access to rows (see :class:`Table`)
+        cache: if `True`, tables read rows from the shared relation
+            cache (see :class:`Table`)
     Attributes:
         schema (dict): database schema as a mapping of table names to
             lists of :class:`Field` objects
         encoding (str): character encoding used when reading and
             writing tables
+        line_index (bool): whether tables use line indexes
+        cache (bool): whether tables read from the relation cache
     """
 
     def __init__(self,
                  path: Optional[util.PathLike] = None,
                  schema: Optional[tsdb.SchemaLike] = None,
-                 encoding: str = 'utf-8') -> None:
+                 encoding: str = 'utf-8',
+                 line_index: bool = False,
+                 cache: bool = False) -> None:
         # Virtual test suites use a temporary directory
         if path is None:
             self._tempdir = tempfile.TemporaryDirectory()
@@ -721,8 +941,14 @@ class TestSuite(tsdb.Database):
                 schema = tsdb.read_schema(schema)
             tsdb.write_schema(path, schema)
 
-        super().__init__(path, autocast=False, encoding=encoding)
+        super().__init__(path, autocast=False, encoding=encoding,
+                         cache=cache)
+        self.line_index = line_index
         self._data: Dict[str, Table] = {}
+        # tables and progress recorded in the checkpoint while processing
+        self._checkpoint_tables: Optional[List[str]] = None
+        self._checkpoint_progress: Optional[
+            Callable[[], Dict[str, Any]]] = None
 
     @property
     def in_transaction(self) -> bool:
@@ -739,13 +965,22 @@ class TestSuite(tsdb.Database):
         # if the table is None it is invalidated; reload it
         if name not in self._data:
             self._data[name] = Table(
-                self.path, name, self.schema[name], self.encoding)
+                self.path,
+                name,
+                self.schema[name],
+                encoding=self.encoding,
+                line_index=self.line_index,
+                cache=self.cache)
         return self._data[name]
 
-    def select_from(self,
-                    name: str,
-                    columns: Optional[Iterable[str]] = None,
-                    cast: bool = True):
+    def select_from(
+            self,
+            name: str,
+            columns: Optional[Iterable[str]] = None,
+            cast: bool = True,
+            where: Optional[Callable[[tsdb.RawRecord], bool]] = None,
+            where_columns: Optional[Iterable[str]] = None,
+    ):
         """
         Select fields given by *names* from each row in table *name*.
 
@@ -754,6 +989,10 @@ class TestSuite(tsdb.Database):
         If *cast* is `False`, simple tuples of raw data are returned
         instead of :class:`Row` objects.
 
+        Rows are filtered by *where* over the raw values of
+        *where_columns* as with :meth:`Table.select`, so uncommitted
+        changes are taken into account.
+
         Yields:
             Row
         Examples:
@@ -768,7 +1007,8 @@ class TestSuite(tsdb.Database):
         """
         if not columns:
             columns = []
-        return self[name].select(*columns, cast=cast)
+        return self[name].select(
+            *columns, cast=cast, where=where, where_columns=where_columns)
 
     def reload(self) -> None:
         """Discard temporary changes and reload the database from disk."""
@@ -809,6 +1049,34 @@ class TestSuite(tsdb.Database):
                     encoding=self.encoding
                 )
             table._sync_with_file()
+        if self._checkpoint_tables is not None:
+            progress = None
+            if self._checkpoint_progress is not None:
+                progress = self._checkpoint_progress()
+            _write_checkpoint(self.path, self._checkpoint_tables,
+                              progress=progress)
+
+    def _restore_progress(self) -> Dict[str, Any]:
+        """
+        Restore the affected tables and the interrupted runs from the
+        checkpoint and return the recorded progress.
+        """
+        progress = _restore_checkpoint(self.path)
+        self.reload()
+        if progress is None:
+            # without a checkpoint, each parse is one processed item
+            count = len(self['parse']) if 'parse' in self.schema else 0
+            return {'items': count, 'keys': None}
+        if progress.get('runs') and 'run' in self.schema:
+            fields = self.schema['run']
+            table = self['run']
+            run_ids = {row['run-id'] for row in table}
+            for line in progress['runs']:
+                record = tsdb.split(line, fields)
+                if record[table.column_index('run-id')] not in run_ids:
+                    table.append(record)
+        return {'items': progress.get('items', 0),
+                'keys': progress.get('keys')}
 
     def processed_items(
             self,
@@ -823,13 +1091,14 @@ class TestSuite(tsdb.Database):
 
     def process(
             self,
-            cpu: interface.Processor,
+            cpu: Union[interface.Processor, Sequence[interface.Processor]],
             selector: Optional[Tuple[str, str]] = None,
             source: Optional[tsdb.Database] = None,
             fieldmapper: Optional[FieldMapper] = None,
             gzip: bool = False,
             buffer_size: int = 1000,
             callback: Optional[Callable[[interface.Response], Any]] = None,
+            resume: bool = False,
     ) -> None:
         """
         Process each item in a [incr tsdb()] test suite.
@@ -840,9 +1109,33 @@ class TestSuite(tsdb.Database):
         The *callback* parameter can be used, for example, to update a
         progress indicator.
 
+        If *cpu* is a sequence of processors, items are sent to
+        whichever processor is idle so they are processed
+        concurrently, but the responses are mapped to rows in the
+        order of the items, so parse identifiers are assigned as if
+        the items were processed one at a time. The runs of each
+        processor are recorded separately: the *n*-th run of the
+        *i*-th of *k* processors gets the run identifier `n * k + i`.
+
+        While items are processed, output rows are only committed
+        after all rows of an item are mapped, and every commit also
+        records the sizes of the affected table files, the number of
+        processed items, the keys of the last one, and the rows of the
+        current runs in a checkpoint file in the test suite directory
+        (see :data:`CHECKPOINT_FILENAME`), which is removed when
+        processing is complete. If processing is interrupted, it can
+        be continued with *resume*: the affected tables are restored
+        to the last checkpoint, so rows of a commit that did not
+        finish are discarded, the `run` rows of the interrupted runs
+        are restored, and then the items after the processed ones are
+        processed. The new rows are appended with parse and run
+        identifiers following the existing ones. Without a checkpoint,
+        each existing `parse` row is taken to be one processed item.
+
         Args:
             cpu (:class:`~delphin.interface.Processor`): processor
-                interface (e.g., :class:`~delphin.ace.ACEParser`)
+                interface (e.g., :class:`~delphin.ace.ACEParser`), or
+                a sequence of processor interfaces for the same task
             selector: a pair of (table_name, column_name) that specify
                 the table and column used for processor input (e.g.,
                 `('item', 'i-input')`)
@@ -858,13 +1151,24 @@ class TestSuite(tsdb.Database):
                 in-memory; if `None`, do not flush to disk
             callback: a function that is called with the response for
                 each item processed; the return value is ignored
+            resume: if `True`, keep the existing rows of the affected
+                tables and skip the items that were already processed
         Examples:
             >>> ts.process(ace_parser)
             >>> ts.process(ace_generator, 'result:mrs', source=ts2)
+            >>> ts.process([ace_parser1, ace_parser2])
         """
+        # processors need not subclass interface.Processor
+        if isinstance(cpu, (list, tuple)):
+            cpus = list(cpu)
+            if not cpus:
+                raise ITSDBError('no processors given')
+        else:
+            cpus = [typing_cast(interface.Processor, cpu)]
         if selector is None:
-            assert isinstance(cpu.task, str)
-            input_table, input_column = _default_task_selectors[cpu.task]
+            task = cpus[0].task
+            assert isinstance(task, str)
+            input_table, input_column = _default_task_selectors[task]
         else:
             input_table, input_column = selector
         if (input_table not in self.schema
@@ -878,40 +1182,275 @@ class TestSuite(tsdb.Database):
             fieldmapper = FieldMapper(source=source)
         index = tsdb.make_field_index(source.schema[input_table])
 
-        affected = set(fieldmapper.affected_tables).intersection(self.schema)
-        for name in affected:
-            self[name].clear()
+        affected = [name for name in self.schema
+                    if name in fieldmapper.affected_tables]
+        progress: Dict[str, Any] = {'items': 0, 'keys': None}
+        run_offset = 0
+        if resume:
+            progress.update(self._restore_progress())
+            last_parse_id, run_offset = _processed_parses(self)
+            fieldmapper._parse_id = max(fieldmapper._parse_id, last_parse_id)
+        else:
+            for name in affected:
+                self[name].clear()
+
+        def get_progress() -> Dict[str, Any]:
+            runs = []
+            if 'run' in self.schema:
+                fields = self.schema['run']
+                runs = [tsdb.join(tsdb.make_record(d, fields), fields)
+                        for d in fieldmapper._run_rows()]
+            return dict(progress, runs=runs)
+
+        self._checkpoint_tables = affected
+        self._checkpoint_progress = get_progress
+        if not resume:
+            # the cleared tables are empty until the first commit
+            _write_checkpoint(self.path, affected, empty=True,
+                              progress=get_progress())
+        elif not self.path.joinpath(CHECKPOINT_FILENAME).is_file():
+            _write_checkpoint(self.path, affected, progress=get_progress())
 
         key_names = [f.name for f in source.schema[input_table] if f.is_key]
+        # the input column holds the strings given to the processors
+        items: Iterable[Tuple[str, Dict[str, Any]]] = (
+            (typing_cast(str, row[index[input_column]]),
+             {name: row[index[name]] for name in key_names})
+            for row in source[input_table])
+        if progress['items']:
+            items = _skip_items(items, progress['items'], progress['keys'])
+
+        indexed_responses: Iterable[Tuple[int, interface.Response]]
+        if len(cpus) == 1:
+            indexed_responses = (
+                (0, cpus[0].process_item(datum, keys=keys))
+                for datum, keys in items)
+        else:
+            indexed_responses = _process_concurrently(cpus, items)
+        responses: Iterable[interface.Response]
+        if len(cpus) > 1 or run_offset:
+            responses = _renumber_runs(
+                indexed_responses, len(cpus), run_offset)
+        else:
+            responses = (response for _, response in indexed_responses)
 
-        for row in source[input_table]:
-            datum = row[index[input_column]]
-            keys = [row[index[name]] for name in key_names]
-            keys_dict = dict(zip(key_names, keys))
-            response = cpu.process_item(datum, keys=keys_dict)
+        try:
+            for response in responses:
+                keys = response.get('keys', {})
+                logger.info(
+                    'Processed item {:>16}  {:>8} results'
+                    .format(
+                        tsdb.join(list(keys.values())),
+                        len(response['results']))
+                )
+                if callback:
+                    callback(response)
+
+                for tablename, data in fieldmapper.map(response):
+                    _add_row(self, tablename, data)
+                progress['items'] += 1
+                progress['keys'] = _format_keys(keys)
+                # only commit complete items so they can be resumed
+                _commit_if_full(self, buffer_size)
+
+            for tablename, data in fieldmapper.cleanup():
+                _add_row(self, tablename, data)
+
+            self.commit()
+        finally:
+            self._checkpoint_tables = None
+            self._checkpoint_progress = None
+        self.path.joinpath(CHECKPOINT_FILENAME).unlink()
+        tsdb.write_database(self, self.path, gzip=gzip)
 
-            logger.info(
-                'Processed item {:>16}  {:>8} results'
-                .format(tsdb.join(keys), len(response['results']))
-            )
-            if callback:
-                callback(response)
 
-            for tablename, data in fieldmapper.map(response):
-                _add_row(self, tablename, data, buffer_size)
+def _process_concurrently(
+        cpus: Sequence[interface.Processor],
+        items: Iterable[Tuple[str, Dict[str, Any]]]
+) -> Iterator[Tuple[int, interface.Response]]:
+    """
+    Process *items* with whichever of *cpus* is idle and yield the
+    index of the processor with each response in the order of the
+    items.
 
-        for tablename, data in fieldmapper.cleanup():
-            _add_row(self, tablename, data, buffer_size)
+    Each processor is used by one thread at a time.
+    """
+    num_cpus = len(cpus)
+    idle: queue.Queue = queue.Queue()
+    for i in range(num_cpus):
+        idle.put(i)
 
-        tsdb.write_database(self, self.path, gzip=gzip)
+    def process_item(datum: str, keys: Dict[str, Any]):
+        i = idle.get()
+        try:
+            return i, cpus[i].process_item(datum, keys=keys)
+        finally:
+            idle.put(i)
+
+    # only read ahead enough items to keep every processor busy
+    pending: collections.deque[Future] = collections.deque()
+    executor = ThreadPoolExecutor(max_workers=num_cpus)
+    try:
+        for datum, keys in items:
+            pending.append(executor.submit(process_item, datum, keys))
+            if len(pending) >= 2 * num_cpus:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def _renumber_runs(
+        indexed_responses: Iterable[Tuple[int, interface.Response]],
+        num_cpus: int,
+        offset: int
+) -> Iterator[interface.Response]:
+    """
+    Yield the responses of *num_cpus* processors with the run
+    identifier `offset + n * num_cpus + i` for the *n*-th run of the
+    *i*-th processor.
+    """
+    # maps (processor, run-id) to the processor's run and its copy
+    runs: Dict[Tuple[int, Any], Tuple[Dict, Dict]] = {}
+    for i, response in indexed_responses:
+        run = response.get('run')
+        if run is not None:
+            run_id = run.get('run-id', 0)
+            key = (i, run_id)
+            if key not in runs:
+                runs[key] = (run, {})
+            copy = runs[key][1]
+            copy.update(run)
+            copy['run-id'] = offset + run_id * num_cpus + i
+            response['run'] = copy
+        yield response
+
+    if num_cpus > 1:
+        # the runs overlap, so none of them ended before the last item
+        now = datetime.now()
+        for run, copy in runs.values():
+            copy['end'] = run.get('end', now)
+
+
+def _processed_parses(ts: TestSuite) -> Tuple[int, int]:
+    """
+    Return the last parse identifier in *ts* and the next free run
+    identifier.
+    """
+    last_parse_id = -1
+    last_run_id = -1
+    if 'parse' in ts.schema:
+        names = [name for name in ('parse-id', 'run-id')
+                 if any(f.name == name for f in ts.schema['parse'])]
+        # one pass over the parses for both identifiers
+        for row in ts['parse'].select(*names):
+            values = dict(zip(names, row))
+            parse_id = values.get('parse-id')
+            if isinstance(parse_id, int):
+                last_parse_id = max(last_parse_id, parse_id)
+            run_id = values.get('run-id')
+            if isinstance(run_id, int):
+                last_run_id = max(last_run_id, run_id)
+    if 'run' in ts.schema:
+        for (run_id,) in ts['run'].select('run-id'):
+            if isinstance(run_id, int):
+                last_run_id = max(last_run_id, run_id)
+    return last_parse_id, last_run_id + 1
+
+
+def _format_keys(keys: Dict[str, Any]) -> Dict[str, str]:
+    """Return the item *keys* as strings for the checkpoint."""
+    return {name: str(value) for name, value in keys.items()}
+
+
+def _skip_items(
+        items: Iterable[Tuple[str, Dict[str, Any]]],
+        count: int,
+        keys: Optional[Dict[str, str]]
+) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """
+    Skip the first *count* of *items* and yield the rest.
+
+    If *keys* is given, they must be the keys of the last skipped
+    item, otherwise the inputs do not match the checkpoint.
+    """
+    items = iter(items)
+    skipped = 0
+    last = None
+    for item in itertools.islice(items, count):
+        last = item
+        skipped += 1
+    if (skipped < count
+            or (keys is not None
+                and last is not None
+                and _format_keys(last[1]) != keys)):
+        raise ITSDBError('the processed items do not match the inputs; '
+                         'process the test suite without resuming')
+    yield from items
+
+
+def _write_checkpoint(path: Path,
+                      names: Iterable[str],
+                      empty: bool = False,
+                      progress: Optional[Dict[str, Any]] = None) -> None:
+    """
+    Record the file name and size of each relation *names* in the
+    checkpoint file of the test suite at *path*, or record them as
+    empty if *empty* is `True`, along with the processing *progress*.
+    """
+    relations = {}
+    for name in names:
+        if empty:
+            relations[name] = [name, 0]
+            continue
+        try:
+            relpath = tsdb.get_path(path, name)
+        except tsdb.TSDBError:
+            relations[name] = [name, 0]
+        else:
+            relations[name] = [relpath.name, relpath.stat().st_size]
+    checkpoint = path.joinpath(CHECKPOINT_FILENAME)
+    tmp = checkpoint.with_name(checkpoint.name + '.tmp')
+    data = dict(progress or {}, relations=relations)
+    tmp.write_text(json.dumps(data), encoding='utf-8')
+    os.replace(tmp, checkpoint)
+
+
+def _restore_checkpoint(path: Path) -> Optional[Dict[str, Any]]:
+    """
+    Truncate the relations of the test suite at *path* to the sizes
+    in its checkpoint file, if any, and return the checkpoint data.
+
+    Rows written after the checkpoint are thereby removed, including
+    partially written rows.
+    """
+    checkpoint = path.joinpath(CHECKPOINT_FILENAME)
+    try:
+        data = json.loads(checkpoint.read_text(encoding='utf-8'))
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as exc:
+        raise ITSDBError(f'invalid checkpoint file: {checkpoint}') from exc
+    for name, (filename, size) in data.get('relations', {}).items():
+        for relpath in (path.joinpath(name), path.joinpath(name + '.gz')):
+            if not relpath.is_file():
+                continue
+            if relpath.name == filename and size > 0:
+                if relpath.stat().st_size > size:
+                    os.truncate(relpath, size)
+            else:
+                relpath.unlink()
+        if size == 0:
+            path.joinpath(name).touch()
+    return data
 
 
 def _add_row(ts: TestSuite,
              name: str,
-             data: Dict,
-             buffer_size: int) -> None:
+             data: Dict) -> None:
     """
-    Prepare and append a Row into its Table; flush to disk if necessary.
+    Prepare and append a Row into its Table.
     """
     fields = ts.schema[name]
     # remove any keys that aren't relation fields
@@ -920,6 +1459,13 @@ def _add_row(ts: TestSuite,
 
     ts[name].append(tsdb.make_record(data, fields))
 
+
+def _commit_if_full(ts: TestSuite, buffer_size: Optional[int]) -> None:
+    """
+    Flush the new rows to disk if there are more than *buffer_size*.
+    """
+    if buffer_size is None:
+        return
     num_changes = 0
     for _name in ts:
         table = ts[_name]
@@ -938,7 +1484,8 @@ _Matched = Tuple[List[Row], List[Row]]
 def match_rows(rows1: Rows,
                rows2: Rows,
                key: Union[str, int],
-               sort_keys: bool = True) -> Iterator[Match]:
+               sort_keys: bool = True,
+               stream: bool = False) -> Iterator[Match]:
     """
     Yield triples of `(value, left_rows, right_rows)` where
     `left_rows` and `right_rows` are lists of rows that share the same
@@ -947,9 +1494,17 @@ def match_rows(rows1: Rows,
 
     .. warning::
 
-       Both *rows1* and *rows2* will exist in memory for this
-       operation, so it is not recommended for very large tables on
-       low-memory systems.
+       Unless *stream* is `True`, both *rows1* and *rows2* will exist
+       in memory for this operation, so it is not recommended for
+       very large tables on low-memory systems.
+
+    If *stream* is `True`, the rows are instead sorted by *key* and
+    merged as they are read, so only the rows sharing one value are
+    in memory at a time. A :class:`Table` whose rows are already
+    ordered by *key* is read directly, a list is sorted in memory,
+    and other rows are sorted in runs that are spilled to temporary
+    files. Streamed matches are always sorted by the matched key, as
+    with *sort_keys*.
 
     Args:
         rows1: a :class:`Table` or list of :class:`Row` objects
@@ -957,11 +1512,16 @@ def match_rows(rows1: Rows,
         key (str, int): the column name or index on which to match
         sort_keys (bool): if `True`, yield matching rows sorted by the
             matched key instead of the original order
+        stream (bool): if `True`, sort and merge the rows in bounded
+            memory
     Yields:
         tuple: a triple containing the matched value for *key*, the
             list of any matching rows from *rows1*, and the list of
             any matching rows from *rows2*
     """
+    if stream:
+        yield from _merge_matches(rows1, rows2, key)
+        return
     matched: Dict[tsdb.Value, _Matched] = collections.OrderedDict()
     for i, rows in enumerate([rows1, rows2]):
         for row in rows:
@@ -978,3 +1538,116 @@ def match_rows(rows1: Rows,
     for val in vals:
         left, right = matched[val]
         yield (val, left, right)
+
+
+# number of rows sorted in memory before they are spilled to disk
+_MATCH_RUN_SIZE = 100000
+
+# entries sorted for matching: (sort key, value, side, row)
+_MatchKey = Tuple[Any, str]
+_MatchEntry = Tuple[_MatchKey, tsdb.Value, int, Row]
+
+
+def _merge_matches(rows1: Rows,
+                   rows2: Rows,
+                   key: Union[str, int]) -> Iterator[Match]:
+    """Yield matches from rows sorted and merged by *key*."""
+    entries = heapq.merge(_sorted_entries(rows1, key, 0),
+                          _sorted_entries(rows2, key, 1),
+                          key=lambda entry: entry[0])
+    # group by the sort key so equal values are always adjacent
+    for _, group in itertools.groupby(entries, key=lambda e: e[0]):
+        matched: _Matched = ([], [])
+        for entry in group:
+            matched[entry[2]].append(entry[3])
+        # all entries of the group have the same value
+        yield (entry[1], matched[0], matched[1])
+
+
+def _sorted_entries(rows: Rows,
+                    key: Union[str, int],
+                    side: int) -> Iterator[_MatchEntry]:
+    """Yield the match entries for *rows* sorted by *key*."""
+    entries = ((_match_key(row[key]), row[key], side, row)
+               for row in rows)
+    if isinstance(rows, Table) and _is_key_ordered(rows, key):
+        yield from entries
+    elif isinstance(rows, list):
+        yield from sorted(entries, key=lambda entry: entry[0])
+    else:
+        yield from _external_sort(entries)
+
+
+def _match_key(val: tsdb.Value) -> _MatchKey:
+    """
+    Return the sort key of the matched value *val*.
+
+    Values are ordered numerically like with *sort_keys*, and values
+    that are numerically equal but distinct (e.g., `'1'` and `'01'`)
+    are ordered by their string forms so they are not interleaved.
+    """
+    return (util.safe_int(val), str(val))
+
+
+def _is_key_ordered(table: Table, key: Union[str, int]) -> bool:
+    """Return `True` if the rows of *table* are ordered by *key*."""
+    if isinstance(key, int):
+        key = table.fields[key].name
+    values = (_match_key(row[0]) for row in table.select(key))
+    previous = next(values, None)
+    if previous is None:  # no rows
+        return True
+    try:
+        for value in values:
+            if value < previous:
+                return False
+            previous = value
+    except TypeError:  # values cannot be compared
+        return False
+    return True
+
+
+def _external_sort(entries: Iterable[_MatchEntry]) -> Iterator[_MatchEntry]:
+    """Sort *entries* in runs spilled to temporary files."""
+    # rows keep their (shared) fields in memory and only their
+    # values are written to the run files
+    formats: Dict[int, Tuple[tsdb.Fields, tsdb.FieldIndex]] = {}
+    with tempfile.TemporaryDirectory() as dir:
+        paths: List[Path] = []
+        while True:
+            run = list(itertools.islice(entries, _MATCH_RUN_SIZE))
+            if not run:
+                break
+            run.sort(key=lambda entry: entry[0])
+            path = Path(dir, str(len(paths)))
+            with path.open('wb') as fh:
+                record: Tuple[_MatchKey, tsdb.Value, int,
+                              Optional[int], tsdb.Record]
+                for sort_key, val, side, row in run:
+                    if isinstance(row, Row):
+                        formats.setdefault(
+                            id(row.fields), (row.fields, row._field_index))
+                        record = (sort_key, val, side,
+                                  id(row.fields), row.data)
+                    else:
+                        record = (sort_key, val, side, None, row)
+                    pickle.dump(record, fh, pickle.HIGHEST_PROTOCOL)
+            paths.append(path)
+        runs = [_read_run(path, formats) for path in paths]
+        yield from heapq.merge(*runs, key=lambda entry: entry[0])
+
+
+def _read_run(path: Path,
+              formats: Dict[int, Tuple[tsdb.Fields, tsdb.FieldIndex]]
+              ) -> Iterator[_MatchEntry]:
+    """Yield the entries of a sorted run spilled by _external_sort()."""
+    with path.open('rb') as fh:
+        while True:
+            try:
+                sort_key, val, side, fmt, row = pickle.load(fh)
+            except EOFError:
+                break
+            if fmt is not None:
+                fields, field_index = formats[fmt]
+                row = Row(fields, row, field_index=field_index)
+            yield (sort_key, val, side, row)
@@ -2,19 +2,33 @@
 Test Suite Database (TSDB) Primitives
 """
 
+import bisect
+import codecs
+import functools
+import glob
+import hashlib
+import itertools
+import json
+import mmap
+import os
 import re
 import shutil
+import struct
+import sys
 import tempfile
+import threading
 import warnings
+import zlib
+from abc import ABC, abstractmethod
+from array import array
 from collections import OrderedDict
 from datetime import date, datetime
-from gzip import (
-    GzipFile,
-    open as gzopen,
-)
+from gzip import open as gzopen
 from pathlib import Path
 from typing import (
     IO,
+    Any,
+    Callable,
     Dict,
     Generator,
     Iterable,
@@ -25,8 +39,9 @@ from typing import (
     Sequence,
     Set,
     Tuple,
+    TypeVar,
     Union,
-    cast as typing_cast,
+    overload,
 )
 
 from delphin import util
@@ -40,6 +55,10 @@ from delphin.exceptions import PyDelphinException, PyDelphinWarning
 
 SCHEMA_FILENAME = 'relations'
 FIELD_DELIMITER = '@'
+LINE_INDEX_SUFFIX = '.idx'
+KEY_INDEX_SUFFIX = '.kdx'
+TRIGRAM_INDEX_SUFFIX = '.tgx'
+STATISTICS_FILENAME = 'statistics.json'
 TSDB_CORE_FILES = [
     "item",
     "analysis",
@@ -79,6 +98,7 @@ RawRecord = Sequence[RawValue]
 Value = Union[str, int, float, datetime, date, None]
 Record = Sequence[Value]
 Records = Iterable[Record]
+_T = TypeVar('_T')
 ColumnMap = Dict[str, Value]  # e.g., a partial Record
 
 
@@ -155,6 +175,9 @@ class Field:
                 and self.datatype == other.datatype
                 and self.flags == other.flags)
 
+    def __hash__(self):
+        return hash((self.name, self.datatype, self.flags))
+
 
 Fields = Sequence[Field]
 FieldIndex = Dict[str, int]
@@ -273,9 +296,12 @@ class Relation(Records):
         self.name = name
         self.fields = fields
         self.encoding = encoding
-        self._generator = (split(line, fields=fields)
-                           for line in open(self.dir, name,
-                                            encoding=self.encoding))
+        lines = open(self.dir, name, encoding=self.encoding)
+        if fields:
+            decode = get_codec(fields).decode
+            self._generator = (decode(_split_raw(line)) for line in lines)
+        else:
+            self._generator = (split(line) for line in lines)
 
     def __next__(self) -> Record:
         return next(self._generator)
@@ -301,11 +327,31 @@ class Database:
        using an idiom like :func:`contextlib.closing` ensures that the
        file descriptor gets closed.
 
+    If *cache* is `True`, the data of each relation is decoded once
+    when it is first read by :meth:`select_from` (and thus by
+    :mod:`delphin.tsql` queries) and kept in memory in a compact
+    columnar form: `:integer` and `:float` columns as arrays of
+    numbers and other columns as a single string buffer with
+    offsets. Later reads of the relation use the decoded data
+    directly instead of splitting and casting each line again. The
+    decoded relations are kept in a cache shared by all databases in
+    the process (see `Relation Caches`_), so other databases with the
+    same directory use them as well. A cached relation is decoded
+    again if the size or modification time of its file changes.
+
+    TSQL queries (see :mod:`delphin.tsql`) use existing key indexes
+    (see :func:`get_key_index`) to read only the records matching
+    conditions on key columns or joined with a few other records. If
+    *key_indexes* is `True`, missing key indexes are built when a
+    query could use them.
+
     Args:
         path: path to the database directory
         autocast: if `True`, automatically cast column values to their
             datatypes
         encoding: character encoding of the database files
+        cache: if `True`, cache decoded relation data in memory
+        key_indexes: if `True`, build key indexes for queries
     Example:
         >>> db = tsdb.Database('my-profile')
         >>> items = db['item']
@@ -316,11 +362,15 @@ class Database:
         autocast: Whether to automatically cast column values to their
             datatypes.
         encoding: The character encoding of database files.
+        cache: Whether decoded relation data is cached.
+        key_indexes: Whether key indexes are built for queries.
     """
     def __init__(self,
                  path: util.PathLike,
                  autocast: bool = False,
-                 encoding: str = 'utf-8') -> None:
+                 encoding: str = 'utf-8',
+                 cache: bool = False,
+                 key_indexes: bool = False) -> None:
         path = Path(path).expanduser()
         if not is_database_directory(path):
             raise TSDBError(f'not a valid TSDB database: {path!s}')
@@ -328,6 +378,8 @@ class Database:
         self.schema = read_schema(path)
         self.autocast = autocast
         self.encoding = encoding
+        self.cache = cache
+        self.key_indexes = key_indexes
 
     @property
     def path(self) -> Path:
@@ -348,46 +400,534 @@ class Database:
     def __len__(self):
         return len(self.schema)
 
-    def select_from(self, name: str,
-                    columns: Optional[Iterable[str]] = None,
-                    cast: bool = False) -> Generator[Record, None, None]:
+    def select_from(
+            self,
+            name: str,
+            columns: Optional[Iterable[str]] = None,
+            cast: bool = False,
+            where: Optional[Callable[[RawRecord], bool]] = None,
+            where_columns: Optional[Iterable[str]] = None,
+    ) -> Generator[Record, None, None]:
         """
         Yield values for *columns* from relation *name*.
+
+        If *where* is given, it is a predicate function that is called
+        with a tuple of the raw (uncast) values of *where_columns*, or
+        of all columns if *where_columns* is `None`, for each record,
+        and only records for which it returns a true value are
+        yielded. The predicate is evaluated as the relation is
+        scanned, so records that do not match are never cast.
+
+        Args:
+            name: name of the relation to select from
+            columns: names of the columns to select; if `None`, all
+                columns are selected
+            cast: if `True`, cast the values to their datatypes
+            where: function for filtering records by their raw values
+            where_columns: names of the columns whose raw values are
+                given to *where*
+        Example:
+            >>> list(db.select_from(
+            ...     'item', ['i-input'],
+            ...     where=lambda values: values[0] == '1',
+            ...     where_columns=['i-wf']))
+            [('It rained.',), ('It snowed.',)]
         """
         fields = self.schema[name]
-        if columns is None:
-            columns = [f.name for f in fields]
-        index = make_field_index(fields)
-        indices = [index[column] for column in columns]
-        records = self[name]
-        for record in records:
-            if cast and not self.autocast:
-                record = typing_cast(RawRecord, record)
-                # _cast is a copy of the function cast()
-                data = tuple(_cast(fields[idx].datatype, record[idx])
-                             for idx in indices)
+        indices = _field_indices(fields, columns)
+        where_indices = _field_indices(fields, where_columns)
+        cast = cast or self.autocast
+        if self.cache:
+            relation = self._get_columns(name)
+            if cast:
+                records = relation.select(indices)
+                yield from relation.filter(records, where, where_indices)
             else:
-                data = tuple(record[idx] for idx in indices)
-            yield data
-        records.close()
+                raw_records = relation.select_raw(indices)
+                yield from relation.filter(
+                    raw_records, where, where_indices)
+            return
+        raw_records = self._scan(name, indices, where, where_indices)
+        if cast:
+            codec = get_codec([fields[idx] for idx in indices])
+            yield from map(codec.cast, raw_records)
+        else:
+            yield from raw_records
 
     def _select_raw(
             self,
             name: str,
-            columns: Optional[Iterable[str]] = None
+            columns: Optional[Iterable[str]] = None,
+            where: Optional[Callable[[RawRecord], bool]] = None,
+            where_columns: Optional[Iterable[str]] = None,
+            linenos: Optional[Sequence[int]] = None,
     ) -> Generator[RawRecord, None, None]:
+        # *linenos* are the sorted line numbers of the only records
+        # that may be selected; records at other lines must not
+        # match *where*, so they are ignored when it is cheaper to
+        # check every record
         if name not in self.schema:
             raise TSDBError(f'relation not defined in schema: {name}')
         fields = self.schema[name]
-        if columns is None:
-            indices = list(range(len(fields)))
+        indices = _field_indices(fields, columns)
+        where_indices = _field_indices(fields, where_columns)
+        if self.cache:
+            relation = self._get_columns(name)
+            yield from relation.filter(
+                relation.select_raw(indices), where, where_indices)
+        else:
+            yield from self._scan(
+                name, indices, where, where_indices, linenos)
+
+    def _scan(
+            self,
+            name: str,
+            indices: Sequence[int],
+            where: Optional[Callable[[RawRecord], bool]],
+            where_indices: Sequence[int],
+            linenos: Optional[Sequence[int]] = None,
+    ) -> Iterator[RawRecord]:
+        """
+        Yield the raw values at *indices* of the records of relation
+        *name* that match *where*, reading only the lines at
+        *linenos* if given.
+        """
+        fields = self.schema[name]
+        num_selected = len(indices)
+        if where is not None:
+            # decode the columns for the predicate along with the
+            # selected ones and separate them again below
+            indices = list(indices) + list(where_indices)
+        path = get_path(self._path, name)
+        if linenos is not None:
+            records = _select_linenos(
+                self._path, name, linenos, indices, len(fields),
+                self.encoding)
+        elif _use_mapped_select(path, indices, fields, self.encoding):
+            records = _select_mapped(
+                path, indices, len(fields), self.encoding)
+        else:
+            records = _select_lines(
+                self._path, name, indices, len(fields), self.encoding)
+        if where is None:
+            yield from records
         else:
-            index = make_field_index(fields)
-            indices = [index[column] for column in columns]
-        with open(self._path, name, encoding=self.encoding) as file:
-            for line in file:
-                record = typing_cast(RawRecord, split(line, fields=None))
-                yield tuple(record[idx] for idx in indices)
+            for record in records:
+                if where(record[num_selected:]):
+                    yield record[:num_selected]
+
+    def _get_columns(self, name: str) -> '_ColumnarRelation':
+        """Return the cached data for relation *name*, decoding if needed."""
+        return _read_columns(
+            self._path, name, self.schema[name], self.encoding)
+
+
+def _field_indices(fields: Fields,
+                   columns: Optional[Iterable[str]]) -> List[int]:
+    """Return the indices of *columns* in *fields*, or all indices."""
+    if columns is None:
+        return list(range(len(fields)))
+    index = make_field_index(fields)
+    return [index[column] for column in columns]
+
+
+def _select_lines(dir: Path,
+                  name: str,
+                  indices: Sequence[int],
+                  num_fields: int,
+                  encoding: str) -> Iterator[RawRecord]:
+    """Yield the raw values at *indices* of each line of relation *name*."""
+    with open(dir, name, encoding=encoding) as file:
+        for line in file:
+            record = _split_raw(line)
+            if len(record) != num_fields:
+                _mismatched_counts(record, range(num_fields))
+            yield tuple([record[idx] for idx in indices])
+
+
+def _select_linenos(dir: Path,
+                    name: str,
+                    linenos: Sequence[int],
+                    indices: Sequence[int],
+                    num_fields: int,
+                    encoding: str) -> Iterator[RawRecord]:
+    """Yield the raw values at *indices* of lines *linenos*."""
+    for line in read_lines(dir, name, linenos, encoding=encoding):
+        record = _split_raw(line)
+        if len(record) != num_fields:
+            _mismatched_counts(record, range(num_fields))
+        yield tuple([record[idx] for idx in indices])
+
+
+def _can_map(path: Path, encoding: str) -> bool:
+    """Return `True` if *path* can be read by :func:`_select_mapped`."""
+    # only plain text files can be mapped, and only encodings where
+    # the delimiter, escape, and newline bytes cannot occur within
+    # other characters can be split before decoding
+    if path.suffix.lower() == '.gz':
+        return False
+    try:
+        name = codecs.lookup(encoding).name
+    except LookupError:
+        return False
+    return (name in ('utf-8', 'ascii')
+            or name.startswith(('iso8859-', 'cp125')))
+
+
+def _use_mapped_select(path: Path,
+                       indices: Sequence[int],
+                       fields: Fields,
+                       encoding: str) -> bool:
+    """Return `True` if *path* should be read by :func:`_select_mapped`."""
+    # decoding every column separately is only worth it when some
+    # columns are skipped
+    return (len(set(indices)) < len(fields)
+            and _can_map(path, encoding))
+
+
+def _select_mapped(path: Path,
+                   indices: Sequence[int],
+                   num_fields: int,
+                   encoding: str) -> Iterator[RawRecord]:
+    """
+    Yield the raw values at *indices* for each line of the file *path*.
+
+    The file is memory-mapped and each line is only split as far as
+    the last requested column. Only the requested columns are decoded
+    and unescaped, so large unrequested columns cost little more than
+    finding the line's end. The file must be readable as described by
+    :func:`_can_map`.
+    """
+    if not indices:
+        with path.open('rb') as fh:
+            for _ in fh:
+                yield ()
+        return
+    if path.stat().st_size == 0:
+        return
+    maxsplit = max(indices) + 1
+    delimiter = FIELD_DELIMITER.encode(encoding)
+    with path.open('rb') as fh, \
+            mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        size = len(mm)
+        find = mm.find
+        pos = 0
+        while pos < size:
+            end = find(b'\n', pos)
+            if end == -1:
+                end = size
+            line = mm[pos:end]
+            num_columns = line.count(delimiter) + 1
+            if num_columns != num_fields:
+                raise TSDBError(
+                    f'number of columns ({num_columns}) != number of '
+                    f'fields ({num_fields}) in {path!s}')
+            parts = line.split(delimiter, maxsplit)
+            yield tuple([
+                (unescape(part.decode(encoding)) if b'\\' in part
+                 else part.decode(encoding)) if part else None
+                for part in [parts[idx] for idx in indices]
+            ])
+            pos = end + 1
+
+
+class _Column(ABC):
+    """A compactly stored column of relation data."""
+
+    __slots__ = 'datatype', 'nulls'
+
+    def __init__(self, datatype: str, nulls: Optional[bytearray]) -> None:
+        self.datatype = datatype
+        self.nulls = nulls  # None if there are no null values
+
+    @abstractmethod
+    def raw_values(self) -> Iterator[RawValue]:
+        """Yield the raw value of each row."""
+
+    @abstractmethod
+    def raw_value(self, index: int) -> RawValue:
+        """Return the raw value of the row at *index*."""
+
+    @abstractmethod
+    def values(self) -> Iterator[Value]:
+        """Yield the cast value of each row."""
+
+
+class _NumericColumn(_Column):
+    """A column of `:integer` or `:float` values stored as an array."""
+
+    __slots__ = 'data',
+
+    def __init__(self,
+                 datatype: str,
+                 nulls: Optional[bytearray],
+                 data: array) -> None:
+        super().__init__(datatype, nulls)
+        self.data = data
+
+    @classmethod
+    def make(cls,
+             datatype: str,
+             nulls: Optional[bytearray],
+             raw_values: Sequence[RawValue]) -> Optional['_NumericColumn']:
+        """
+        Return a column for *raw_values*, or `None` if they cannot be
+        reproduced from their numeric values (e.g., `'007'`).
+        """
+        typecode: str
+        convert: Callable[[str], Any]
+        unconvert: Callable[[Any], str]
+        if datatype == ':integer':
+            typecode, convert, unconvert = 'q', int, str
+        else:
+            typecode, convert, unconvert = 'd', float, repr
+        data: 'array[Any]' = array(typecode)
+        append = data.append
+        try:
+            for raw in raw_values:
+                if raw is None:
+                    append(0)
+                    continue
+                value = convert(raw)
+                if unconvert(value) != raw:
+                    return None
+                append(value)
+        except (ValueError, OverflowError):
+            return None
+        return cls(datatype, nulls, data)
+
+    def raw_values(self) -> Iterator[RawValue]:
+        unconvert = str if self.datatype == ':integer' else repr
+        if self.nulls is None:
+            return map(unconvert, self.data)
+        return (None if null else unconvert(value)
+                for value, null in zip(self.data, self.nulls))
+
+    def raw_value(self, index: int) -> RawValue:
+        if self.nulls is not None and self.nulls[index]:
+            return None
+        value = self.data[index]
+        return str(value) if self.datatype == ':integer' else repr(value)
+
+    def values(self) -> Iterator[Value]:
+        if self.nulls is None:
+            return iter(self.data)
+        return (None if null else value
+                for value, null in zip(self.data, self.nulls))
+
+
+class _StringColumn(_Column):
+    """A column of values stored in a string buffer with offsets."""
+
+    __slots__ = 'buffer', 'offsets'
+
+    def __init__(self,
+                 datatype: str,
+                 nulls: Optional[bytearray],
+                 raw_values: Sequence[RawValue]) -> None:
+        super().__init__(datatype, nulls)
+        offsets = array('Q', [0])
+        append = offsets.append
+        pos = 0
+        for raw in raw_values:
+            if raw is not None:
+                pos += len(raw)
+            append(pos)
+        self.buffer = ''.join(raw for raw in raw_values if raw is not None)
+        self.offsets = offsets
+
+    def raw_values(self) -> Iterator[RawValue]:
+        buffer = self.buffer
+        offsets = self.offsets
+        ends = iter(offsets)
+        next(ends)
+        if self.nulls is None:
+            return (buffer[start:end] for start, end in zip(offsets, ends))
+        return (None if null else buffer[start:end]
+                for start, end, null in zip(offsets, ends, self.nulls))
+
+    def raw_value(self, index: int) -> RawValue:
+        if self.nulls is not None and self.nulls[index]:
+            return None
+        return self.buffer[self.offsets[index]:self.offsets[index + 1]]
+
+    def values(self) -> Iterator[Value]:
+        if self.datatype == ':string':
+            return self.raw_values()
+        datatype = self.datatype
+        return (_cast(datatype, raw) for raw in self.raw_values())
+
+
+class _ColumnarRelation:
+    """The decoded data of a relation stored as columns."""
+
+    __slots__ = 'count', 'columns', 'fingerprint'
+
+    def __init__(self, count: int, columns: List[_Column]) -> None:
+        self.count = count
+        self.columns = columns
+        self.fingerprint: Tuple[int, int] = (0, 0)
+
+    @property
+    def nbytes(self) -> int:
+        """The approximate memory size of the decoded data."""
+        total = 0
+        for column in self.columns:
+            if column.nulls is not None:
+                total += len(column.nulls)
+            if isinstance(column, _NumericColumn):
+                total += column.data.itemsize * len(column.data)
+            elif isinstance(column, _StringColumn):
+                total += sys.getsizeof(column.buffer)
+                total += column.offsets.itemsize * len(column.offsets)
+        return total
+
+    @classmethod
+    def read(cls,
+             dir: util.PathLike,
+             name: str,
+             fields: Fields,
+             encoding: str) -> '_ColumnarRelation':
+        with open(dir, name, encoding=encoding) as lines:
+            records = [split(line) for line in lines]
+        for record in records:
+            if len(record) != len(fields):
+                _mismatched_counts(record, fields)
+        raw_columns: List[Sequence[RawValue]]
+        if records:
+            raw_columns = list(zip(*records))  # type: ignore
+        else:
+            raw_columns = [()] * len(fields)
+        del records
+        columns: List[_Column] = []
+        for field, raw_values in zip(fields, raw_columns):
+            nulls: Optional[bytearray] = bytearray(
+                raw is None for raw in raw_values)
+            if not any(nulls):  # type: ignore
+                nulls = None
+            column: Optional[_Column] = None
+            if field.datatype in (':integer', ':float'):
+                column = _NumericColumn.make(field.datatype, nulls, raw_values)
+            if column is None:
+                column = _StringColumn(field.datatype, nulls, raw_values)
+            columns.append(column)
+        return cls(len(raw_columns[0]) if raw_columns else 0, columns)
+
+    def select(self, indices: Sequence[int]) -> Iterator[Record]:
+        """Yield the cast values at *indices* of each record."""
+        if not indices:
+            return (() for _ in range(self.count))
+        columns = [self.columns[idx] for idx in indices]
+        return zip(*(column.values() for column in columns))
+
+    def select_raw(self, indices: Sequence[int]) -> Iterator[RawRecord]:
+        """Yield the raw values at *indices* of each record."""
+        if not indices:
+            return (() for _ in range(self.count))
+        columns = [self.columns[idx] for idx in indices]
+        return zip(*(column.raw_values() for column in columns))
+
+    def filter(self,
+               records: Iterator[_T],
+               where: Optional[Callable[[RawRecord], bool]],
+               where_indices: Sequence[int]) -> Iterator[_T]:
+        """
+        Yield the *records* selected from the relation whose raw
+        values at *where_indices* match *where*.
+        """
+        if where is None:
+            return records
+        matches = map(where, self.select_raw(where_indices))
+        return itertools.compress(records, matches)
+
+    def raw_record(self, index: int) -> RawRecord:
+        """Return the raw values of the record at *index*."""
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError(index)
+        return tuple([column.raw_value(index) for column in self.columns])
+
+
+# decoded relations shared by all readers in the process; maps
+# (path, encoding, datatypes) to relations, least recently used first
+_relation_cache: 'OrderedDict[Tuple, _ColumnarRelation]' = OrderedDict()
+_relation_cache_lock = threading.Lock()
+_relation_cache_size = 256 * 1024 * 1024  # bytes
+_relation_cache_bytes = 0
+
+
+def set_relation_cache_size(nbytes: int) -> None:
+    """
+    Set the maximum size in bytes of the shared relation cache.
+
+    Least recently used relations are evicted until the decoded data
+    in the cache is no larger than *nbytes*. Relations larger than
+    *nbytes* are decoded when they are read but they are not cached,
+    so a size of `0` disables the cache.
+
+    Args:
+        nbytes: the maximum size of the cached data in bytes
+    Raises:
+        ValueError: when *nbytes* is negative
+    Example:
+        >>> tsdb.set_relation_cache_size(1024 ** 3)  # 1 GiB
+    """
+    global _relation_cache_size
+    if nbytes < 0:
+        raise ValueError(f'invalid relation cache size: {nbytes}')
+    with _relation_cache_lock:
+        _relation_cache_size = nbytes
+        _evict_relations()
+
+
+def clear_relation_cache() -> None:
+    """Remove all decoded relations from the shared relation cache."""
+    global _relation_cache_bytes
+    with _relation_cache_lock:
+        _relation_cache.clear()
+        _relation_cache_bytes = 0
+
+
+def _read_columns(dir: util.PathLike,
+                  name: str,
+                  fields: Fields,
+                  encoding: str) -> _ColumnarRelation:
+    """
+    Return the decoded data of relation *name* from the shared
+    relation cache, decoding and caching it if needed.
+    """
+    global _relation_cache_bytes
+    path = get_path(dir, name).resolve()
+    key = (path, encoding, tuple(field.datatype for field in fields))
+    fingerprint = _fingerprint(path)
+    with _relation_cache_lock:
+        relation = _relation_cache.get(key)
+        if relation is not None and relation.fingerprint == fingerprint:
+            _relation_cache.move_to_end(key)
+            return relation
+    relation = _ColumnarRelation.read(dir, name, fields, encoding)
+    # only cache the data if the file did not change meanwhile
+    if _fingerprint(path) != fingerprint:
+        return relation
+    relation.fingerprint = fingerprint
+    nbytes = relation.nbytes
+    with _relation_cache_lock:
+        old = _relation_cache.pop(key, None)
+        if old is not None:
+            _relation_cache_bytes -= old.nbytes
+        if nbytes <= _relation_cache_size:
+            _relation_cache[key] = relation
+            _relation_cache_bytes += nbytes
+            _evict_relations()
+    return relation
+
+
+def _evict_relations() -> None:
+    global _relation_cache_bytes
+    while _relation_cache_bytes > _relation_cache_size:
+        _, relation = _relation_cache.popitem(last=False)
+        _relation_cache_bytes -= relation.nbytes
 
 
 #############################################################################
@@ -409,11 +949,16 @@ def escape(string: str) -> str:
     Returns:
         The escaped string
     """
-    # str.replace()... is about 3-4x faster than re.sub() here
-    return (string
-            .replace('\\', '\\\\')  # must be done first
-            .replace('\n', '\\n')
-            .replace(FIELD_DELIMITER, '\\s'))
+    # most strings have nothing to escape, and checking for that is
+    # much faster than attempting the replacements
+    if '\\' in string or '\n' in string or FIELD_DELIMITER in string:
+        # str.replace()... is about 3-4x faster than re.sub() and
+        # about 2x faster than str.translate() here
+        string = (string
+                  .replace('\\', '\\\\')  # must be done first
+                  .replace('\n', '\\n')
+                  .replace(FIELD_DELIMITER, '\\s'))
+    return string
 
 
 def unescape(string: str) -> str:
@@ -428,28 +973,36 @@ def unescape(string: str) -> str:
         The string with escape sequences replaced
 
     """
+    if '\\' not in string:
+        return string
     # unescape cannot use multiple str.replace() calls because of
     # examples like '\\\\s' which turn into '@' instead of '\\s'
-    chars: List[str] = []
-    esc = False
-    for c in string:
-        if esc:
-            if c == '\\':
-                chars.append('\\')
-            elif c == 's':
-                chars.append('@')
-            elif c == 'n':
-                chars.append('\n')
-            else:
-                raise TSDBError('invalid escape sequence: \\' + c)
-            esc = False
-        elif c == '\\':
-            esc = True
-        else:
-            chars.append(c)
-    if esc:
-        raise TSDBError(f'invalid escape at end-of-string: {string!r}')
-    return ''.join(chars)
+    return _ESCAPE_SEQUENCE_RE.sub(_unescape_match, string)
+
+
+_ESCAPE_SEQUENCE_RE = re.compile(r'\\(.?)', flags=re.DOTALL)
+_UNESCAPED = {'\\': '\\', 's': FIELD_DELIMITER, 'n': '\n'}
+
+
+def _unescape_match(match: 're.Match[str]') -> str:
+    c = match.group(1)
+    try:
+        return _UNESCAPED[c]
+    except KeyError:
+        if not c:
+            raise TSDBError('invalid escape at end-of-string: '
+                            f'{match.string!r}') from None
+        raise TSDBError('invalid escape sequence: \\' + c) from None
+
+
+@overload
+def split(line: str, fields: None = None) -> RawRecord:
+    ...
+
+
+@overload
+def split(line: str, fields: Optional[Fields]) -> Record:
+    ...
 
 
 def split(line: str,
@@ -470,16 +1023,20 @@ def split(line: str,
     Returns:
         A list of column values.
     """
-    raw_values = [unescape(col) if col else None
-                  for col in line.rstrip('\n').split(FIELD_DELIMITER)]
+    raw_values = _split_raw(line)
     if fields:
-        if len(raw_values) != len(fields):
-            _mismatched_counts(raw_values, fields)
-        record = tuple(cast(f.datatype, col)
-                       for col, f in zip(raw_values, fields))
-    else:
-        record = tuple(raw_values)
-    return record
+        return get_codec(fields).decode(raw_values)
+    return tuple(raw_values)
+
+
+def _split_raw(line: str) -> List[RawValue]:
+    """Split and unescape *line* without casting the values."""
+    cols = line.rstrip('\n').split(FIELD_DELIMITER)
+    if '\\' not in line:
+        # fast path: nothing to unescape
+        return [col or None for col in cols]
+    return [(unescape(col) if '\\' in col else col) if col else None
+            for col in cols]
 
 
 def join(values: Record,
@@ -502,14 +1059,20 @@ def join(values: Record,
         A TSDB-encoded string
     """
     if fields:
-        if len(values) != len(fields):
-            _mismatched_counts(values, fields)
-        raw_values = [format(f.datatype, val, default=f.default)
-                      for f, val in zip(fields, values)]
-    else:
-        raw_values = ['' if v is None else str(v) for v in values]
-    escaped_values = map(escape, raw_values)
-    return FIELD_DELIMITER.join(escaped_values)
+        return get_codec(fields).encode(values)
+    return _join_raw(['' if v is None else str(v) for v in values])
+
+
+def _join_raw(raw_values: Sequence[str]) -> str:
+    """Escape and join already formatted *raw_values*."""
+    line = FIELD_DELIMITER.join(raw_values)
+    # fast path: if the joined line has no special characters other
+    # than the delimiters, no value needs escaping
+    if ('\\' in line
+            or '\n' in line
+            or line.count(FIELD_DELIMITER) != len(raw_values) - 1):
+        line = FIELD_DELIMITER.join(map(escape, raw_values))
+    return line
 
 
 def _mismatched_counts(columns, fields):
@@ -533,7 +1096,7 @@ def make_record(colmap: ColumnMap, fields: Fields) -> Record:
     Returns:
         A tuple of column values
     """
-    return tuple(colmap.get(f.name, None) for f in fields)
+    return get_codec(fields).make_record(colmap)
 
 
 def cast(datatype: str, raw_value: Optional[str]) -> Value:
@@ -693,18 +1256,172 @@ def format(datatype: str,
         else:
             default = str(default)  # ensure it is a string
         raw_value = default
-    elif datatype == ':date' and isinstance(value, (date, datetime)):
-        month = _MONTHS[value.month]
-        pattern = f'{value.day!s}-{month}-%Y'
-        if (isinstance(value, datetime)
-                and (value.hour, value.minute, value.second) != (0, 0, 0)):
-            pattern += ' %H:%M:%S'
-        raw_value = value.strftime(pattern)
+    elif datatype == ':date':
+        raw_value = _format_date(value)
     else:
         raw_value = str(value)
     return raw_value
 
 
+def _format_date(value: Value) -> str:
+    if not isinstance(value, (date, datetime)):
+        return str(value)
+    month = _MONTHS[value.month]
+    pattern = f'{value.day!s}-{month}-%Y'
+    if (isinstance(value, datetime)
+            and (value.hour, value.minute, value.second) != (0, 0, 0)):
+        pattern += ' %H:%M:%S'
+    return value.strftime(pattern)
+
+
+#############################################################################
+# Record Codecs
+
+class Codec:
+    """
+    Encoder and decoder for the records of a relation.
+
+    A codec selects the function for casting and formatting each
+    column once for the *fields* of a relation so that records can
+    be converted without dispatching on the datatype of every
+    value. Codecs are cached by their fields, so they are normally
+    retrieved with :func:`get_codec` instead of being instantiated
+    directly.
+
+    Args:
+        fields: iterable of :class:`Field` objects
+    Attributes:
+        fields: The fields of the relation.
+    """
+
+    __slots__ = ('fields', '_names', '_converters', '_formatters',
+                 '_defaults', '_datatype_defaults')
+
+    def __init__(self, fields: Iterable[Field]) -> None:
+        self.fields: Tuple[Field, ...] = tuple(fields)
+        self._names = [f.name for f in self.fields]
+        self._converters = [_get_converter(f.datatype) for f in self.fields]
+        self._formatters = [_format_date if f.datatype == ':date' else None
+                            for f in self.fields]
+        self._defaults = [f.default for f in self.fields]
+        self._datatype_defaults = [format(f.datatype, None)
+                                   for f in self.fields]
+
+    def __len__(self) -> int:
+        return len(self.fields)
+
+    def cast(self, raw_values: Sequence[RawValue]) -> Record:
+        """
+        Cast each of *raw_values* into the datatype of its field.
+
+        This is like calling :func:`cast` on each value, but the
+        number of values is not checked.
+        """
+        return tuple([
+            None if not raw else raw if convert is None else convert(raw)
+            for convert, raw in zip(self._converters, raw_values)
+        ])
+
+    def decode(self, raw_values: Sequence[RawValue]) -> Record:
+        """
+        Cast split *raw_values* of a record into their datatypes.
+
+        Raises:
+            TSDBError: when the number of values does not match the
+                number of fields
+        """
+        if len(raw_values) != len(self.fields):
+            _mismatched_counts(raw_values, self.fields)
+        return self.cast(raw_values)
+
+    def format(self,
+               values: Record,
+               defaults: bool = True) -> List[str]:
+        """
+        Format each of *values* as a string for its field.
+
+        This is like calling :func:`format` on each value. If
+        *defaults* is `True`, `None` values are replaced with the
+        default values of their fields, otherwise with the default
+        values of their datatypes. The number of values is not
+        checked.
+        """
+        default_values = (self._defaults if defaults
+                          else self._datatype_defaults)
+        return [
+            default if value is None
+            else (str(value) if formatter is None else formatter(value))
+            for formatter, default, value
+            in zip(self._formatters, default_values, values)
+        ]
+
+    def encode(self, values: Record) -> str:
+        """
+        Format, escape, and join *values* into a line for a relation.
+
+        Raises:
+            TSDBError: when the number of values does not match the
+                number of fields
+        """
+        if len(values) != len(self.fields):
+            _mismatched_counts(values, self.fields)
+        return _join_raw(self.format(values))
+
+    def make_record(self, colmap: ColumnMap) -> Record:
+        """Create a record tuple from a mapping of column names to values."""
+        get = colmap.get
+        return tuple([get(name) for name in self._names])
+
+
+@functools.lru_cache(maxsize=256)
+def _get_codec(fields: Tuple[Field, ...]) -> Codec:
+    return Codec(fields)
+
+
+# Hashing the fields is relatively slow, so codecs are first looked up
+# by the identity of the fields object (e.g., a schema's list) which is
+# then compared by its items in case it was modified
+_codecs_by_id: Dict[int, Tuple[Iterable[Field], Tuple[Field, ...], Codec]]
+_codecs_by_id = {}
+
+
+def get_codec(fields: Iterable[Field]) -> Codec:
+    """
+    Return the cached :class:`Codec` for *fields*.
+
+    Example:
+        >>> codec = tsdb.get_codec(schema['item'])
+        >>> codec.decode(tsdb.split('10@It rained.@1@1-feb-2018 15:00'))
+        (10, 'It rained.', 1, datetime.datetime(2018, 2, 1, 15, 0))
+        >>> codec.encode((20, 'Rained.', None, None))
+        '20@Rained.@1@'
+    """
+    key = tuple(fields)
+    entry = _codecs_by_id.get(id(fields))
+    if entry is not None and entry[0] is fields and entry[1] == key:
+        return entry[2]
+    codec = _get_codec(key)
+    if len(_codecs_by_id) >= 256:
+        _codecs_by_id.clear()
+    _codecs_by_id[id(fields)] = (fields, key, codec)
+    return codec
+
+
+def _get_converter(datatype: str) -> Optional[Callable[[str], Value]]:
+    """Return the function for casting non-empty raw values."""
+    if datatype == ':integer':
+        return int
+    elif datatype == ':float':
+        return float
+    elif datatype == ':date':
+        return _parse_datetime
+    elif datatype == ':string':
+        return None
+    else:
+        # defer the error until a value is actually cast
+        return functools.partial(_cast, datatype)
+
+
 #############################################################################
 # Files
 
@@ -782,6 +1499,1196 @@ def open(dir: util.PathLike,
         return path.open(encoding=encoding, newline='\n')
 
 
+#############################################################################
+# Block-Compressed Files
+
+_GZIP_BLOCK_SIZE = 2 ** 16
+# A gzip member header with an extra field (FEXTRA) containing a
+# single 'TB' subfield with the total size of the member. Fields are:
+# magic+method+flags, mtime, xfl, os, xlen, si1, si2, subfield length,
+# member size
+_GZIP_BLOCK_HEADER = struct.Struct('<4sIBBHBBHI')
+_GZIP_BLOCK_MAGIC = b'\x1f\x8b\x08\x04'
+_GZIP_BLOCK_SUBFIELD = (ord('T'), ord('B'), 4)
+
+
+def _write_gzip_blocks(source: IO[bytes], out: IO[bytes]) -> None:
+    """Compress the lines in *source* as gzip members of whole lines."""
+    block = bytearray()
+    for line in source:
+        if block and len(block) + len(line) > _GZIP_BLOCK_SIZE:
+            out.write(_compress_block(bytes(block)))
+            block.clear()
+        block += line
+    if block:
+        out.write(_compress_block(bytes(block)))
+
+
+def _compress_block(data: bytes) -> bytes:
+    compressor = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS)
+    deflated = compressor.compress(data) + compressor.flush()
+    size = _GZIP_BLOCK_HEADER.size + len(deflated) + 8
+    header = _GZIP_BLOCK_HEADER.pack(
+        _GZIP_BLOCK_MAGIC, 0, 0, 255, 8, *_GZIP_BLOCK_SUBFIELD, size)
+    trailer = struct.pack('<II', zlib.crc32(data), len(data) & 0xffffffff)
+    return header + deflated + trailer
+
+
+def _read_gzip_block(fh: IO[bytes]) -> Optional[bytes]:
+    """
+    Decompress the gzip member at the current position of *fh*.
+
+    Return `None` if the member was not written by
+    :func:`_write_gzip_blocks`.
+    """
+    header = fh.read(_GZIP_BLOCK_HEADER.size)
+    if len(header) != _GZIP_BLOCK_HEADER.size:
+        return None
+    magic, _, _, _, xlen, si1, si2, slen, size = (
+        _GZIP_BLOCK_HEADER.unpack(header))
+    if (magic != _GZIP_BLOCK_MAGIC
+            or xlen != 8
+            or (si1, si2, slen) != _GZIP_BLOCK_SUBFIELD
+            or size < len(header)):
+        return None
+    member = header + fh.read(size - len(header))
+    return zlib.decompress(member, wbits=zlib.MAX_WBITS | 16)
+
+
+#############################################################################
+# Line Indexes
+
+_LINE_INDEX_MAGIC = b'TSDBIDX1'
+# magic, relation size, relation mtime (ns), number of lines
+_LINE_INDEX_HEADER = struct.Struct('<8sQQQ')
+# recently used line indexes; maps paths to (fingerprint, offsets)
+_line_index_memo: 'OrderedDict[Path, Tuple[Tuple[int, int], array]]' = (
+    OrderedDict())
+_LINE_INDEX_MEMO_SIZE = 16
+
+
+def get_line_index(dir: util.PathLike,
+                   name: str,
+                   build: bool = True) -> Optional[Sequence[int]]:
+    """
+    Return the byte offset of each line in relation *name*.
+
+    The offsets allow lines to be read directly from the relation file
+    without scanning all preceding lines (see :func:`read_lines`). They
+    are stored in a sidecar file next to the relation (e.g.,
+    `result.idx` for `result`) so they only need to be computed
+    once. The sidecar records the size and modification time of the
+    relation file and it is rebuilt when these no longer match. If the
+    sidecar cannot be written (e.g., the directory is read-only), the
+    offsets are still computed and returned.
+
+    For gzipped relations written by :func:`write`, the offsets are
+    virtual offsets combining the position of the compressed block
+    containing the line (upper 48 bits) and the position of the line
+    within the uncompressed block (lower 16 bits). Other gzipped
+    relations are not indexed and `None` is returned for them.
+
+    Args:
+        dir: path to the database directory
+        name: name of the relation
+        build: if `False`, only return an existing and valid index
+            instead of computing a new one
+    Returns:
+        A sequence of byte offsets, or `None` if no index is available
+    Raises:
+        TSDBError: when the relation file does not exist
+    Example:
+        >>> offsets = tsdb.get_line_index('my-profile', 'result')
+        >>> len(offsets)  # number of rows in the relation
+        4302
+    """
+    path = get_path(dir, name)
+    fingerprint = _fingerprint(path)
+    memo = _line_index_memo.get(path)
+    if memo is not None and memo[0] == fingerprint:
+        return memo[1]
+    idx_path = path.with_name(path.name + LINE_INDEX_SUFFIX)
+    offsets = _read_line_index(idx_path, fingerprint)
+    if offsets is None:
+        if not build:
+            return None
+        offsets = _scan_line_offsets(path)
+        if offsets is None:
+            return None
+        # only persist the index if the file did not change meanwhile
+        if _fingerprint(path) != fingerprint:
+            return offsets
+        _write_line_index(idx_path, fingerprint, offsets)
+    _line_index_memo[path] = (fingerprint, offsets)
+    while len(_line_index_memo) > _LINE_INDEX_MEMO_SIZE:
+        _line_index_memo.popitem(last=False)
+    return offsets
+
+
+def read_lines(dir: util.PathLike,
+               name: str,
+               linenos: Iterable[int],
+               encoding: str = 'utf-8') -> Iterator[str]:
+    """
+    Yield the lines at (0-based) positions *linenos* of relation *name*.
+
+    Lines are yielded in the order given by *linenos*. When a line
+    index is available (see :func:`get_line_index`), each line is
+    read by seeking directly to its offset, otherwise the relation is
+    scanned once and the requested lines are collected.
+
+    Args:
+        dir: path to the database directory
+        name: name of the relation
+        linenos: non-negative line numbers
+        encoding: character encoding of the file
+    Raises:
+        IndexError: when a line number is beyond the end of the file
+    Example:
+        >>> list(tsdb.read_lines('my-profile', 'item', [10, 11]))
+        ['21@...\n', '22@...\n']
+    """
+    linenos = list(linenos)
+    offsets = get_line_index(dir, name)
+    if offsets is None:
+        yield from _scan_lines(dir, name, linenos, encoding)
+        return
+    path = get_path(dir, name)
+    if path.suffix.lower() == '.gz':
+        yield from _seek_block_lines(path, offsets, linenos, encoding)
+        return
+    with path.open('rb') as fh:
+        pos = -1
+        for lineno in linenos:
+            if lineno < 0:
+                raise IndexError(f'invalid line number: {lineno}')
+            offset = offsets[lineno]
+            if offset != pos:
+                fh.seek(offset)
+            line = fh.readline()
+            pos = offset + len(line)
+            yield line.decode(encoding)
+
+
+def _seek_block_lines(path, offsets, linenos, encoding):
+    block_offset = -1
+    block = b''
+    with path.open('rb') as fh:
+        for lineno in linenos:
+            if lineno < 0:
+                raise IndexError(f'invalid line number: {lineno}')
+            offset = offsets[lineno]
+            if offset >> 16 != block_offset:
+                block_offset = offset >> 16
+                fh.seek(block_offset)
+                try:
+                    read = _read_gzip_block(fh)
+                except (zlib.error, EOFError):
+                    read = None
+                if read is None:
+                    raise TSDBError(
+                        f'could not read the block at offset {block_offset} '
+                        f'of {path}; the line index may be out of date')
+                block = read
+            start = offset & 0xffff
+            if start >= len(block):
+                raise TSDBError(
+                    f'line {lineno} is outside of its block in {path}')
+            end = block.find(b'\n', start) + 1 or len(block)
+            yield block[start:end].decode(encoding)
+
+
+def sample_lines(dir: util.PathLike,
+                 name: str,
+                 size: int = 65536,
+                 encoding: str = 'utf-8') -> Tuple[List[str], float]:
+    """
+    Return lines from the start of relation *name* and their share
+    of the file.
+
+    Whole lines are read until at least *size* bytes of (uncompressed)
+    data have been read or the file ends. The share is the estimated
+    fraction of the file's data that the lines represent; for gzipped
+    files it is based on the compressed bytes consumed. This allows
+    cheap estimates of relation statistics, such as the number of
+    rows, without reading whole files.
+
+    Args:
+        dir: path to the database directory
+        name: name of the relation
+        size: the minimum number of bytes to read
+        encoding: character encoding of the file
+    Returns:
+        A pair of the list of lines and their share of the file,
+        which is `1.0` if the whole file was read
+    Example:
+        >>> lines, share = tsdb.sample_lines('my-profile', 'result')
+        >>> estimated_rows = len(lines) / share
+    """
+    path = get_path(dir, name)
+    total = path.stat().st_size
+    with path.open('rb') as fh:
+        if path.suffix.lower() == '.gz':
+            data, consumed = _decompress_prefix(fh, size)
+        else:
+            data = fh.read(size)
+            consumed = len(data)
+            if consumed == size and not data.endswith(b'\n'):
+                # finish the last line
+                data += fh.readline()
+                consumed = len(data)
+    if not data:
+        return [], 1.0
+    share = 1.0
+    if consumed < total:
+        read = len(data)
+        end = data.rfind(b'\n') + 1
+        data = data[:end]
+        share = (consumed * end / read) / total
+    lines = data.decode(encoding).splitlines(keepends=True)
+    return lines, share
+
+
+def _decompress_prefix(fh: IO[bytes], size: int) -> Tuple[bytes, int]:
+    """
+    Decompress at least *size* bytes from the gzip file *fh*, if
+    available, and return them with the number of compressed bytes
+    consumed.
+    """
+    chunks: List[bytes] = []
+    num_bytes = 0
+    consumed = 0
+    decompressor = zlib.decompressobj(wbits=31)
+    pending = b''
+    while num_bytes < size:
+        if not pending:
+            pending = fh.read(16384)
+            if not pending:
+                break
+        chunk = decompressor.decompress(pending)
+        consumed += len(pending) - len(decompressor.unused_data)
+        pending = decompressor.unused_data
+        if decompressor.eof:
+            # files may have multiple gzip members
+            decompressor = zlib.decompressobj(wbits=31)
+        chunks.append(chunk)
+        num_bytes += len(chunk)
+    return b''.join(chunks), consumed
+
+
+def _scan_lines(dir, name, linenos, encoding):
+    wanted = set(linenos)
+    found: Dict[int, str] = {}
+    if wanted:
+        last = max(wanted)
+        with open(dir, name, encoding=encoding) as fh:
+            for i, line in enumerate(fh):
+                if i in wanted:
+                    found[i] = line
+                if i >= last:
+                    break
+    for lineno in linenos:
+        try:
+            yield found[lineno]
+        except KeyError:
+            raise IndexError(f'invalid line number: {lineno}') from None
+
+
+def _fingerprint(path: Path) -> Tuple[int, int]:
+    st = path.stat()
+    return st.st_size, st.st_mtime_ns
+
+
+def _scan_line_offsets(path: Path) -> Optional[array]:
+    if path.suffix.lower() == '.gz':
+        return _scan_block_line_offsets(path)
+    offsets = array('Q')
+    pos = 0
+    with path.open('rb') as fh:
+        for line in fh:
+            offsets.append(pos)
+            pos += len(line)
+    return offsets
+
+
+def _scan_block_line_offsets(path: Path) -> Optional[array]:
+    offsets = array('Q')
+    size = path.stat().st_size
+    with path.open('rb') as fh:
+        block_offset = 0
+        while block_offset < size:
+            block = _read_gzip_block(fh)
+            if block is None:
+                return None
+            start = 0
+            while start < len(block):
+                if start > 0xffff:
+                    return None
+                offsets.append(block_offset << 16 | start)
+                start = block.find(b'\n', start) + 1 or len(block)
+            block_offset = fh.tell()
+    return offsets
+
+
+def _read_line_index(idx_path: Path,
+                     fingerprint: Tuple[int, int]) -> Optional[array]:
+    try:
+        with idx_path.open('rb') as fh:
+            header = fh.read(_LINE_INDEX_HEADER.size)
+            if len(header) != _LINE_INDEX_HEADER.size:
+                return None
+            magic, size, mtime, count = _LINE_INDEX_HEADER.unpack(header)
+            if magic != _LINE_INDEX_MAGIC or (size, mtime) != fingerprint:
+                return None
+            offsets = array('Q')
+            offsets.fromfile(fh, count)
+    except (OSError, EOFError):
+        return None
+    if sys.byteorder == 'big':
+        offsets.byteswap()
+    return offsets
+
+
+def _write_line_index(idx_path: Path,
+                      fingerprint: Tuple[int, int],
+                      offsets: array) -> None:
+    data = array('Q', offsets)
+    if sys.byteorder == 'big':
+        data.byteswap()
+    header = _LINE_INDEX_HEADER.pack(
+        _LINE_INDEX_MAGIC, fingerprint[0], fingerprint[1], len(data))
+    # the index is only an optimization, so failing to store it is
+    # not an error
+    try:
+        fd, tmp = tempfile.mkstemp(
+            suffix='.tmp', prefix=idx_path.name, dir=idx_path.parent)
+    except OSError:
+        return
+    try:
+        with os.fdopen(fd, 'wb') as fh:
+            fh.write(header)
+            data.tofile(fh)
+        os.replace(tmp, idx_path)
+    except OSError:
+        Path(tmp).unlink(missing_ok=True)
+
+
+#############################################################################
+# Key Indexes
+
+_KEY_INDEX_MAGIC = b'TSDBKDX1'
+# magic, relation size, relation mtime (ns), number of keys, number of
+# lines
+_KEY_INDEX_HEADER = struct.Struct('<8sQQQQ')
+# recently used key indexes; maps (path, column) to (fingerprint, index)
+_key_index_memo: 'OrderedDict[Tuple[Path, str], Tuple[Tuple, KeyIndex]]' = (
+    OrderedDict())
+_KEY_INDEX_MEMO_SIZE = 32
+
+
+class KeyIndex:
+    """
+    The sorted values of an integer key column of a relation and the
+    line numbers of the records having each value.
+
+    Records with empty values for the key are not included.
+
+    Args:
+        keys: the sorted key values
+        linenos: the line number of the record with each key value
+        lines: the number of lines in the relation
+    Attributes:
+        keys: the sorted key values
+        linenos: the line number of the record with each key value;
+            line numbers of equal keys are in ascending order
+        lines: the number of lines in the relation
+    """
+
+    __slots__ = 'keys', 'linenos', 'lines'
+
+    def __init__(self, keys: array, linenos: array, lines: int) -> None:
+        self.keys = keys
+        self.linenos = linenos
+        self.lines = lines
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def lookup(self, value: int) -> List[int]:
+        """Return the line numbers of records whose key is *value*."""
+        keys = self.keys
+        start = bisect.bisect_left(keys, value)
+        end = bisect.bisect_right(keys, value, start)
+        return self.linenos[start:end].tolist()
+
+    def range(self,
+              low: Optional[int] = None,
+              high: Optional[int] = None,
+              include_low: bool = True,
+              include_high: bool = True) -> List[int]:
+        """
+        Return the sorted line numbers of records whose key is between
+        *low* and *high*.
+
+        If *low* or *high* is `None`, the range is unbounded on that
+        side. The bounds are included unless *include_low* or
+        *include_high* is `False`.
+        """
+        keys = self.keys
+        start, end = 0, len(keys)
+        if low is not None:
+            if include_low:
+                start = bisect.bisect_left(keys, low)
+            else:
+                start = bisect.bisect_right(keys, low)
+        if high is not None:
+            if include_high:
+                end = bisect.bisect_right(keys, high, start)
+            else:
+                end = bisect.bisect_left(keys, high, start)
+        return sorted(self.linenos[start:end])
+
+    @classmethod
+    def from_keys(cls,
+                  values: Iterable[Optional[int]],
+                  start: int = 0,
+                  base: Optional['KeyIndex'] = None) -> 'KeyIndex':
+        """
+        Make a key index from the key *values* of consecutive lines.
+
+        The line number of the first value is *start*. If *base* is
+        given, its keys are merged into the new index.
+        """
+        pairs = [] if base is None else list(zip(base.keys, base.linenos))
+        lineno = start - 1
+        for lineno, value in enumerate(values, start):
+            if value is not None:
+                pairs.append((value, lineno))
+        pairs.sort()
+        return cls(array('q', [key for key, _ in pairs]),
+                   array('Q', [lineno for _, lineno in pairs]),
+                   lineno + 1)
+
+
+def get_key_index(dir: util.PathLike,
+                  name: str,
+                  column: str,
+                  fields: Optional[Fields] = None,
+                  build: bool = True,
+                  encoding: str = 'utf-8') -> Optional[KeyIndex]:
+    """
+    Return the key index of *column* in relation *name*.
+
+    A key index allows the records having particular values of an
+    `:integer` key column to be found without scanning the relation.
+    Like line indexes (see :func:`get_line_index`), key indexes are
+    stored in sidecar files next to the relation (e.g.,
+    `result.parse-id.kdx` for the `parse-id` column of `result`) and
+    they are rebuilt when the relation changes. Existing key indexes
+    are updated by :func:`write` so they stay valid when records are
+    written.
+
+    Args:
+        dir: path to the database directory
+        name: name of the relation
+        column: name of the key column
+        fields: the fields of the relation; if not given, they are
+            read from the schema in *dir*
+        build: if `False`, only return an existing and valid index
+            instead of computing a new one
+        encoding: character encoding of the file
+    Returns:
+        A :class:`KeyIndex`, or `None` if *build* is `False` and no
+        valid index exists
+    Raises:
+        TSDBError: when the relation file does not exist or when
+            *column* is not an `:integer` key column
+    Example:
+        >>> index = tsdb.get_key_index('my-profile', 'result', 'parse-id')
+        >>> list(tsdb.read_lines('my-profile', 'result',
+        ...                      index.lookup(10)))
+        ['10@0@...\n', '10@1@...\n']
+    """
+    if fields is None:
+        fields = read_schema(dir)[name]
+    col_index = _key_column_index(fields, column)
+    path = get_path(dir, name)
+    fingerprint = _fingerprint(path)
+    memo = _key_index_memo.get((path, column))
+    if memo is not None and memo[0] == fingerprint:
+        return memo[1]
+    kdx_path = _key_index_path(path, column)
+    index = _read_key_index(kdx_path, fingerprint)
+    if index is None:
+        if not build:
+            return None
+        index = _scan_key_index(Path(dir), name, col_index, len(fields),
+                                encoding)
+        # only persist the index if the file did not change meanwhile
+        if _fingerprint(path) != fingerprint:
+            return index
+        _write_key_index(kdx_path, fingerprint, index)
+    _remember_key_index(path, column, fingerprint, index)
+    return index
+
+
+def _key_column_index(fields: Fields, column: str) -> int:
+    for i, field in enumerate(fields):
+        if field.name == column:
+            if not field.is_key or field.datatype != ':integer':
+                raise TSDBError(f'not an :integer key column: {column}')
+            return i
+    raise TSDBError(f'column not defined: {column}')
+
+
+def _key_index_path(path: Path, column: str) -> Path:
+    return path.with_name(f'{path.name}.{column}{KEY_INDEX_SUFFIX}')
+
+
+def _remember_key_index(path: Path,
+                        column: str,
+                        fingerprint: Tuple[int, int],
+                        index: KeyIndex) -> None:
+    _key_index_memo[(path, column)] = (fingerprint, index)
+    while len(_key_index_memo) > _KEY_INDEX_MEMO_SIZE:
+        _key_index_memo.popitem(last=False)
+
+
+def _scan_key_index(dir: Path,
+                    name: str,
+                    col_index: int,
+                    num_fields: int,
+                    encoding: str) -> KeyIndex:
+    path = get_path(dir, name)
+    if _can_map(path, encoding):
+        records = _select_mapped(path, [col_index], num_fields, encoding)
+    else:
+        records = _select_lines(dir, name, [col_index], num_fields, encoding)
+    try:
+        return KeyIndex.from_keys(
+            int(raw) if raw else None for raw, in records)
+    except ValueError as exc:
+        raise TSDBError(f'invalid key value in {path!s}: {exc}') from None
+
+
+def _read_key_index(kdx_path: Path,
+                    fingerprint: Tuple[int, int]) -> Optional[KeyIndex]:
+    try:
+        with kdx_path.open('rb') as fh:
+            header = fh.read(_KEY_INDEX_HEADER.size)
+            if len(header) != _KEY_INDEX_HEADER.size:
+                return None
+            magic, size, mtime, count, lines = (
+                _KEY_INDEX_HEADER.unpack(header))
+            if magic != _KEY_INDEX_MAGIC or (size, mtime) != fingerprint:
+                return None
+            keys = array('q')
+            keys.fromfile(fh, count)
+            linenos = array('Q')
+            linenos.fromfile(fh, count)
+    except (OSError, EOFError):
+        return None
+    if sys.byteorder == 'big':
+        keys.byteswap()
+        linenos.byteswap()
+    return KeyIndex(keys, linenos, lines)
+
+
+def _write_key_index(kdx_path: Path,
+                     fingerprint: Tuple[int, int],
+                     index: KeyIndex) -> None:
+    keys = array('q', index.keys)
+    linenos = array('Q', index.linenos)
+    if sys.byteorder == 'big':
+        keys.byteswap()
+        linenos.byteswap()
+    header = _KEY_INDEX_HEADER.pack(
+        _KEY_INDEX_MAGIC, fingerprint[0], fingerprint[1], len(keys),
+        index.lines)
+    # like line indexes, key indexes are only an optimization
+    try:
+        fd, tmp = tempfile.mkstemp(
+            suffix='.tmp', prefix=kdx_path.name, dir=kdx_path.parent)
+    except OSError:
+        return
+    try:
+        with os.fdopen(fd, 'wb') as fh:
+            fh.write(header)
+            keys.tofile(fh)
+            linenos.tofile(fh)
+        os.replace(tmp, kdx_path)
+    except OSError:
+        Path(tmp).unlink(missing_ok=True)
+
+
+def _key_index_sidecars(path: Path) -> Iterator[Path]:
+    """Yield the paths of the key index sidecars of relation file *path*."""
+    return path.parent.glob(f'{glob.escape(path.name)}.*{KEY_INDEX_SUFFIX}')
+
+
+#############################################################################
+# Trigram Indexes
+
+_TRIGRAM_INDEX_MAGIC = b'TSDBTGX1'
+# magic, relation size, relation mtime (ns), number of trigrams, number
+# of line numbers, number of lines
+_TRIGRAM_INDEX_HEADER = struct.Struct('<8sQQQQQ')
+# recently used trigram indexes; maps (path, column) to (fingerprint,
+# index)
+_trigram_index_memo: (
+    'OrderedDict[Tuple[Path, str], Tuple[Tuple, TrigramIndex]]'
+) = OrderedDict()
+_TRIGRAM_INDEX_MEMO_SIZE = 8
+
+
+class TrigramIndex:
+    """
+    The line numbers of the records of a relation whose values of a
+    `:string` column contain each trigram (sequence of three
+    characters).
+
+    Trigrams are stored as integers combining the code points of
+    their characters (see :meth:`lookup`).
+
+    Args:
+        trigrams: the sorted encoded trigrams
+        starts: the position in *linenos* of the line numbers of
+            each trigram, followed by the number of line numbers
+        linenos: the ascending line numbers of the records containing
+            each trigram
+        lines: the number of lines in the relation
+    Attributes:
+        trigrams: the sorted encoded trigrams
+        starts: the position in *linenos* of the line numbers of
+            each trigram, followed by the number of line numbers
+        linenos: the ascending line numbers of the records containing
+            each trigram
+        lines: the number of lines in the relation
+    """
+
+    __slots__ = 'trigrams', 'starts', 'linenos', 'lines'
+
+    def __init__(self,
+                 trigrams: array,
+                 starts: array,
+                 linenos: array,
+                 lines: int) -> None:
+        self.trigrams = trigrams
+        self.starts = starts
+        self.linenos = linenos
+        self.lines = lines
+
+    def __len__(self) -> int:
+        return len(self.trigrams)
+
+    def lookup(self, trigram: str) -> List[int]:
+        """
+        Return the line numbers of records containing *trigram*.
+        """
+        key = _encode_trigram(trigram)
+        trigrams = self.trigrams
+        i = bisect.bisect_left(trigrams, key)
+        if i == len(trigrams) or trigrams[i] != key:
+            return []
+        return self.linenos[self.starts[i]:self.starts[i + 1]].tolist()
+
+    def candidates(self, substrings: Iterable[str]) -> Optional[List[int]]:
+        """
+        Return the sorted line numbers of the only records that may
+        contain all of *substrings*.
+
+        Substrings shorter than three characters do not restrict the
+        records, so `None` is returned if all of them are shorter.
+        """
+        trigrams = {sub[i:i + 3]
+                    for sub in substrings
+                    for i in range(len(sub) - 2)}
+        if not trigrams:
+            return None
+        postings = sorted((self.lookup(trigram) for trigram in trigrams),
+                          key=len)
+        found = set(postings[0])
+        for linenos in postings[1:]:
+            # the rarest trigrams select the fewest records, and
+            # intersecting much longer lists removes few of them
+            if not found or len(linenos) > 16 * len(found):
+                break
+            found.intersection_update(linenos)
+        return sorted(found)
+
+    @classmethod
+    def from_values(cls,
+                    values: Iterable[Optional[str]],
+                    start: int = 0,
+                    base: Optional['TrigramIndex'] = None
+                    ) -> 'TrigramIndex':
+        """
+        Make a trigram index from the column *values* of consecutive
+        lines.
+
+        The line number of the first value is *start*. If *base* is
+        given, its trigrams are merged into the new index; the line
+        numbers of *values* must then follow those of *base*.
+        """
+        postings: Dict[int, List[int]] = {}
+        if base is not None:
+            starts = base.starts
+            for i, key in enumerate(base.trigrams):
+                postings[key] = base.linenos[starts[i]:starts[i + 1]].tolist()
+        encode = _encode_trigram
+        lineno = start - 1
+        for lineno, value in enumerate(values, start):
+            if value:
+                for trigram in {value[i:i + 3]
+                                for i in range(len(value) - 2)}:
+                    postings.setdefault(encode(trigram), []).append(lineno)
+        trigrams = array('Q', sorted(postings))
+        starts = array('Q', [0])
+        linenos = array('Q')
+        for key in trigrams:
+            linenos.extend(postings[key])
+            starts.append(len(linenos))
+        return cls(trigrams, starts, linenos, lineno + 1)
+
+
+def _encode_trigram(trigram: str) -> int:
+    # code points have at most 21 bits
+    return ord(trigram[0]) << 42 | ord(trigram[1]) << 21 | ord(trigram[2])
+
+
+def get_trigram_index(dir: util.PathLike,
+                      name: str,
+                      column: str,
+                      fields: Optional[Fields] = None,
+                      build: bool = True,
+                      encoding: str = 'utf-8') -> Optional[TrigramIndex]:
+    """
+    Return the trigram index of *column* in relation *name*.
+
+    A trigram index allows the records whose values of a `:string`
+    column contain some substrings to be found without scanning the
+    relation. Like key indexes (see :func:`get_key_index`), trigram
+    indexes are stored in sidecar files next to the relation (e.g.,
+    `item.i-input.tgx` for the `i-input` column of `item`), they are
+    rebuilt when the relation changes, and existing trigram indexes
+    are updated by :func:`write`.
+
+    Args:
+        dir: path to the database directory
+        name: name of the relation
+        column: name of the `:string` column
+        fields: the fields of the relation; if not given, they are
+            read from the schema in *dir*
+        build: if `False`, only return an existing and valid index
+            instead of computing a new one
+        encoding: character encoding of the file
+    Returns:
+        A :class:`TrigramIndex`, or `None` if *build* is `False` and
+        no valid index exists
+    Raises:
+        TSDBError: when the relation file does not exist or when
+            *column* is not a `:string` column
+    Example:
+        >>> index = tsdb.get_trigram_index('my-profile', 'item', 'i-input')
+        >>> list(tsdb.read_lines('my-profile', 'item',
+        ...                      index.candidates(['rained'])))
+        ['10@It rained.@...\n']
+    """
+    if fields is None:
+        fields = read_schema(dir)[name]
+    col_index = _string_column_index(fields, column)
+    path = get_path(dir, name)
+    fingerprint = _fingerprint(path)
+    memo = _trigram_index_memo.get((path, column))
+    if memo is not None and memo[0] == fingerprint:
+        return memo[1]
+    tgx_path = _trigram_index_path(path, column)
+    index = _read_trigram_index(tgx_path, fingerprint)
+    if index is None:
+        if not build:
+            return None
+        index = _scan_trigram_index(Path(dir), name, col_index, len(fields),
+                                    encoding)
+        # only persist the index if the file did not change meanwhile
+        if _fingerprint(path) != fingerprint:
+            return index
+        _write_trigram_index(tgx_path, fingerprint, index)
+    _remember_trigram_index(path, column, fingerprint, index)
+    return index
+
+
+def _string_column_index(fields: Fields, column: str) -> int:
+    for i, field in enumerate(fields):
+        if field.name == column:
+            if field.datatype != ':string':
+                raise TSDBError(f'not a :string column: {column}')
+            return i
+    raise TSDBError(f'column not defined: {column}')
+
+
+def _trigram_index_path(path: Path, column: str) -> Path:
+    return path.with_name(f'{path.name}.{column}{TRIGRAM_INDEX_SUFFIX}')
+
+
+def _remember_trigram_index(path: Path,
+                            column: str,
+                            fingerprint: Tuple[int, int],
+                            index: TrigramIndex) -> None:
+    _trigram_index_memo[(path, column)] = (fingerprint, index)
+    while len(_trigram_index_memo) > _TRIGRAM_INDEX_MEMO_SIZE:
+        _trigram_index_memo.popitem(last=False)
+
+
+def _scan_trigram_index(dir: Path,
+                        name: str,
+                        col_index: int,
+                        num_fields: int,
+                        encoding: str) -> TrigramIndex:
+    path = get_path(dir, name)
+    if _can_map(path, encoding):
+        records = _select_mapped(path, [col_index], num_fields, encoding)
+    else:
+        records = _select_lines(dir, name, [col_index], num_fields, encoding)
+    return TrigramIndex.from_values(raw for raw, in records)
+
+
+def _read_trigram_index(
+        tgx_path: Path,
+        fingerprint: Tuple[int, int]
+) -> Optional[TrigramIndex]:
+    try:
+        with tgx_path.open('rb') as fh:
+            header = fh.read(_TRIGRAM_INDEX_HEADER.size)
+            if len(header) != _TRIGRAM_INDEX_HEADER.size:
+                return None
+            magic, size, mtime, count, total, lines = (
+                _TRIGRAM_INDEX_HEADER.unpack(header))
+            if magic != _TRIGRAM_INDEX_MAGIC or (size, mtime) != fingerprint:
+                return None
+            trigrams = array('Q')
+            trigrams.fromfile(fh, count)
+            starts = array('Q')
+            starts.fromfile(fh, count + 1)
+            linenos = array('Q')
+            linenos.fromfile(fh, total)
+    except (OSError, EOFError):
+        return None
+    if sys.byteorder == 'big':
+        trigrams.byteswap()
+        starts.byteswap()
+        linenos.byteswap()
+    return TrigramIndex(trigrams, starts, linenos, lines)
+
+
+def _write_trigram_index(tgx_path: Path,
+                         fingerprint: Tuple[int, int],
+                         index: TrigramIndex) -> None:
+    data = [array('Q', index.trigrams),
+            array('Q', index.starts),
+            array('Q', index.linenos)]
+    if sys.byteorder == 'big':
+        for arr in data:
+            arr.byteswap()
+    header = _TRIGRAM_INDEX_HEADER.pack(
+        _TRIGRAM_INDEX_MAGIC, fingerprint[0], fingerprint[1],
+        len(index.trigrams), len(index.linenos), index.lines)
+    # like other indexes, trigram indexes are only an optimization
+    try:
+        fd, tmp = tempfile.mkstemp(
+            suffix='.tmp', prefix=tgx_path.name, dir=tgx_path.parent)
+    except OSError:
+        return
+    try:
+        with os.fdopen(fd, 'wb') as fh:
+            fh.write(header)
+            for arr in data:
+                arr.tofile(fh)
+        os.replace(tmp, tgx_path)
+    except OSError:
+        Path(tmp).unlink(missing_ok=True)
+
+
+def _trigram_index_sidecars(path: Path) -> Iterator[Path]:
+    """
+    Yield the paths of the trigram index sidecars of relation file
+    *path*.
+    """
+    return path.parent.glob(
+        f'{glob.escape(path.name)}.*{TRIGRAM_INDEX_SUFFIX}')
+
+
+#############################################################################
+# Relation Statistics
+
+# the number of hashes kept for estimating distinct values
+_SKETCH_SIZE = 256
+# recently used statistics; maps paths to (fingerprint, statistics)
+_statistics_memo: (
+    'OrderedDict[Path, Tuple[Tuple[int, int], RelationStatistics]]'
+) = OrderedDict()
+_STATISTICS_MEMO_SIZE = 64
+
+
+class RelationStatistics:
+    """
+    Summary statistics of the key columns of a relation.
+
+    Distinct values are estimated from the smallest hashes of the
+    values of each key column (a "k minimum values" sketch), so the
+    estimates are exact for columns with few distinct values and
+    approximate otherwise.
+
+    Args:
+        rows: the number of lines in the relation
+        ranges: mapping of `:integer` key columns to the minimum and
+            maximum of their non-empty values
+        sketches: mapping of key columns to the sorted smallest
+            hashes of their non-empty values
+    Attributes:
+        rows: the number of lines in the relation
+        ranges: mapping of `:integer` key columns to the minimum and
+            maximum of their non-empty values
+        sketches: mapping of key columns to the sorted smallest
+            hashes of their non-empty values
+    """
+
+    __slots__ = 'rows', 'ranges', 'sketches'
+
+    def __init__(self,
+                 rows: int,
+                 ranges: Dict[str, Tuple[int, int]],
+                 sketches: Dict[str, List[int]]) -> None:
+        self.rows = rows
+        self.ranges = ranges
+        self.sketches = sketches
+
+    def distinct(self, column: str) -> int:
+        """
+        Return the estimated number of distinct values of *column*.
+
+        Raises:
+            KeyError: when *column* is not a key column
+        """
+        sketch = self.sketches[column]
+        if len(sketch) < _SKETCH_SIZE:
+            return len(sketch)
+        return round((_SKETCH_SIZE - 1) * 2**64 / (sketch[-1] + 1))
+
+    @classmethod
+    def from_records(cls,
+                     records: Iterable[Record],
+                     fields: Fields,
+                     base: Optional['RelationStatistics'] = None
+                     ) -> 'RelationStatistics':
+        """
+        Make statistics from the *records* of consecutive lines.
+
+        If *base* is given, the new statistics include those of
+        *base*, as when *records* are appended to a relation.
+        """
+        collector = _StatisticsCollector(fields, base)
+        for record in records:
+            collector.add(record)
+        return collector.statistics()
+
+
+class _StatisticsCollector:
+    """Accumulate the statistics of records one at a time."""
+
+    def __init__(self,
+                 fields: Fields,
+                 base: Optional[RelationStatistics] = None) -> None:
+        self.columns = [(i, field.name, field.datatype == ':integer')
+                        for i, field in enumerate(fields) if field.is_key]
+        self.rows = 0
+        self.ranges: Dict[str, Tuple[int, int]] = {}
+        self.hashes: Dict[str, Set[int]] = {
+            name: set() for _, name, _ in self.columns}
+        if base is not None:
+            self.rows = base.rows
+            self.ranges.update(base.ranges)
+            for name, hashes in self.hashes.items():
+                hashes.update(base.sketches.get(name, ()))
+
+    def add(self, record: Record) -> None:
+        self.rows += 1
+        ranges = self.ranges
+        for i, name, is_integer in self.columns:
+            value = record[i] if i < len(record) else None
+            if value is None or value == '':
+                continue
+            if is_integer:
+                # invalid values are left for readers to report
+                try:
+                    number = int(value)  # type: ignore
+                except ValueError:
+                    pass
+                else:
+                    low, high = ranges.get(name, (number, number))
+                    ranges[name] = (min(low, number), max(high, number))
+                    value = number
+            hashes = self.hashes[name]
+            hashes.add(_hash_value(str(value)))
+            if len(hashes) > 2 * _SKETCH_SIZE:
+                self.hashes[name] = set(sorted(hashes)[:_SKETCH_SIZE])
+
+    def collect(self, records: Iterable[Record]) -> Iterator[Record]:
+        """Yield *records* while adding them to the statistics."""
+        for record in records:
+            self.add(record)
+            yield record
+
+    def statistics(self) -> RelationStatistics:
+        sketches = {name: sorted(hashes)[:_SKETCH_SIZE]
+                    for name, hashes in self.hashes.items()}
+        return RelationStatistics(self.rows, dict(self.ranges), sketches)
+
+
+def _hash_value(value: str) -> int:
+    digest = hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little')
+
+
+def get_statistics(dir: util.PathLike,
+                   name: str,
+                   fields: Optional[Fields] = None,
+                   build: bool = True,
+                   encoding: str = 'utf-8') -> Optional[RelationStatistics]:
+    """
+    Return the statistics of relation *name*.
+
+    The statistics give the number of rows of a relation and the
+    range and estimated number of distinct values of its key columns
+    without scanning the relation. They are stored for all relations
+    of a database in a single file in the database directory
+    (`statistics.json`). Like line indexes (see
+    :func:`get_line_index`), the statistics of a relation record the
+    size and modification time of the relation file and they are
+    computed again when the file changes. The statistics are updated
+    by :func:`write` whenever it writes a relation.
+
+    Args:
+        dir: path to the database directory
+        name: name of the relation
+        fields: the fields of the relation; if not given, they are
+            read from the schema in *dir*
+        build: if `False`, only return existing and valid statistics
+            instead of computing them
+        encoding: character encoding of the file
+    Returns:
+        A :class:`RelationStatistics` object, or `None` if *build*
+        is `False` and no valid statistics exist
+    Raises:
+        TSDBError: when the relation file does not exist
+    Example:
+        >>> stats = tsdb.get_statistics('my-profile', 'item')
+        >>> stats.rows
+        1023
+        >>> stats.ranges['i-id']
+        (10, 10230)
+    """
+    path = get_path(dir, name)
+    fingerprint = _fingerprint(path)
+    memo = _statistics_memo.get(path)
+    if memo is not None and memo[0] == fingerprint:
+        return memo[1]
+    stats = _read_statistics(Path(dir), name, path, fingerprint)
+    if stats is None:
+        if not build:
+            return None
+        if fields is None:
+            fields = read_schema(dir)[name]
+        stats = _scan_statistics(Path(dir), name, fields, encoding)
+        # only persist the statistics if the file did not change meanwhile
+        if _fingerprint(path) != fingerprint:
+            return stats
+        _write_statistics(Path(dir), name, path, fingerprint, stats)
+    _remember_statistics(path, fingerprint, stats)
+    return stats
+
+
+def _remember_statistics(path: Path,
+                         fingerprint: Tuple[int, int],
+                         stats: RelationStatistics) -> None:
+    _statistics_memo[path] = (fingerprint, stats)
+    while len(_statistics_memo) > _STATISTICS_MEMO_SIZE:
+        _statistics_memo.popitem(last=False)
+
+
+def _scan_statistics(dir: Path,
+                     name: str,
+                     fields: Fields,
+                     encoding: str) -> RelationStatistics:
+    path = get_path(dir, name)
+    indices = [i for i, field in enumerate(fields) if field.is_key]
+    if _can_map(path, encoding):
+        records = _select_mapped(path, indices, len(fields), encoding)
+    else:
+        records = _select_lines(dir, name, indices, len(fields), encoding)
+    return RelationStatistics.from_records(
+        records, [fields[i] for i in indices])
+
+
+def _read_statistics_file(dir: Path) -> Dict[str, dict]:
+    try:
+        with dir.joinpath(STATISTICS_FILENAME).open(encoding='utf-8') as fh:
+            data = json.load(fh)
+    except (OSError, ValueError):
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def _read_statistics(dir: Path,
+                     name: str,
+                     path: Path,
+                     fingerprint: Tuple[int, int]
+                     ) -> Optional[RelationStatistics]:
+    entry = _read_statistics_file(dir).get(name)
+    if entry is None:
+        return None
+    try:
+        if (entry['file'], entry['size'], entry['mtime']) != (
+                path.name, *fingerprint):
+            return None
+        return RelationStatistics(
+            entry['rows'],
+            {column: (low, high)
+             for column, (low, high) in entry['ranges'].items()},
+            entry['sketches'])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def _write_statistics(dir: Path,
+                      name: str,
+                      path: Path,
+                      fingerprint: Tuple[int, int],
+                      stats: RelationStatistics) -> None:
+    data = _read_statistics_file(dir)
+    data[name] = {
+        'file': path.name,
+        'size': fingerprint[0],
+        'mtime': fingerprint[1],
+        'rows': stats.rows,
+        'ranges': {column: list(range_)
+                   for column, range_ in stats.ranges.items()},
+        'sketches': stats.sketches,
+    }
+    # like indexes, statistics are only an optimization
+    stats_path = dir.joinpath(STATISTICS_FILENAME)
+    try:
+        fd, tmp = tempfile.mkstemp(
+            suffix='.tmp', prefix=stats_path.name, dir=dir)
+    except OSError:
+        return
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as fh:
+            json.dump(data, fh, separators=(',', ':'))
+        os.replace(tmp, stats_path)
+    except OSError:
+        Path(tmp).unlink(missing_ok=True)
+
+
 def write(dir: util.PathLike,
           name: str,
           records: Iterable[Record],
@@ -816,11 +2723,18 @@ def write(dir: util.PathLike,
       avoid having inconsistent files (e.g., delete any existing
       `item` when writing `item.gz`)
 
-    Note that *append* cannot be used with *gzip* or with an existing
-    gzipped file and in such a case a :exc:`NotImplementedError` will
-    be raised. This may be allowed in the future, but as appending to
-    a gzipped file (in general) results in inefficient compression, it
-    is better to append to plain text and compress when done.
+    Compressed files are written as a series of independently
+    compressed gzip members, each holding whole lines and at most
+    64KiB of uncompressed data (similar to the BGZF format). The
+    result is a regular gzip file that can be read by `gunzip` or
+    [incr tsdb()], but it also allows lines to be read without
+    decompressing the entire file (see :func:`get_line_index`) and
+    records to be appended by adding new members.
+
+    When appending to an existing gzipped file, the file remains
+    gzipped even if *gzip* is `False`. When appending with *gzip* to
+    an existing plain text file, the whole file is rewritten with
+    compression.
 
     Args:
         dir: path to the database directory
@@ -830,7 +2744,8 @@ def write(dir: util.PathLike,
             points to an existing test suite directory
         append: if `True`, append to rather than overwrite the file
         gzip: if `True` and the file is not empty, compress the file
-            with `gzip`; if `False`, do not compress
+            with `gzip`; if `False`, do not compress (except when
+            appending to a gzipped file)
         encoding: character encoding of the file
     Example:
         >>> tsdb.write('my-profile',
@@ -855,35 +2770,200 @@ def write(dir: util.PathLike,
                 f'cannot determine fields; no schema file at {schema_path}')
 
     tx_path, gz_path, use_gz = _get_paths(dir, name)
-    if append and (gzip or use_gz):
-        raise NotImplementedError('cannot append to a gzipped file')
-
-    mode = 'ab' if append else 'wb'
+    current = gz_path if use_gz else tx_path
+    if append and not current.is_file():
+        append = False
+    key_indexes = _existing_key_indexes(dir, name, current, fields, encoding)
+    key_values: List[List[Optional[int]]] = [[] for _ in key_indexes]
+    if key_indexes:
+        records = _collect_keys(
+            records, [idx for idx, _, _ in key_indexes], key_values)
+    trigram_indexes = _existing_trigram_indexes(
+        dir, name, current, fields, encoding)
+    # statistics are only kept up to date if they were valid before
+    collector: Optional[_StatisticsCollector] = None
+    if not append:
+        collector = _StatisticsCollector(fields)
+    else:
+        base_stats = get_statistics(dir, name, fields, build=False,
+                                    encoding=encoding)
+        if base_stats is not None:
+            collector = _StatisticsCollector(fields, base_stats)
+    if collector is not None:
+        records = collector.collect(records)
+    string_values: List[List[Optional[str]]] = [[] for _ in trigram_indexes]
+    if trigram_indexes:
+        records = _collect_strings(
+            records, [idx for idx, _, _ in trigram_indexes], string_values)
+    # gzipped files stay gzipped when appending, but plain text files
+    # must be rewritten if they are to become gzipped
+    convert = append and gzip and not use_gz
+    if append:
+        gzip = gzip or use_gz
+    mode = 'ab' if append and not convert else 'wb'
 
     with tempfile.NamedTemporaryFile(
             mode='w+b', suffix='.tmp',
             prefix=name, dir=dir) as f_tmp:
 
+        if convert:
+            with current.open('rb') as f_in:
+                shutil.copyfileobj(f_in, f_tmp)
+
+        encode = get_codec(fields).encode
         for record in records:
-            f_tmp.write(
-                (join(record, fields) + '\n').encode(encoding))
+            f_tmp.write((encode(record) + '\n').encode(encoding))
 
         # only gzip non-empty files
-        gzip = gzip and f_tmp.tell() != 0
+        gzip = gzip and (mode == 'ab' or f_tmp.tell() != 0)
         dest, other = (gz_path, tx_path) if gzip else (tx_path, gz_path)
 
         # now copy the temp file to the destination
         f_tmp.seek(0)
-        if gzip:
-            with GzipFile(dest, mode=mode) as gz_out:
-                shutil.copyfileobj(f_tmp, gz_out)
-        else:
-            with dest.open(mode=mode) as f_out:
+        with dest.open(mode=mode) as f_out:
+            if gzip:
+                _write_gzip_blocks(f_tmp, f_out)
+            else:
                 shutil.copyfileobj(f_tmp, f_out)
 
     # clean up other (gz or non-gz) file if it exists
     if other.is_file():
         other.unlink()
+    for sidecar in _key_index_sidecars(other):
+        sidecar.unlink()
+    for sidecar in _trigram_index_sidecars(other):
+        sidecar.unlink()
+
+    # update existing key indexes with the written keys
+    fingerprint = _fingerprint(dest)
+    for (_, column, base), values in zip(key_indexes, key_values):
+        if not append:
+            index = KeyIndex.from_keys(values)
+        elif base is not None:
+            index = KeyIndex.from_keys(values, base.lines, base)
+        else:
+            # the index was out of date before the records were added
+            get_key_index(dir, name, column, fields, encoding=encoding)
+            continue
+        _write_key_index(_key_index_path(dest, column), fingerprint, index)
+        _remember_key_index(dest, column, fingerprint, index)
+
+    # and existing trigram indexes with the written strings
+    for (_, column, tbase), strings in zip(trigram_indexes, string_values):
+        if not append:
+            tindex = TrigramIndex.from_values(strings)
+        elif tbase is not None:
+            tindex = TrigramIndex.from_values(strings, tbase.lines, tbase)
+        else:
+            get_trigram_index(dir, name, column, fields, encoding=encoding)
+            continue
+        _write_trigram_index(
+            _trigram_index_path(dest, column), fingerprint, tindex)
+        _remember_trigram_index(dest, column, fingerprint, tindex)
+
+    # and the statistics of the relation
+    if collector is not None:
+        stats = collector.statistics()
+        _write_statistics(dir, name, dest, fingerprint, stats)
+        _remember_statistics(dest, fingerprint, stats)
+
+
+def _existing_key_indexes(
+        dir: Path,
+        name: str,
+        path: Path,
+        fields: Fields,
+        encoding: str
+) -> List[Tuple[int, str, Optional[KeyIndex]]]:
+    """
+    Return the column index, column name, and current key index (if
+    valid) of each key column of relation file *path* with a key
+    index sidecar.
+    """
+    columns = {field.name: i for i, field in enumerate(fields)
+               if field.is_key and field.datatype == ':integer'}
+    prefix_length = len(path.name) + 1
+    indexes = []
+    for sidecar in _key_index_sidecars(path):
+        column = sidecar.name[prefix_length:-len(KEY_INDEX_SUFFIX)]
+        if column not in columns:
+            sidecar.unlink()
+            continue
+        index = None
+        if path.is_file():
+            index = get_key_index(dir, name, column, fields, build=False,
+                                  encoding=encoding)
+        indexes.append((columns[column], column, index))
+    return indexes
+
+
+def _collect_keys(records: Iterable[Record],
+                  indices: List[int],
+                  key_values: List[List[Optional[int]]]) -> Iterator[Record]:
+    """
+    Yield *records* while collecting their values at *indices* as
+    integers in *key_values*.
+    """
+    pairs = list(zip(indices, key_values))
+    for record in records:
+        for idx, values in pairs:
+            value = record[idx]
+            if value is None or value == '':
+                values.append(None)
+            else:
+                try:
+                    values.append(int(value))  # type: ignore
+                except ValueError:
+                    raise TSDBError(
+                        f'invalid key value: {value!r}') from None
+        yield record
+
+
+def _existing_trigram_indexes(
+        dir: Path,
+        name: str,
+        path: Path,
+        fields: Fields,
+        encoding: str
+) -> List[Tuple[int, str, Optional[TrigramIndex]]]:
+    """
+    Return the column index, column name, and current trigram index
+    (if valid) of each `:string` column of relation file *path* with a
+    trigram index sidecar.
+    """
+    columns = {field.name: i for i, field in enumerate(fields)
+               if field.datatype == ':string'}
+    prefix_length = len(path.name) + 1
+    indexes = []
+    for sidecar in _trigram_index_sidecars(path):
+        column = sidecar.name[prefix_length:-len(TRIGRAM_INDEX_SUFFIX)]
+        if column not in columns:
+            sidecar.unlink()
+            continue
+        index = None
+        if path.is_file():
+            index = get_trigram_index(dir, name, column, fields, build=False,
+                                      encoding=encoding)
+        indexes.append((columns[column], column, index))
+    return indexes
+
+
+def _collect_strings(
+        records: Iterable[Record],
+        indices: List[int],
+        string_values: List[List[Optional[str]]]
+) -> Iterator[Record]:
+    """
+    Yield *records* while collecting their values at *indices* as
+    strings in *string_values*.
+    """
+    pairs = list(zip(indices, string_values))
+    for record in records:
+        for idx, values in pairs:
+            value = record[idx]
+            values.append(None if value is None or value == ''
+                          else str(value))
+        yield record
 
 
 def initialize_database(path: util.PathLike,
@@ -993,16 +3073,22 @@ def write_database(db: Database,
 
 def _remake_records(relation, old_fields, new_fields):
     field_names = [field.name for field in old_fields]
+    remake = get_codec(new_fields).make_record
     for record in relation:
         colmap = dict(zip(field_names, record))
-        yield make_record(colmap, new_fields)
+        yield remake(colmap)
 
 
 def _cleanup_files(path, names):
     for name in names:
         tx_path = Path(path, name).with_suffix('')
         gz_path = Path(path, name).with_suffix('.gz')
-        if tx_path.is_file():
-            tx_path.unlink()
-        if gz_path.is_file():
-            gz_path.unlink()
+        for _path in (tx_path, gz_path):
+            idx_path = _path.with_name(_path.name + LINE_INDEX_SUFFIX)
+            for p in (_path, idx_path):
+                if p.is_file():
+                    p.unlink()
+            for p in _key_index_sidecars(_path):
+                p.unlink()
+            for p in _trigram_index_sidecars(_path):
+                p.unlink()
@@ -3,16 +3,29 @@
 TSQL -- Test Suite Query Language
 """
 
+import hashlib
+import itertools
 import operator
+import os
+import queue
 import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from pathlib import Path
 from typing import (
     Any,
     Callable,
     Dict,
+    Iterable,
     Iterator,
     List,
+    Mapping,
+    NamedTuple,
     Optional,
+    Sequence,
     Set,
     Tuple,
     Type,
@@ -49,6 +62,38 @@ _Condition = Union[_Comparison, _Boolean]
 _FilterFunction = Callable[[tsdb.Record], bool]
 
 _QNameResolver = Callable[[str], Tuple[str, tsdb.Field]]
+# a predicate over the raw values of the named columns of a relation
+_Predicate = Tuple[_Names, _FilterFunction]
+_JoinStage = Callable[[Iterator[tsdb.Record]], Iterator[tsdb.Record]]
+_Parameters = Union[Sequence[tsdb.Value], Mapping[str, tsdb.Value]]
+# an aggregate function and its column, e.g., ('count', '*')
+_Aggregate = Tuple[str, str]
+# rows being joined, and the cast key values they are joined on
+_Row = Tuple[tsdb.Value, ...]
+_JoinKeys = Tuple[tsdb.Value, ...]
+_Projected = Union[str, _Aggregate]
+
+
+class _Placeholder:
+    """A parameter in a condition whose value is bound later."""
+
+    __slots__ = ('key',)
+
+    def __init__(self, key: Optional[Union[int, str]]) -> None:
+        self.key = key
+
+    def __eq__(self, other):
+        if not isinstance(other, _Placeholder):
+            return NotImplemented
+        return self.key == other.key
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def __repr__(self):
+        if isinstance(self.key, str):
+            return ':' + self.key
+        return '?'
 
 
 class _Record(tsdb.Record):
@@ -65,16 +110,41 @@ class Selection(tsdb.Records):
                  record_class: Optional[Type[_Record]] = None) -> None:
         """
         The results of a 'select' query.
+
+        The rows of a selection may be produced by a pipeline that
+        scans, filters, and joins relations as the selection is
+        iterated. Such a pipeline is run again for each iteration,
+        and it is only run to completion and kept in memory when the
+        :attr:`data` attribute is accessed.
         """
         self.fields: List[tsdb.Field] = []
         self._field_index: tsdb.FieldIndex = {}
-        self.data: tsdb.Records = []
-        self.projection = None
+        self._data: tsdb.Records = []
+        self._pipeline: Optional[Callable[[], Iterator[tsdb.Record]]] = None
+        self.projection: Optional[_Names] = None
         if record_class is None:
             record_class = _Record
         self.record_class = record_class
         self.joined: Set[str] = set()
 
+    @property
+    def data(self) -> tsdb.Records:
+        """The rows of the selection before projection."""
+        if self._pipeline is not None:
+            self._data = list(self._pipeline())
+            self._pipeline = None
+        return self._data
+
+    @data.setter
+    def data(self, data: tsdb.Records) -> None:
+        self._data = data
+        self._pipeline = None
+
+    def _rows(self) -> Iterator[tsdb.Record]:
+        if self._pipeline is not None:
+            return self._pipeline()
+        return iter(self._data)
+
     def __iter__(self) -> Iterator[tsdb.Record]:
         if self.projection is None:
             return self.select()
@@ -90,24 +160,48 @@ class Selection(tsdb.Records):
             indices = [self._field_index[name] for name in names]
         fields = [self.fields[idx] for idx in indices]
         index = tsdb.make_field_index(fields)
+        cast_record = tsdb.get_codec(fields).cast
         cls = self.record_class
-        for record in self.data:
+        for record in self._rows():
             record = getattr(record, 'data', record)  # in case it's a Row
-            data = tuple(record[idx] for idx in indices)
+            data: tsdb.Record = tuple(record[idx] for idx in indices)
             if cast and all(value is None or isinstance(value, str)
                             for value in data):
-                data = typing_cast(Tuple[Optional[str], ...], data)
-                data = tuple(tsdb.cast(field.datatype, value)
-                             for field, value in zip(fields, data))
+                data = cast_record(typing_cast(tsdb.RawRecord, data))
             yield cls(fields, data, field_index=index)
 
 
 # QUERY INSPECTION ############################################################
 
-def inspect_query(querystring: str) -> dict:
+def inspect_query(querystring: str,
+                  db: Optional[tsdb.Database] = None) -> dict:
     """
     Parse *querystring* and return the interpreted query dictionary.
 
+    If *db* is given and the query is a selection, the dictionary
+    also has a `'plan'` key for the steps that would be used to
+    execute the query on *db*. Each step is a dictionary with an
+    `'operation'` key whose value is one of:
+
+    - `'scan'` -- read the first relation
+    - `'join'` -- join another relation on shared keys; the
+      `'build'` key is `'relation'` when a hash table is built over
+      the relation, `'selection'` when it is built over the rows
+      selected so far, and `'index'` when it is built over the rows
+      selected so far and only the records of the relation with the
+      selected keys are read using a key index (see
+      :func:`delphin.tsdb.get_key_index`)
+    - `'filter'` -- filter joined rows by a condition that spans
+      relations
+    - `'aggregate'` -- aggregate rows by the `'group'` columns into
+      the `'columns'`
+    - `'limit'` -- skip `'offset'` rows and stop after `'limit'` rows
+
+    Scans and joins also have the `'relation'`, `'columns'`, and
+    `'condition'` (for conditions filtering the relation as it is
+    scanned) keys, and the `'rows'` key for the estimated number of
+    rows after the step.
+
     Example:
         >>> from delphin import tsql
         >>> from pprint import pprint
@@ -117,8 +211,134 @@ def inspect_query(querystring: str) -> dict:
          'projection': ['i-input'],
          'relations': ['item'],
          'condition': ('<', ('i-id', 100))}
+        >>> pprint(tsql.inspect_query('select i-input where readings > 0',
+        ...                           db)['plan'])
+        [{'columns': ['parse-id', 'i-id'],
+          'condition': ('>', ('parse.readings', 0)),
+          'operation': 'scan',
+          'relation': 'parse',
+          'rows': 1},
+         {'build': 'selection',
+          'columns': ['i-input', 'i-id'],
+          'condition': None,
+          'operation': 'join',
+          'relation': 'item',
+          'rows': 1}]
+    """
+    queryobj = _parse_query(querystring)
+    if db is not None and queryobj['type'] in ('select', 'retrieve'):
+        resolved = _resolve_query(queryobj, db)
+        steps, condition = _make_execution_plan(
+            resolved, db, compile=False,
+            limited=(resolved.limit is not None
+                     and resolved.aggregation is None))
+        queryobj['plan'] = _describe_plan(
+            steps, condition, resolved.aggregation,
+            resolved.limit, resolved.offset or 0)
+    return queryobj
+
+
+def explain(querystring: str,
+            db: tsdb.Database,
+            analyze: bool = False,
+            params: Optional[_Parameters] = None) -> List[dict]:
+    """
+    Return the execution plan of the selection query *querystring*.
+
+    The query is as for :func:`select`, but it may also start with
+    `select` or `retrieve`. The plan is the list of steps described
+    for :func:`inspect_query`, using the values in *params* for the
+    query's parameters. If *analyze* is `True`, the query is also
+    run and each step has the following additional keys:
+
+    - `'actual_rows'` -- the number of rows produced by the step
+    - `'time'` -- the wall time in seconds spent in the step, not
+      including the time spent in the previous steps
+
+    Scans and joins also have the following keys:
+
+    - `'read'` -- the number of records read from the relation
+    - `'hashed'` -- the number of rows in the hash tables of a join
+
+    Example:
+        >>> for step in tsql.explain('i-input where readings > 0', db,
+        ...                          analyze=True):
+        ...     print(step['operation'], step['relation'],
+        ...           step['read'], step['actual_rows'])
+        ...
+        scan parse 3 2
+        join item 3 2
+    """
+    querytype, _, querybody = querystring.lstrip().partition(' ')
+    if querytype.lower() in ('select', 'retrieve'):
+        querystring = querybody
+    resolved = _get_resolved_query(querystring, db)
+    if not analyze:
+        steps, condition = _make_execution_plan(
+            resolved, db, params,
+            limited=(resolved.limit is not None
+                     and resolved.aggregation is None))
+        return _describe_plan(steps, condition, resolved.aggregation,
+                              resolved.limit, resolved.offset or 0)
+    plan: List[dict] = []
+    selection = _select(resolved, db, params, None, stream=True, plan=plan)
+    for _ in selection._rows():
+        pass
+    # the timings include the time of the previous steps until here
+    previous = 0.0
+    for step in plan:
+        step['time'], previous = step['time'] - previous, step['time']
+    return plan
+
+
+def _describe_plan(steps: List['_JoinStep'],
+                   condition: Optional[_Condition],
+                   aggregation: Optional['_Aggregation'],
+                   limit: Optional[int],
+                   offset: int) -> List[dict]:
+    plan: List[dict] = []
+    for step in steps:
+        description = {
+            'operation': 'join' if plan else 'scan',
+            'relation': step.relation,
+            'columns': step.columns,
+            'condition': step.condition,
+            'rows': step.rows,
+        }
+        if plan:
+            description['build'] = step.build
+        plan.append(description)
+    if condition:
+        plan.append({'operation': 'filter', 'condition': condition})
+    if aggregation is not None:
+        plan.append({'operation': 'aggregate',
+                     'group': aggregation.group,
+                     'columns': [name for _, _, name in aggregation.columns]})
+    if limit is not None or offset:
+        plan.append({'operation': 'limit',
+                     'limit': limit,
+                     'offset': offset})
+    return plan
+
+
+def _measure(rows: Iterator[tsdb.Record],
+             step: dict) -> Iterator[tsdb.Record]:
+    """
+    Yield *rows* while counting them and timing their production in
+    the `'actual_rows'` and `'time'` keys of plan *step*.
     """
-    return _parse_query(querystring)
+    step['actual_rows'] = 0
+    step['time'] = 0.0
+    clock = time.perf_counter
+    rows = iter(rows)
+    while True:
+        start = clock()
+        row = next(rows, None)
+        step['time'] += clock() - start
+        if row is None:
+            break
+        step['actual_rows'] += 1
+        yield row
 
 
 # QUERY PROCESSING ############################################################
@@ -140,89 +360,979 @@ def query(querystring: str,
         >>> list(tsql.query('select i-id where i-length < 4', ts))
         [[142], [1061]]
     """
-    queryobj = _parse_query(querystring)
+    querytype, _, querybody = querystring.lstrip().partition(' ')
 
-    if queryobj['type'] in ('select', 'retrieve'):
-        return _select(
-            queryobj['projection'],
-            queryobj['relations'],
-            queryobj['condition'],
+    if querytype.lower() in ('select', 'retrieve'):
+        return select(
+            querybody,
             db,
-            record_class=kwargs.get('record_class', None))
+            record_class=kwargs.get('record_class', None),
+            stream=kwargs.get('stream', False),
+            params=kwargs.get('params', None),
+            limit=kwargs.get('limit', None),
+            offset=kwargs.get('offset', None),
+            cache=kwargs.get('cache', None))
     else:
-        # not really a syntax error; replace with TSQLError or something
-        # when the proper exception class exists
-        raise TSQLSyntaxError(queryobj['type'] + ' queries are not supported',
-                              text=querystring)
+        # raises a syntax error for unsupported queries
+        _parse_query(querystring)
 
 
 def select(querystring: str,
            db: tsdb.Database,
-           record_class: Optional[Type[_Record]] = None) -> Selection:
+           record_class: Optional[Type[_Record]] = None,
+           stream: bool = False,
+           params: Optional[_Parameters] = None,
+           limit: Optional[int] = None,
+           offset: Optional[int] = None,
+           cache: Optional['ResultCache'] = None) -> Selection:
     """
     Perform the TSQL selection query *querystring* on testsuite *ts*.
 
     Note: The `select`/`retrieve` part of the query is not included.
 
+    By default the selected rows are computed before this function
+    returns. If *stream* is `True`, the rows are instead computed as
+    the returned selection is iterated: only the hash tables of
+    joined relations are kept in memory and the first row is
+    available as soon as the relations are scanned up to it. Each
+    iteration over a streamed selection runs the query again.
+
+    Relations are joined in the order that is estimated to be the
+    cheapest, so the order of the selected rows depends on the
+    sizes of the relations and is not otherwise defined. Sort the
+    rows if a particular order is needed.
+
+    The parsed and resolved query is kept in a cache for databases
+    with the same schema, so repeating a query does not parse it
+    again. Queries that differ only by their values can share a
+    cache entry by using parameters (see :func:`prepare`), whose
+    values are given by *params*.
+
+    The *limit* and *offset* arguments are alternatives to the
+    `limit` and `offset` clauses of the query and take precedence
+    over them. Relations are only read until the rows up to the
+    limit are selected, although joins that build a hash table over
+    the rows selected so far must first read all of those rows.
+
+    If *cache* is given, the selected rows are looked up in and
+    stored to the :class:`ResultCache`, so repeating the query on an
+    unchanged database does not read the relations again.
+
     Args:
         querystring: TSQL select query
         db: TSDB database to query over
+        record_class: alternative class for records in the selection
+        stream: if `True`, compute the rows lazily
+        params: values for the query's parameters
+        limit: the maximum number of rows to select
+        offset: the number of rows to skip before selecting rows
+        cache: a cache of query results
     Example:
         >>> list(tsql.select('i-id where i-length < 4', ts))
         [[142], [1061]]
     """
-    queryobj = _parse_select(querystring)
-    return _select(
-        queryobj['projection'],
-        queryobj['relations'],
-        queryobj['condition'],
-        db,
-        record_class=record_class)
+    resolved = _get_resolved_query(querystring, db)
+    return _select(resolved, db, params, record_class, stream,
+                   limit, offset, cache)
 
 
-def _select(projection: _Names,
-            relations: List[str],
-            condition: Optional[_Condition],
-            db: tsdb.Database,
-            record_class: Optional[Type[_Record]]) -> Selection:
+def prepare(querystring: str) -> 'PreparedQuery':
+    """
+    Parse the TSQL selection query *querystring* for repeated use.
+
+    The query is the same as for :func:`select` except that the
+    values in its conditions may be parameters: `?` for positional
+    parameters or `:name` for named parameters. The values of the
+    parameters are given each time the query is run. Syntax errors
+    are raised when the query is prepared, while errors that depend
+    on a database schema, such as undefined columns, are raised when
+    it is run.
+
+    Example:
+        >>> q = tsql.prepare('i-input where i-id = ?')
+        >>> list(q.select(ts, [10]))
+        [('It rained.',)]
+        >>> q = tsql.prepare('i-input where i-length < :n')
+        >>> list(q.select(ts, {'n': 3}))
+        [('Rained.',)]
+    """
+    return PreparedQuery(querystring, _parse_select(querystring))
+
+
+class PreparedQuery:
+    """
+    A TSQL selection query prepared with :func:`prepare`.
+
+    Attributes:
+        querystring: the query string
+        parameters: the positions or names of the query's parameters
+    """
+
+    def __init__(self, querystring: str, queryobj: dict) -> None:
+        self.querystring = querystring
+        self.parameters: List[Union[int, str]] = queryobj.get(
+            'parameters', [])
+        self._queryobj = queryobj
+
+    def __repr__(self) -> str:
+        return f'<{type(self).__name__} {self.querystring!r}>'
+
+    def select(self,
+               db: tsdb.Database,
+               params: Optional[_Parameters] = None,
+               record_class: Optional[Type[_Record]] = None,
+               stream: bool = False,
+               limit: Optional[int] = None,
+               offset: Optional[int] = None,
+               cache: Optional['ResultCache'] = None) -> Selection:
+        """
+        Run the query on *db* with values for its parameters.
+
+        For positional parameters, *params* is a sequence of values
+        in the order of the parameters in the query, and for named
+        parameters it is a mapping of names to values. The other
+        arguments are as for :func:`select`.
+        """
+        if self.parameters and isinstance(self.parameters[0], int):
+            if (isinstance(params, (str, Mapping))
+                    or params is None
+                    or len(params) != len(self.parameters)):
+                raise TSQLError(
+                    f'expected a sequence of {len(self.parameters)} '
+                    f'values for the parameters of {self.querystring!r}')
+        resolved = _get_resolved_query(self.querystring, db, self._queryobj)
+        return _select(resolved, db, params, record_class, stream,
+                       limit, offset, cache)
+
+
+def select_many(
+        querystring: str,
+        dbs: Iterable[tsdb.Database],
+        record_class: Optional[Type[_Record]] = None,
+        params: Optional[_Parameters] = None,
+        limit: Optional[int] = None,
+        offset: Optional[int] = None,
+        workers: Optional[int] = None
+) -> Iterator[Tuple[tsdb.Database, tsdb.Record]]:
+    """
+    Perform the TSQL selection query *querystring* on each of *dbs*.
+
+    The query is run on all databases concurrently by up to
+    *workers* threads (by default, as many as
+    :class:`concurrent.futures.ThreadPoolExecutor` uses). The
+    selected rows are paired with the database they were selected
+    from and are yielded in the order of *dbs*: all rows of a
+    database are yielded before those of the next one. Rows are not
+    interleaved, so only part of the work overlaps: each database
+    builds its hash tables and reads ahead up to 4096 rows
+    concurrently, and then waits until the rows of the databases
+    before it have been yielded. The *limit* and *offset* apply to
+    each database separately, as for :func:`select`; see
+    :func:`select_union` for selecting from the union of the
+    databases.
+
+    Args:
+        querystring: TSQL select query
+        dbs: TSDB databases to query over
+        record_class: alternative class for records in the selection
+        params: values for the query's parameters
+        limit: the maximum number of rows to select from each database
+        offset: the number of rows to skip in each database
+        workers: the maximum number of databases queried at once
+    Example:
+        >>> dbs = [tsdb.Database(path) for path in profile_paths]
+        >>> for db, (i_id,) in tsql.select_many('i-id where readings = 0',
+        ...                                     dbs):
+        ...     print(db.path.name, i_id)
+        ...
+        grammar-1.0 20
+        grammar-1.1 20
+        grammar-1.1 50
+    """
+    dbs = list(dbs)
+    # the queries are resolved now so errors are raised immediately
+    selections = [
+        _select(_get_resolved_query(querystring, db), db, params,
+                record_class, stream=True, limit=limit, offset=offset)
+        for db in dbs]
+    sources = [selection.__iter__ for selection in selections]
+    return ((dbs[i], record)
+            for i, record in _concurrent_rows(sources, workers))
+
+
+def select_union(querystring: str,
+                 dbs: Iterable[tsdb.Database],
+                 record_class: Optional[Type[_Record]] = None,
+                 stream: bool = False,
+                 params: Optional[_Parameters] = None,
+                 limit: Optional[int] = None,
+                 offset: Optional[int] = None,
+                 workers: Optional[int] = None) -> Selection:
+    """
+    Perform the TSQL selection query *querystring* on the union of
+    *dbs*.
+
+    The result is like that of :func:`select` on a single database
+    containing the records of all of *dbs*: the rows of each
+    database follow those of the previous ones, aggregate functions
+    are computed over the rows of all databases, and the *limit* and
+    *offset* apply to the union of the rows. As for
+    :func:`select_many`, the query is run on the databases
+    concurrently, and the rows of later databases are read ahead
+    while those of earlier ones are produced, except when the number
+    of rows is limited: then the databases are read one after
+    another so that later databases are not read at all once enough
+    rows are selected.
+
+    The databases need not have the same schema, but the query must
+    be valid for each of them.
+
+    Args:
+        querystring: TSQL select query
+        dbs: TSDB databases to query over
+        record_class: alternative class for records in the selection
+        stream: if `True`, compute the rows lazily
+        params: values for the query's parameters
+        limit: the maximum number of rows to select
+        offset: the number of rows to skip before selecting rows
+        workers: the maximum number of databases queried at once
+    Example:
+        >>> list(tsql.select_union('count(*) from item', dbs))
+        [('2894',)]
+    """
+    dbs = list(dbs)
+    if not dbs:
+        raise TSQLError('no databases to select from')
+    resolved = [_get_resolved_query(querystring, db) for db in dbs]
+    first = resolved[0]
+    if limit is None:
+        limit = first.limit
+    if offset is None:
+        offset = first.offset or 0
+    if (limit is not None and limit < 0) or offset < 0:
+        raise TSQLError('limit and offset must not be negative')
+
+    # no database contributes more rows than the union needs
+    part_limit = None
+    if limit is not None and first.aggregation is None:
+        part_limit = offset + limit
+    parts = [_select(res._replace(aggregation=None, limit=None, offset=None),
+                     db, params, None, stream=True, limit=part_limit)
+             for res, db in zip(resolved, dbs)]
+
+    # the rows of each database are rearranged to match the fields of
+    # the first, whose joins may be in a different order
+    template = parts[0]
+    qnames = _qualified_names(template)
+    sources = []
+    for part in parts:
+        mapping = [part._field_index[qname] for qname in qnames]
+        if mapping == list(range(len(mapping))):
+            sources.append(part._rows)
+        else:
+            sources.append(_rearranged(part._rows, mapping))
+
+    def pipeline() -> Iterator[tsdb.Record]:
+        if part_limit is not None:
+            return itertools.chain.from_iterable(
+                source() for source in sources)
+        return (row for _, row in _concurrent_rows(sources, workers))
 
-    proj, joins, condition = _make_execution_plan(
-        projection, relations, condition, db)
     selection = Selection(record_class=record_class)
+    selection.fields = template.fields
+    selection._field_index = template._field_index
+    selection.joined = template.joined
+    if first.aggregation is not None:
+        selection, pipeline = _aggregate(
+            selection, pipeline, first.aggregation, first.fields,
+            record_class)
+    else:
+        selection.projection = first.projection
 
-    for name, columns in joins:
-        _join(selection, db, name, columns, 'inner')
+    if limit is not None or offset:
+        stop = None if limit is None else offset + limit
+        unlimited = pipeline
 
+        def pipeline() -> Iterator[tsdb.Record]:
+            return itertools.islice(unlimited(), offset, stop)
+
+    if stream:
+        selection._pipeline = pipeline
+    else:
+        selection.data = list(pipeline())
+    return selection
+
+
+def _qualified_names(selection: Selection) -> List[str]:
+    """Return a qualified name for each field of *selection*."""
+    qnames: List[str] = [''] * len(selection.fields)
+    for name, i in selection._field_index.items():
+        if '.' in name and not qnames[i]:
+            qnames[i] = name
+    return qnames
+
+
+def _rearranged(
+        rows: Callable[[], Iterator[tsdb.Record]],
+        mapping: List[int]
+) -> Callable[[], Iterator[tsdb.Record]]:
+    def rearrange() -> Iterator[tsdb.Record]:
+        for row in rows():
+            yield tuple([row[idx] for idx in mapping])
+    return rearrange
+
+
+# the number of rows passed between threads at once and the number of
+# such batches read ahead for each database
+_CONCURRENT_BATCH_SIZE = 256
+_CONCURRENT_BATCHES = 16
+
+
+def _concurrent_rows(
+        sources: List[Callable[[], Iterator[Any]]],
+        workers: Optional[int] = None
+) -> Iterator[Tuple[int, Any]]:
+    """
+    Yield the position of each of *sources* paired with each of its
+    rows, running the sources concurrently in threads.
+
+    All rows of a source are yielded before those of the next one.
+    Later sources only read ahead a bounded number of rows, and they
+    are stopped when the returned iterator is closed.
+    """
+    stop = threading.Event()
+    queues: List[queue.Queue] = [
+        queue.Queue(maxsize=_CONCURRENT_BATCHES) for _ in sources]
+
+    def put(q: queue.Queue, item: Any) -> bool:
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def run(source: Callable[[], Iterator[Any]], q: queue.Queue) -> None:
+        try:
+            rows = source()
+            while True:
+                batch = list(itertools.islice(rows, _CONCURRENT_BATCH_SIZE))
+                if not batch:
+                    break
+                if not put(q, batch):
+                    return
+        except BaseException as exc:
+            put(q, exc)
+        else:
+            put(q, None)
+
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        # sources are started in order, so each one is running by
+        # the time its rows are needed
+        for source, q in zip(sources, queues):
+            executor.submit(run, source, q)
+        for i, q in enumerate(queues):
+            while True:
+                item = q.get()
+                if item is None:
+                    break
+                elif isinstance(item, BaseException):
+                    raise item
+                for row in item:
+                    yield i, row
+    finally:
+        stop.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _select(resolved: '_ResolvedQuery',
+            db: tsdb.Database,
+            params: Optional[_Parameters],
+            record_class: Optional[Type[_Record]],
+            stream: bool = False,
+            limit: Optional[int] = None,
+            offset: Optional[int] = None,
+            cache: Optional['ResultCache'] = None,
+            plan: Optional[List[dict]] = None) -> Selection:
+    # if *plan* is given, it is filled with the description of the
+    # execution plan and the rows are counted and timed in each step
+
+    if limit is None:
+        limit = resolved.limit
+    if offset is None:
+        offset = resolved.offset or 0
+    if (limit is not None and limit < 0) or offset < 0:
+        raise TSQLError('limit and offset must not be negative')
+
+    steps, condition = _make_execution_plan(
+        resolved, db, params,
+        limited=limit is not None and resolved.aggregation is None)
+    selection = Selection(record_class=record_class)
+
+    # the described steps in the order of the plan: joins, then the
+    # filter, aggregation, and limit if the query has them
+    described: List[Optional[dict]] = [None] * (len(steps) + 3)
+    if plan is not None:
+        plan.extend(_describe_plan(steps, condition, resolved.aggregation,
+                                   limit, offset))
+        described = list(plan)
+    described.reverse()
+    join_stats = [described.pop() for _ in steps]
+
+    stages = [_join(selection, db, step.relation, step.columns, 'inner',
+                    where=step.where, build=step.build,
+                    condition=step.condition, stats=stats)
+              for step, stats in zip(steps, join_stats)]
+
+    cond: Optional[_FilterFunction] = None
+    filter_stats: Optional[dict] = None
     if condition:
-        cond = _process_condition_function(condition, selection)
-        selection.data = list(filter(cond, selection.data))
+        cond = _process_condition_function(
+            condition, selection._field_index, selection.fields)
+        filter_stats = described.pop()
+
+    def pipeline() -> Iterator[tsdb.Record]:
+        rows: Iterator[tsdb.Record] = iter(())
+        for stage, stats in zip(stages, join_stats):
+            rows = stage(rows)
+            if stats is not None:
+                rows = _measure(rows, stats)
+        if cond is not None:
+            rows = filter(cond, rows)
+            if filter_stats is not None:
+                rows = _measure(rows, filter_stats)
+        return rows
+
+    if resolved.aggregation is not None:
+        selection, pipeline = _aggregate(
+            selection, pipeline, resolved.aggregation, resolved.fields,
+            record_class)
+        aggregate_stats = described.pop()
+        if aggregate_stats is not None:
+            aggregated = pipeline
+
+            def pipeline() -> Iterator[tsdb.Record]:
+                return _measure(aggregated(), aggregate_stats)
+    else:
+        selection.projection = resolved.projection
+
+    if limit is not None or offset:
+        stop = None if limit is None else offset + limit
+        unlimited = pipeline
+        limit_stats = described.pop()
+
+        def pipeline() -> Iterator[tsdb.Record]:
+            # stopping early also stops the scans and joins
+            rows: Iterator[tsdb.Record] = itertools.islice(
+                unlimited(), offset, stop)
+            if limit_stats is not None:
+                rows = _measure(rows, limit_stats)
+            return rows
+
+    if cache is not None:
+        entry = _result_entry(resolved, steps, condition, db, limit, offset)
+        if entry is not None:
+            rows = cache._get(*entry)
+            if rows is not None:
+                selection.data = list(rows)
+                return selection
+            pipeline = cache._storing(entry, pipeline)
+
+    if stream:
+        selection._pipeline = pipeline
+    else:
+        selection.data = list(pipeline())
 
-    selection.projection = proj
     return selection
 
 
-def _make_execution_plan(
-        projection: _Names,
-        relations: List[str],
-        condition: Optional[_Condition],
-        db: tsdb.Database) -> Tuple:
-    """Make a plan for all relations to join and columns to keep."""
+def _result_entry(resolved: '_ResolvedQuery',
+                  steps: List['_JoinStep'],
+                  condition: Optional[_Condition],
+                  db: tsdb.Database,
+                  limit: Optional[int],
+                  offset: int) -> Optional[Tuple[str, str]]:
+    """
+    Return the key and fingerprint of the result of a query plan.
+
+    The key is the normalized plan, which includes the join order
+    and the bound parameter values, and the fingerprint is the size
+    and modification time of every relation file that is read. If a
+    relation file does not exist, `None` is returned.
+    """
+    key = repr((
+        str(db.path.resolve()),
+        db.encoding,
+        _schema_key(db.schema),
+        [(step.relation, step.columns, step.build, step.condition)
+         for step in steps],
+        condition,
+        resolved.aggregation,
+        limit,
+        offset,
+    ))
+    fingerprint = []
+    for step in steps:
+        try:
+            path = tsdb.get_path(db.path, step.relation)
+        except tsdb.TSDBError:
+            return None
+        fingerprint.append((path.name, *tsdb._fingerprint(path)))
+    return key, repr(fingerprint)
+
+
+class ResultCache:
+    """
+    A cache of the results of TSQL selection queries.
+
+    Results are cached by the query, including its parameter values,
+    and the size and modification time of every relation file that
+    the query reads, so any change to those files invalidates the
+    cached result. Up to *maxsize* results are kept in memory and the
+    least recently used ones are evicted first. If *path* is given,
+    results are also stored as files in that directory so they are
+    available to later processes, such as other invocations of
+    `delphin select`. Results with more than *max_rows* rows are not
+    cached.
+
+    A result cache is used by passing it as the *cache* argument of
+    :func:`select`, :func:`query`, or :meth:`PreparedQuery.select`.
+
+    Args:
+        maxsize: the maximum number of results kept in memory
+        path: directory where results are also stored
+        max_rows: the maximum number of rows of a cached result
+    Example:
+        >>> cache = tsql.ResultCache(path='~/.cache/tsql')
+        >>> rows = tsql.select('i-id where readings = 0', ts, cache=cache)
+    """
+
+    def __init__(self,
+                 maxsize: int = 128,
+                 path: Optional[util.PathLike] = None,
+                 max_rows: int = 100000) -> None:
+        self.maxsize = maxsize
+        self.path = None if path is None else Path(path).expanduser()
+        self.max_rows = max_rows
+        self._results: 'OrderedDict[str, Tuple[str, List[tsdb.Record]]]' = (
+            OrderedDict())
+
+    def __len__(self) -> int:
+        return len(self._results)
+
+    def clear(self) -> None:
+        """Remove all cached results from memory and from disk."""
+        self._results.clear()
+        if self.path is not None and self.path.is_dir():
+            for file in self.path.glob('*' + _RESULT_SUFFIX):
+                file.unlink()
+
+    def _get(self,
+             key: str,
+             fingerprint: str) -> Optional[List[tsdb.Record]]:
+        cached = self._results.get(key)
+        if cached is not None and cached[0] == fingerprint:
+            self._results.move_to_end(key)
+            return cached[1]
+        rows = self._read(key, fingerprint)
+        if rows is not None:
+            self._remember(key, fingerprint, rows)
+        return rows
+
+    def _put(self,
+             key: str,
+             fingerprint: str,
+             rows: List[tsdb.Record]) -> None:
+        self._remember(key, fingerprint, rows)
+        self._write(key, fingerprint, rows)
+
+    def _remember(self,
+                  key: str,
+                  fingerprint: str,
+                  rows: List[tsdb.Record]) -> None:
+        self._results[key] = (fingerprint, rows)
+        self._results.move_to_end(key)
+        while len(self._results) > self.maxsize:
+            self._results.popitem(last=False)
+
+    def _storing(
+            self,
+            entry: Tuple[str, str],
+            pipeline: Callable[[], Iterator[tsdb.Record]]
+    ) -> Callable[[], Iterator[tsdb.Record]]:
+        """Wrap *pipeline* to cache its rows once they are all read."""
+        def storing_pipeline() -> Iterator[tsdb.Record]:
+            rows: Optional[List[tsdb.Record]] = []
+            for row in pipeline():
+                if rows is not None:
+                    rows.append(tuple(row))
+                    if len(rows) > self.max_rows:
+                        rows = None
+                yield row
+            if rows is not None:
+                self._put(*entry, rows)
+
+        return storing_pipeline
+
+    def _file(self, key: str) -> Path:
+        assert self.path is not None
+        return self.path / (_digest(key) + _RESULT_SUFFIX)
+
+    def _read(self,
+              key: str,
+              fingerprint: str) -> Optional[List[tsdb.Record]]:
+        # the first line of a result file identifies the relation
+        # files the rows came from
+        if self.path is None:
+            return None
+        try:
+            with self._file(key).open(encoding='utf-8', newline='\n') as fh:
+                if fh.readline() != _digest(fingerprint) + '\n':
+                    return None
+                return [tsdb.split(line) for line in fh]
+        except (OSError, UnicodeError):
+            return None
+
+    def _write(self,
+               key: str,
+               fingerprint: str,
+               rows: List[tsdb.Record]) -> None:
+        if self.path is None:
+            return
+        file = self._file(key)
+        temp = file.with_name(f'{file.name}.{os.getpid()}.tmp')
+        try:
+            self.path.mkdir(parents=True, exist_ok=True)
+            with temp.open('w', encoding='utf-8', newline='\n') as fh:
+                fh.write(_digest(fingerprint) + '\n')
+                for row in rows:
+                    fh.write(tsdb.join(row) + '\n')
+            # replace the file at once so readers never see a partial
+            # result
+            os.replace(temp, file)
+        except (OSError, UnicodeError):
+            if temp.exists():
+                temp.unlink()
+
+
+_RESULT_SUFFIX = '.rows'
+
+
+def _digest(string: str) -> str:
+    return hashlib.sha256(string.encode('utf-8')).hexdigest()
+
+
+class _ResolvedQuery(NamedTuple):
+    """A selection query resolved against a database schema."""
+    projection: _Names
+    joinmap: Dict[str, _Names]  # relations and columns to join
+    keymap: Dict[str, _Names]  # key columns of each relation
+    pushed: Dict[str, _Condition]  # conditions for single relations
+    condition: Optional[_Condition]  # conditions spanning relations
+    fields: Dict[str, tsdb.Field]  # fields of the condition columns
+    parameters: List[Union[int, str]]
+    aggregation: Optional['_Aggregation']
+    limit: Optional[int]
+    offset: Optional[int]
+
+
+_PLAN_CACHE_SIZE = 128
+_plan_cache: 'OrderedDict[Tuple[str, str], _ResolvedQuery]' = OrderedDict()
+_schema_keys: Dict[int, Tuple[tsdb.Schema, str]] = {}
+
+
+def _get_resolved_query(querystring: str,
+                        db: tsdb.Database,
+                        queryobj: Optional[dict] = None) -> _ResolvedQuery:
+    """
+    Return the resolved selection query *querystring* for *db*.
+
+    Resolved queries are kept in a least-recently-used cache keyed by
+    the query string and the schema of the database. If the query is
+    not cached, it is parsed, unless it was already parsed as
+    *queryobj*, and resolved.
+    """
+    key = (querystring, _schema_key(db.schema))
+    resolved = _plan_cache.get(key)
+    if resolved is not None:
+        _plan_cache.move_to_end(key)
+        return resolved
+
+    if queryobj is None:
+        queryobj = _parse_select(querystring)
+    resolved = _resolve_query(queryobj, db)
+
+    _plan_cache[key] = resolved
+    if len(_plan_cache) > _PLAN_CACHE_SIZE:
+        _plan_cache.popitem(last=False)
+    return resolved
+
+
+def _schema_key(schema: tsdb.Schema) -> str:
+    """Return a string that identifies the fields of *schema*."""
+    memoized = _schema_keys.get(id(schema))
+    if memoized is not None and memoized[0] is schema:
+        return memoized[1]
+    key = tsdb._format_schema(schema)
+    if len(_schema_keys) >= 64:
+        _schema_keys.clear()
+    _schema_keys[id(schema)] = (schema, key)
+    return key
+
+
+def _resolve_query(queryobj: dict, db: tsdb.Database) -> _ResolvedQuery:
+    """
+    Resolve the columns and relations of the query *queryobj* against
+    *db*.
+
+    Column names are qualified with their relations and the
+    relations and columns that need to be joined are found. Parts of
+    the condition that only use the columns of a single relation are
+    separated so they can be pushed down to the scan of that
+    relation, filtering its records before they are joined. This
+    only depends on the schema of *db*; the values of parameters and
+    the order of joins are decided by :func:`_make_execution_plan`.
+    """
+    relations: List[str] = queryobj['relations']
+    condition: Optional[_Condition] = queryobj['condition']
     resolve_qname = _make_qname_resolver(db, relations)
 
-    if projection == ['*']:
+    aggregation: Optional[_Aggregation] = None
+    fields: Dict[str, tsdb.Field] = {}
+    if queryobj['projection'] == ['*']:
         projection = _project_all(relations, db)
+    elif 'group' in queryobj or any(isinstance(item, tuple)
+                                    for item in queryobj['projection']):
+        aggregation = _resolve_aggregation(
+            queryobj['projection'], queryobj.get('group', []),
+            resolve_qname, fields)
+        # the joined columns are the grouped and aggregated columns
+        projection = list(fields)
     else:
-        projection = [resolve_qname(name)[0] for name in projection]
+        projection = [resolve_qname(name)[0]
+                      for name in queryobj['projection']]
 
+    pushed: Dict[str, _Condition] = {}
     cond_resolved: Optional[_Condition] = None
     cond_fields: _Names = []
     if condition:
-        cond_resolved, cond_fields = _process_condition_fields(
+        cond_resolved, qnames = _process_condition_fields(
             condition, resolve_qname)
+        for qname in qnames:
+            fields.setdefault(qname, resolve_qname(qname)[1])
+        pushed, cond_resolved = _push_down_conditions(cond_resolved)
+        if cond_resolved:
+            cond_fields = sorted(_condition_qnames(cond_resolved))
+
+    # relations with pushed-down conditions must be joined even when
+    # none of their columns are kept
+    relations = relations + [rel for rel in pushed if rel not in relations]
+    joinmap, keymap = _map_joins(projection, cond_fields, relations, db)
+    if not joinmap:
+        raise TSQLError('no relations to select from')
+
+    return _ResolvedQuery(projection, joinmap, keymap, pushed,
+                          cond_resolved, fields,
+                          queryobj.get('parameters', []), aggregation,
+                          queryobj.get('limit'), queryobj.get('offset'))
+
+
+def _resolve_aggregation(projection: List[_Projected],
+                         group: _Names,
+                         resolve_qname: _QNameResolver,
+                         fieldmap: Dict[str, tsdb.Field]) -> '_Aggregation':
+    """
+    Resolve the grouped and aggregated columns of a query.
+
+    The fields of the columns are added to *fieldmap*.
+    """
+    group_qnames = []
+    for name in group:
+        qname, field = resolve_qname(name)
+        fieldmap[qname] = field
+        group_qnames.append(qname)
+
+    columns: List[Tuple[Optional[str], Optional[str], str]] = []
+    for item in projection:
+        if isinstance(item, tuple):
+            function, name = item
+            if name == '*':
+                columns.append((function, None, f'{function}(*)'))
+                continue
+            qname, field = resolve_qname(name)
+            if (function in ('sum', 'avg')
+                    and field.datatype not in (':integer', ':float')):
+                raise TSQLError(
+                    f'cannot use {function}() on non-numeric column: '
+                    f'{qname}')
+            fieldmap[qname] = field
+            columns.append((function, qname, f'{function}({name})'))
+        else:
+            qname = resolve_qname(item)[0]
+            if qname not in group_qnames:
+                raise TSQLError(
+                    f'column must be grouped or aggregated: {qname}')
+            columns.append((None, qname, qname))
+
+    return _Aggregation(group_qnames, columns)
+
+
+def _make_execution_plan(
+        resolved: _ResolvedQuery,
+        db: tsdb.Database,
+        params: Optional[_Parameters] = None,
+        compile: bool = True,
+        limited: bool = False
+) -> Tuple[List['_JoinStep'], Optional[_Condition]]:
+    """
+    Make a plan for all relations to join and columns to keep.
+
+    The values in *params* are bound to the parameters of the query
+    and the joins are ordered by the current sizes of the relations.
+    Joins with hashed selections use key indexes when available, as
+    do all joins when the results are *limited* because key index
+    joins can stop before all rows are selected.
+    Unless *compile* is `False`, conditions pushed down to the scans
+    of relations are compiled into predicates. The returned plan has
+    the list of join steps and the remaining condition, if any.
+    """
+    pushed = resolved.pushed
+    condition = resolved.condition
+    if compile and resolved.parameters:
+        pushed = {rel: _bind_parameters(cond, params, resolved.fields)
+                  for rel, cond in pushed.items()}
+        if condition:
+            condition = _bind_parameters(condition, params, resolved.fields)
+
+    joins = _order_joins(resolved.joinmap, resolved.keymap, db, pushed)
+
+    steps = []
+    joined_keys: Set[str] = set()
+    for rel, columns, build, rows in joins:
+        use_index = build == 'selection' or (limited and build != 'scan')
+        if use_index and not db.cache:
+            lookup = _KeyLookup(db, rel)
+            if any(lookup.index(key) is not None
+                   for key in resolved.keymap[rel] if key in joined_keys):
+                build = 'index'
+        joined_keys.update(resolved.keymap[rel])
+        pushed_cond = pushed.get(rel)
+        where = None
+        if pushed_cond and compile:
+            where = _compile_predicate(pushed_cond, resolved.fields)
+        steps.append(_JoinStep(rel, columns, build, rows, pushed_cond, where))
+
+    return steps, condition
+
+
+class _JoinStep(NamedTuple):
+    relation: str
+    columns: _Names
+    build: str  # 'scan', 'relation', 'selection', or 'index'
+    rows: int  # estimated
+    condition: Optional[_Condition]  # pushed down
+    where: Optional[_Predicate]  # compiled from condition
+
+
+def _bind_parameters(condition: _Condition,
+                     params: Optional[_Parameters],
+                     fields: Dict[str, tsdb.Field]) -> _Condition:
+    """Replace the parameters in *condition* with values in *params*."""
+    op, body = condition
+    if op in ('and', 'or'):
+        body = typing_cast(List[_Condition], body)
+        return (op, [_bind_parameters(cond, params, fields)
+                     for cond in body])
+    elif op == 'not':
+        return ('not', _bind_parameters(body, params, fields))
+
+    qname, value = body
+    if not isinstance(value, _Placeholder):
+        return condition
+    placeholder = value
+    try:
+        value = params[placeholder.key]  # type: ignore
+    except (KeyError, IndexError, TypeError):
+        raise TSQLError(
+            f'no value bound for parameter {placeholder!r}') from None
+    if (op in ('~', '!~') and not isinstance(value, str)
+            or op in ('<', '<=', '>', '>=') and isinstance(value, str)):
+        raise TSQLError(
+            f'invalid value for parameter {placeholder!r} with {op}: '
+            f'{value!r}')
+    _check_condition_type(op, qname, fields[qname], value)
+    return (op, (qname, value))
+
+
+def _conjuncts(condition: _Condition) -> List[_Condition]:
+    """Return the list of conditions that are conjoined by *condition*."""
+    op, body = condition
+    if op == 'and':
+        body = typing_cast(List[_Condition], body)
+        conjuncts = []
+        for cond in body:
+            conjuncts.extend(_conjuncts(cond))
+        return conjuncts
+    return [condition]
 
-    joins = _plan_joins(projection, cond_fields, relations, db)
 
-    return projection, joins, cond_resolved
+def _conjoin(conditions: List[_Condition]) -> Optional[_Condition]:
+    if not conditions:
+        return None
+    elif len(conditions) == 1:
+        return conditions[0]
+    return ('and', conditions)
+
+
+def _condition_qnames(condition: _Condition) -> Set[str]:
+    op, body = condition
+    if op in ('and', 'or'):
+        body = typing_cast(List[_Condition], body)
+        return set().union(*(_condition_qnames(cond) for cond in body))
+    elif op == 'not':
+        return _condition_qnames(body)
+    else:
+        return {body[0]}
+
+
+def _push_down_conditions(
+        condition: _Condition
+) -> Tuple[Dict[str, _Condition], Optional[_Condition]]:
+    """
+    Separate the parts of *condition* that only use one relation.
+
+    The conjoined conditions that only use the columns of a single
+    relation are returned in a mapping of relation names to
+    conditions. The conditions that span relations are returned as
+    the remaining condition.
+    """
+    by_relation: Dict[str, List[_Condition]] = {}
+    remaining: List[_Condition] = []
+    for cond in _conjuncts(condition):
+        rels = {qname.rpartition('.')[0]
+                for qname in _condition_qnames(cond)}
+        if len(rels) == 1:
+            by_relation.setdefault(rels.pop(), []).append(cond)
+        else:
+            remaining.append(cond)
+    pushed = {rel: typing_cast(_Condition, _conjoin(conds))
+              for rel, conds in by_relation.items()}
+    return pushed, _conjoin(remaining)
+
+
+def _compile_predicate(condition: _Condition,
+                       fieldmap: Dict[str, tsdb.Field]) -> _Predicate:
+    """
+    Compile *condition* into a predicate over the raw values of the
+    columns it uses.
+    """
+    qnames = sorted(_condition_qnames(condition))
+    field_index = {qname: i for i, qname in enumerate(qnames)}
+    fields = [fieldmap[qname] for qname in qnames]
+    func = _process_condition_function(condition, field_index, fields)
+    return [qname.rpartition('.')[2] for qname in qnames], func
 
 
 def _project_all(relations: List[str], db: tsdb.Database) -> List[str]:
@@ -274,7 +1384,7 @@ def _make_qname_resolver(
     return resolve
 
 
-def _plan_joins(projection, condition_fields, relations, db):
+def _map_joins(projection, condition_fields, relations, db):
     """
     Calculate the relations and columns needed for the query.
     """
@@ -297,23 +1407,145 @@ def _plan_joins(projection, condition_fields, relations, db):
                 qname = f'{relation}.{field.name}'
                 if qname not in added:
                     joinmap.setdefault(relation, []).append(field.name)
-    # finally ensure joins occur in a valid order
-    joined_keys = set()
+
+    return joinmap, keymap
+
+
+def _order_joins(joinmap, keymap, db, pushed=()):
+    """
+    Order the relations in *joinmap* for joining.
+
+    The relations are ordered by estimates of their sizes and of the
+    sizes of their joins (see :func:`_relation_stats`): the smallest
+    relation is scanned first and then the relation that gives the
+    smallest join is joined next. For each join, the smaller of the
+    relation and the rows selected so far is used to build the hash
+    table. Relations with conditions in *pushed* are assumed to be
+    reduced by the conditions.
+    """
+    stats = {rel: _relation_stats(db, rel) for rel in joinmap}
+    sizes = {rel: stats[rel].rows * (_PUSHDOWN_SELECTIVITY
+                                     if rel in pushed else 1.0)
+             for rel in joinmap}
+
+    # ensure joins occur in a valid order
+    joinmap = dict(joinmap)
+    joined_keys: Dict[str, float] = {}  # estimated distinct values
+    size = 0.0
     joins = []
     while joinmap:
-        changed = False
-        for rel in list(joinmap):
-            if not joins or joined_keys.intersection(joinmap[rel]):
-                joins.append((rel, joinmap.pop(rel)))
-                joined_keys.update(keymap[rel])
-                changed = True
-                break
-        if not changed:
+        candidates = [rel for rel in joinmap
+                      if not joins or joined_keys.keys() & set(joinmap[rel])]
+        if not candidates:
             raise TSQLError('infinite loop detected!')
+        if not joins:
+            # min() picks the first of equal estimates, which keeps
+            # the order of the projection
+            rel = min(candidates, key=sizes.__getitem__)
+            estimate, build = sizes[rel], 'scan'
+        else:
+            estimates = {
+                rel: _estimate_join_size(size, joined_keys,
+                                         sizes[rel], stats[rel])
+                for rel in candidates}
+            rel = min(candidates, key=estimates.__getitem__)
+            estimate = estimates[rel]
+            build = 'relation' if sizes[rel] <= size else 'selection'
+        joins.append((rel, list(joinmap.pop(rel)), build, round(estimate)))
+        for key in keymap[rel]:
+            distinct = min(stats[rel].distinct.get(key, 1.0) * sizes[rel],
+                           estimate)
+            joined_keys[key] = min(joined_keys.get(key, distinct), distinct)
+        size = estimate
 
     return joins
 
 
+# the assumed fraction of rows kept by a pushed-down condition
+_PUSHDOWN_SELECTIVITY = 0.25
+
+
+class _RelationStats(NamedTuple):
+    rows: float
+    # ratio of distinct values to rows for key columns
+    distinct: Dict[str, float]
+
+
+_stats_memo: Dict[Tuple[str, str], Tuple[Tuple, _RelationStats]] = {}
+
+
+def _relation_stats(db: tsdb.Database, name: str) -> _RelationStats:
+    """
+    Estimate the number of rows and key cardinalities of relation
+    *name*.
+
+    When the relation has valid statistics (see
+    :func:`delphin.tsdb.get_statistics`), they give the number of
+    rows and distinct key values. Otherwise the number of rows is the
+    length of the relation's line index if it has one, or it is
+    extrapolated from a sample of lines at the start of the file (see
+    :func:`delphin.tsdb.sample_lines`), as are the ratios of distinct
+    key values. Estimates are kept until the file changes.
+    """
+    try:
+        path = tsdb.get_path(db.path, name)
+    except tsdb.TSDBError:
+        return _RelationStats(0.0, {})
+    stat = path.stat()
+    memo_key = (str(db.path), name)
+    fingerprint = (str(path), stat.st_size, stat.st_mtime_ns)
+    memoized = _stats_memo.get(memo_key)
+    if memoized is not None and memoized[0] == fingerprint:
+        return memoized[1]
+
+    relstats = tsdb.get_statistics(db.path, name, db.schema[name],
+                                   build=False, encoding=db.encoding)
+    if relstats is not None:
+        rows = float(relstats.rows)
+        distinct = {column: relstats.distinct(column) / rows
+                    for column in relstats.sketches if rows}
+        stats = _RelationStats(rows, distinct)
+    else:
+        stats = _sample_relation_stats(db, name)
+
+    if len(_stats_memo) >= 256:
+        _stats_memo.clear()
+    _stats_memo[memo_key] = (fingerprint, stats)
+    return stats
+
+
+def _sample_relation_stats(db: tsdb.Database, name: str) -> _RelationStats:
+    """Estimate relation statistics from a sample of lines."""
+    lines, share = tsdb.sample_lines(db.path, name, encoding=db.encoding)
+    offsets = tsdb.get_line_index(db.path, name, build=False)
+    if offsets is not None:
+        rows = float(len(offsets))
+    else:
+        rows = len(lines) / share
+    records = [tsdb.split(line) for line in lines]
+    distinct = {}
+    for i, field in enumerate(db.schema[name]):
+        if field.is_key and records:
+            values = {record[i] for record in records if i < len(record)}
+            distinct[field.name] = len(values) / len(records)
+    return _RelationStats(rows, distinct)
+
+
+def _estimate_join_size(left_rows: float,
+                        left_keys: Dict[str, float],
+                        right_rows: float,
+                        right_stats: _RelationStats) -> float:
+    """
+    Estimate the size of a join as the product of the sizes divided
+    by the largest number of distinct values of a shared key.
+    """
+    divisor = 1.0
+    for key, ratio in right_stats.distinct.items():
+        if key in left_keys:
+            divisor = max(divisor, left_keys[key], ratio * right_rows)
+    return left_rows * right_rows / divisor
+
+
 def _make_keymap(db):
     keymap = {}
     for rel, _fields in db.schema.items():
@@ -396,16 +1628,25 @@ def _process_condition_fields(
     else:
         qname, field = resolve_qname(body[0])
 
-        # check if the condition's type matches the column
-        typ = _expected_type(field.datatype)
-        if not isinstance(body[1], typ):
-            raise TSQLError(
-                'type mismatch in condition on {}: {} {} {}'
-                .format(qname, typ.__name__, op, type(body[1]).__name__))
+        # parameters are checked when their values are bound
+        if not isinstance(body[1], _Placeholder):
+            _check_condition_type(op, qname, field, body[1])
 
         return (op, (qname, body[1])), [qname]
 
 
+def _check_condition_type(op: str,
+                          qname: str,
+                          field: tsdb.Field,
+                          value: tsdb.Value) -> None:
+    """Check if the type of a condition's value matches the column."""
+    typ = _expected_type(field.datatype)
+    if not isinstance(value, typ):
+        raise TSQLError(
+            'type mismatch in condition on {}: {} {} {}'
+            .format(qname, typ.__name__, op, type(value).__name__))
+
+
 def _expected_type(datatype):
     if datatype == ':string':
         return str
@@ -419,9 +1660,14 @@ def _expected_type(datatype):
 
 def _process_condition_function(
         condition: _Condition,
-        selection: Selection) -> _FilterFunction:
-    field_index = selection._field_index
-    fields = selection.fields
+        field_index: tsdb.FieldIndex,
+        fields: tsdb.Fields) -> _FilterFunction:
+    """
+    Compile *condition* into a function over raw rows.
+
+    The column of each comparison is looked up in *field_index* and
+    *fields* once, when the function is created.
+    """
     # conditions are something like:
     #  ('==', ('i-id', 11))
     op, body = condition
@@ -429,60 +1675,366 @@ def _process_condition_function(
         body = typing_cast(List[_Condition], body)
         conditions = []
         for cond in body:
-            _func = _process_condition_function(cond, selection)
+            _func = _process_condition_function(cond, field_index, fields)
             conditions.append(_func)
         _func = all if op == 'and' else any
 
         def func(row):
             return _func(cond(row) for cond in conditions)
 
+        return func
+
     elif op == 'not':
-        nfunc = _process_condition_function(body, selection)
+        nfunc = _process_condition_function(body, field_index, fields)
 
         def func(row):
             return not nfunc(row)
 
-    elif op == '~':
+        return func
 
-        def func(row):
-            index = field_index[body[0]]
-            field = fields[index]
-            value = tsdb.cast(field.datatype, row[index])
-            return value is not None and re.search(body[1], value)
+    index = field_index[body[0]]
+    datatype = fields[index].datatype
+    cast = tsdb.cast
 
-    elif op == '!~':
+    if op in ('~', '!~'):
+        pattern = body[1]
+        if not isinstance(pattern, str):
+            raise TSQLError(
+                f'regular expression must be a string: {pattern!r}')
+        search = re.compile(pattern).search
 
-        def func(row):
-            index = field_index[body[0]]
-            field = fields[index]
-            value = tsdb.cast(field.datatype, row[index])
-            return value is None or not re.search(body[1], value)
+        if op == '~':
+            def func(row):
+                value = cast(datatype, row[index])
+                return value is not None and search(value)
+        else:
+            def func(row):
+                value = cast(datatype, row[index])
+                return value is None or not search(value)
 
     else:
         compare = _operator_functions[op]
+        operand = body[1]
 
         def func(row):
-            index = field_index[body[0]]
-            field = fields[index]
-            value = tsdb.cast(field.datatype, row[index])
-            return value is not None and compare(value, body[1])
+            value = cast(datatype, row[index])
+            return value is not None and compare(value, operand)
 
     return func
 
 
 # RELATION JOINS ##############################################################
 
+# the largest fraction of a relation's lines that are read by their
+# line numbers instead of scanning the relation
+_INDEX_SELECTIVITY = 0.1
+# the number of rows in the first and largest batches of index joins
+_INDEX_BATCH_SIZE = 64
+_INDEX_BATCH_SIZE_MAX = 8192
+
+
+class _KeyLookup:
+    """
+    Find the lines of a relation's records with key indexes and
+    trigram indexes.
+    """
+
+    def __init__(self, db: tsdb.Database, name: str) -> None:
+        self.db = db
+        self.name = name
+        self.lines = 0  # number of lines in the relation
+        self.read = 0  # number of lines found so far
+
+    def index(self, column: str) -> Optional[tsdb.KeyIndex]:
+        """Return the key index for *column*, if available."""
+        db = self.db
+        fields = db.schema[self.name]
+        if not any(field.name == column and field.is_key
+                   and field.datatype == ':integer' for field in fields):
+            return None
+        try:
+            index = tsdb.get_key_index(
+                db.path, self.name, column, fields,
+                build=getattr(db, 'key_indexes', False),
+                encoding=db.encoding)
+        except tsdb.TSDBError:
+            return None
+        if index is not None:
+            self.lines = index.lines
+        return index
+
+    def trigram_index(self, column: str) -> Optional[tsdb.TrigramIndex]:
+        """
+        Return the trigram index for *column*, if one was built.
+
+        Trigram indexes are only built on request, but an index whose
+        relation was changed by other means than
+        :func:`delphin.tsdb.write` is built again.
+        """
+        db = self.db
+        fields = db.schema[self.name]
+        if not any(field.name == column and field.datatype == ':string'
+                   for field in fields):
+            return None
+        try:
+            path = tsdb.get_path(db.path, self.name)
+            index = tsdb.get_trigram_index(
+                db.path, self.name, column, fields,
+                build=tsdb._trigram_index_path(path, column).is_file(),
+                encoding=db.encoding)
+        except tsdb.TSDBError:
+            return None
+        if index is not None:
+            self.lines = index.lines
+        return index
+
+    def find(self,
+             condition: Optional[_Condition],
+             keys: Optional[Tuple[str, Set[tsdb.Value]]] = None
+             ) -> Optional[List[int]]:
+        """
+        Return the sorted line numbers of the only records that may
+        match *condition* and have one of the values of *keys*.
+
+        `None` is returned if the lines cannot be found with indexes
+        or if reading them, together with the lines found before by
+        this lookup, is not cheaper than a scan.
+        """
+        found: List[Set[int]] = []
+        if condition is not None:
+            lines = self.condition_lines(condition)
+            if lines is not None:
+                found.append(lines)
+        if keys is not None:
+            column, values = keys
+            index = self.index(column)
+            if index is not None:
+                found.append({lineno
+                              for value in values if isinstance(value, int)
+                              for lineno in index.lookup(value)})
+        if not found:
+            return None
+        selected = set.intersection(*found)
+        if self.read + len(selected) > self.lines * _INDEX_SELECTIVITY:
+            return None
+        self.read += len(selected)
+        return sorted(selected)
+
+    def condition_lines(self, condition: _Condition) -> Optional[Set[int]]:
+        op, body = condition
+        if op in ('and', 'or'):
+            body = typing_cast(List[_Condition], body)
+            found = [self.condition_lines(cond) for cond in body]
+            sets = [lines for lines in found if lines is not None]
+            if op == 'and':
+                return set.intersection(*sets) if sets else None
+            elif len(sets) == len(found):
+                return set().union(*sets)
+            return None
+        elif op in _index_ranges and isinstance(body[1], int):
+            qname, value = body
+            index = self.index(qname.rpartition('.')[2])
+            if index is None:
+                return None
+            low, high, include_low, include_high = _index_ranges[op](value)
+            return set(index.range(low, high, include_low, include_high))
+        elif op == '~':
+            qname, pattern = body
+            if not isinstance(pattern, str):
+                return None
+            literals = _regex_literals(pattern)
+            if not literals:
+                return None
+            tindex = self.trigram_index(qname.rpartition('.')[2])
+            if tindex is None:
+                return None
+            linenos = tindex.candidates(literals)
+            return None if linenos is None else set(linenos)
+        return None
+
+
+# the arguments of tsdb.KeyIndex.range() for comparisons with a value
+_index_ranges = {
+    '==': lambda value: (value, value, True, True),
+    '<': lambda value: (None, value, True, False),
+    '<=': lambda value: (None, value, True, True),
+    '>': lambda value: (value, None, False, True),
+    '>=': lambda value: (value, None, True, True),
+}
+
+
+_QUANTIFIER_RE = re.compile(r'\{(\d*)(?:,\d*)?\}')
+
+
+def _regex_literals(pattern: str) -> List[str]:
+    """
+    Return substrings that every match of regular expression
+    *pattern* contains.
+
+    The substrings are runs of literal characters outside of groups
+    and character classes, so they are not all of the substrings that
+    matches contain. No substrings are returned for patterns with
+    top-level alternations or for those that are not understood,
+    such as case-insensitive patterns.
+    """
+    literals: List[str] = []
+    run: List[str] = []
+
+    def end_run() -> None:
+        if run:
+            literals.append(''.join(run))
+            run.clear()
+
+    i, n = 0, len(pattern)
+    while i < n:
+        c = pattern[i]
+        if c == '\\':
+            if i + 1 == n:
+                return []
+            escaped = pattern[i + 1]
+            if escaped.isalnum():
+                # character classes and zero-width assertions; other
+                # escapes, such as \x41 or \1, are not understood
+                if escaped not in 'dDwWsSbBAZ':
+                    return []
+                end_run()
+            else:
+                run.append(escaped)
+            i += 2
+            continue
+        elif c == '|':
+            return []
+        elif c == '(':
+            if re.match(r'\(\?[aiLmsux]*[ix]', pattern[i:]):
+                return []
+            i = _skip_group(pattern, i)
+            if i < 0:
+                return []
+            end_run()
+            continue
+        elif c == '[':
+            i = _skip_class(pattern, i)
+            if i < 0:
+                return []
+            end_run()
+            continue
+        elif c in '*?':
+            # the previous character may not occur
+            if run:
+                run.pop()
+            end_run()
+        elif c == '+':
+            end_run()
+        elif c == '{':
+            m = _QUANTIFIER_RE.match(pattern, i)
+            if m is None:
+                run.append(c)
+            else:
+                if not m.group(1) or int(m.group(1)) == 0:
+                    if run:
+                        run.pop()
+                end_run()
+                i = m.end()
+                continue
+        elif c in '.^$)':
+            end_run()
+        else:
+            run.append(c)
+        i += 1
+    end_run()
+    return literals
+
+
+def _skip_class(pattern: str, i: int) -> int:
+    """
+    Return the position after the character class at *i* in
+    *pattern*, or -1 if it is not closed.
+    """
+    i += 1
+    if pattern[i:i + 1] == '^':
+        i += 1
+    if pattern[i:i + 1] == ']':
+        i += 1
+    while i < len(pattern):
+        if pattern[i] == '\\':
+            i += 2
+        elif pattern[i] == ']':
+            return i + 1
+        else:
+            i += 1
+    return -1
+
+
+def _skip_group(pattern: str, i: int) -> int:
+    """
+    Return the position after the group at *i* in *pattern*, or -1
+    if it is not closed.
+    """
+    depth = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if c == '\\':
+            i += 2
+            continue
+        elif c == '[':
+            i = _skip_class(pattern, i)
+            if i < 0:
+                return -1
+            continue
+        elif c == '(':
+            depth += 1
+        elif c == ')':
+            depth -= 1
+            if depth == 0:
+                return i + 1
+        i += 1
+    return -1
+
+
 def _join(selection: Selection,
           db: tsdb.Database,
           name: str,
           columns: _Names,
-          how: str = 'inner') -> None:
+          how: str = 'inner',
+          where: Optional[_Predicate] = None,
+          build: str = 'relation',
+          condition: Optional[_Condition] = None,
+          stats: Optional[dict] = None) -> _JoinStage:
     """
     Join *fields* from *relation* into *selection*.
 
+    The fields of *relation* are added to *selection* immediately,
+    but the data is joined by the returned function, which takes an
+    iterator of the rows selected so far and returns an iterator of
+    the joined rows. The first relation's records are simply
+    scanned. For later relations, a hash table of the relation's
+    records is built when the first row is requested and the rows
+    selected so far are streamed through it.
+
     If *how* is `"inner"`, then only matched rows persist after
     the join; if *how* is `"left"`, all existing rows are kept and
     those without a match are padded with `None` values.
+
+    If *where* is given, it is a pair of column names and a predicate
+    over their raw values that filters the records of *relation*
+    before they are joined.
+
+    If *build* is `"relation"`, the hash table is built over the
+    records of *relation* and the joined rows keep the order of the
+    selection. If it is `"selection"`, the hash table is built over
+    the rows selected so far, the records of *relation* are streamed
+    through it, and the joined rows follow the order of *relation*.
+    If it is `"index"`, it is like `"selection"` except that only the
+    records of *relation* with the selected keys are read, using a
+    key index (see :func:`delphin.tsdb.get_key_index`).
+
+    If *condition* is given, it is the condition compiled into
+    *where*, and key indexes are used to read only the records of
+    *relation* that can match it.
+
+    If *stats* is given, the number of records read from *relation*
+    and the number of rows put in hash tables are counted in its
+    `'read'` and `'hashed'` keys.
     """
     if how not in ('inner', 'left'):
         raise TSQLError("only 'inner' and 'left' join methods are allowed")
@@ -494,36 +2046,181 @@ def _join(selection: Selection,
     indices = [field_index[col] for col in columns]
     fields = [all_fields[idx] for idx in indices]
 
-    data: List[tsdb.Record] = []
+    where_columns: Optional[_Names]
+    where_func: Optional[Callable[[tsdb.RawRecord], bool]]
+    where_columns, where_func = where or (None, None)
+    if stats is not None:
+        stats.update(read=0, hashed=0)
+        if where_func is not None:
+            test = where_func
+
+            def counting_where(values: tsdb.RawRecord) -> bool:
+                stats['read'] += 1
+                return test(values)
+
+            where_func = counting_where
+
+    def find_lines(
+            lookup: '_KeyLookup',
+            keys: Optional[Tuple[str, Set[tsdb.Value]]] = None
+    ) -> Optional[List[int]]:
+        if db.cache or (condition is None and keys is None):
+            return None
+        return lookup.find(condition, keys)
+
+    def select_relation(
+            cols: _Names,
+            linenos: Optional[List[int]] = None
+    ) -> Iterator[tsdb.RawRecord]:
+        records: Iterator[tsdb.RawRecord] = db._select_raw(
+            name, cols,
+            where=where_func,
+            where_columns=where_columns,
+            linenos=linenos)
+        if stats is not None and where_func is None:
+            records = _counted(records, stats, 'read')
+        return records
+
     if not selection.joined:
         _merge_fields(selection, name, [], fields)
-        data.extend(db._select_raw(name, columns))
-    else:
-        on: List[str] = []
-        if selection is not None:
-            on = [f.name for f in fields
-                  if f.is_key and f.name in selection._field_index]
-        fields = [f for f in fields if f.name not in on]
-        cols = [f.name for f in fields]
-
-        if not on:
-            raise TSQLError('no shared keys for joining')
-
-        right: Dict[Tuple[tsdb.Value, ...], List[tsdb.Record]] = {}
-        for keys, row in zip(db.select_from(name, on, cast=True),
-                             db._select_raw(name, cols)):
-            right.setdefault(tuple(keys), []).append(tuple(row))
 
-        rfill = tuple([None] * len(fields))
-        for keys, lrow in zip(selection.select(*on, cast=True), selection):
-            keys = tuple(keys)
-            if how == 'left' or keys in right:
-                for rrow in right.get(keys, [rfill]):
-                    data.append(tuple(lrow) + tuple(rrow))
-
-        _merge_fields(selection, name, on, fields)
-
-    selection.data = data
+        def scan(rows: Iterator[tsdb.Record]) -> Iterator[tsdb.Record]:
+            return select_relation(
+                columns, find_lines(_KeyLookup(db, name)))
+
+        return scan
+
+    on: List[str] = []
+    if selection is not None:
+        on = [f.name for f in fields
+              if f.is_key and f.name in selection._field_index]
+    fields = [f for f in fields if f.name not in on]
+    cols = [f.name for f in fields]
+
+    if not on:
+        raise TSQLError('no shared keys for joining')
+
+    left_indices = [selection._field_index[key] for key in on]
+    cast_left_keys = tsdb.get_codec(
+        [selection.fields[idx] for idx in left_indices]).cast
+    cast_right_keys = tsdb.get_codec(
+        [all_fields[field_index[key]] for key in on]).cast
+    num_keys = len(on)
+    rfill = tuple([None] * len(fields))
+
+    _merge_fields(selection, name, on, fields)
+
+    # the first joined key with a key index for build='index'
+    index_key = 0
+    if build == 'index':
+        index_key = next((i for i, key in enumerate(on)
+                          if _KeyLookup(db, name).index(key) is not None),
+                         0)
+
+    def left_keys(lrow: _Row) -> _JoinKeys:
+        # rows of the selection hold raw values until they are output
+        raw = typing_cast(tsdb.RawRecord,
+                          [lrow[idx] for idx in left_indices])
+        return tuple(cast_left_keys(raw))
+
+    def scan_relation(
+            linenos: Optional[List[int]] = None
+    ) -> Iterator[Tuple[_JoinKeys, _Row]]:
+        # read the keys and the other columns in one scan and cast
+        # only the keys
+        for row in select_relation(on + cols, linenos):
+            keys = tuple(cast_right_keys(row[:num_keys]))
+            yield keys, tuple(row[num_keys:])
+
+    def hash_rows(
+            rows: Iterable[tsdb.Record]
+    ) -> Dict[_JoinKeys, List[_Row]]:
+        left: Dict[_JoinKeys, List[_Row]] = {}
+        for row in rows:
+            lrow = tuple(row)
+            left.setdefault(left_keys(lrow), []).append(lrow)
+        if stats is not None:
+            stats['hashed'] += sum(map(len, left.values()))
+        return left
+
+    def join_hashed(
+            left: Dict[_JoinKeys, List[_Row]],
+            linenos: Optional[List[int]]
+    ) -> Iterator[tsdb.Record]:
+        matched: Set[_JoinKeys] = set()
+        for keys, rrow in scan_relation(linenos):
+            lrows = left.get(keys)
+            if lrows is not None:
+                matched.add(keys)
+                for lrow in lrows:
+                    yield lrow + rrow
+
+        if how == 'left':
+            for keys, lrows in left.items():
+                if keys not in matched:
+                    for lrow in lrows:
+                        yield lrow + rfill
+
+    def build_selection(
+            rows: Iterator[tsdb.Record]
+    ) -> Iterator[tsdb.Record]:
+        lookup = _KeyLookup(db, name)
+        yield from join_hashed(hash_rows(rows), find_lines(lookup))
+
+    def index_batches(
+            rows: Iterator[tsdb.Record]
+    ) -> Iterator[tsdb.Record]:
+        # join growing batches of rows with the records having their
+        # keys, so the first rows are joined without reading all rows
+        lookup = _KeyLookup(db, name)
+        rows = iter(rows)
+        size = _INDEX_BATCH_SIZE
+        while True:
+            batch = list(itertools.islice(rows, size))
+            if not batch:
+                break
+            left = hash_rows(batch)
+            selected = (on[index_key], {keys[index_key] for keys in left})
+            linenos = find_lines(lookup, selected)
+            if linenos is None:
+                # too many records would be read by their lines, so
+                # scan the relation once for all remaining rows
+                left = hash_rows(itertools.chain(batch, rows))
+                yield from join_hashed(left, find_lines(lookup))
+                break
+            yield from join_hashed(left, linenos)
+            size = min(size * 2, _INDEX_BATCH_SIZE_MAX)
+
+    def probe(rows: Iterator[tsdb.Record]) -> Iterator[tsdb.Record]:
+        right: Dict[_JoinKeys, List[_Row]] = {}
+        for keys, rrow in scan_relation(find_lines(_KeyLookup(db, name))):
+            right.setdefault(keys, []).append(rrow)
+        if stats is not None:
+            stats['hashed'] += sum(map(len, right.values()))
+
+        for row in rows:
+            lrow = tuple(row)
+            rrows = right.get(left_keys(lrow))
+            if rrows is not None:
+                for rrow in rrows:
+                    yield lrow + rrow
+            elif how == 'left':
+                yield lrow + rfill
+
+    if build == 'relation':
+        return probe
+    elif build == 'index' and how == 'inner':
+        return index_batches
+    return build_selection
+
+
+def _counted(rows: Iterator[tsdb.RawRecord],
+             stats: dict,
+             key: str) -> Iterator[tsdb.RawRecord]:
+    """Yield *rows* while counting them in *stats* at *key*."""
+    for row in rows:
+        stats[key] += 1
+        yield row
 
 
 def _merge_fields(selection: Selection,
@@ -544,6 +2241,140 @@ def _merge_fields(selection: Selection,
     selection.joined.add(relationname)
 
 
+# AGGREGATION #################################################################
+
+class _Aggregation(NamedTuple):
+    group: _Names  # qualified names of grouped columns
+    # (function, qualified name, output name) for each output column;
+    # the function is None for grouped columns and the qualified name
+    # is None for count(*)
+    columns: List[Tuple[Optional[str], Optional[str], str]]
+
+
+def _sum_step(state: list, value: tsdb.Value) -> None:
+    state[1] = value if state[1] is None else state[1] + value
+
+
+def _min_step(state: list, value: tsdb.Value) -> None:
+    if state[1] is None or value < state[1]:
+        state[1] = value
+
+
+def _max_step(state: list, value: tsdb.Value) -> None:
+    if state[1] is None or value > state[1]:
+        state[1] = value
+
+
+def _average(state: list) -> Optional[float]:
+    return state[1] / state[0] if state[0] else None
+
+
+# Aggregate functions map to a function that updates the state with
+# each non-empty value, a function that gets the result from the
+# state, and the datatype of the result (None for the column's
+# datatype). The state is a list of the count of non-empty values and
+# the current value.
+_aggregate_functions: Dict[str, Tuple[Optional[Callable],
+                                      Callable,
+                                      Optional[str]]] = {
+    'count': (None, operator.itemgetter(0), ':integer'),
+    'sum': (_sum_step, operator.itemgetter(1), None),
+    'avg': (_sum_step, _average, ':float'),
+    'min': (_min_step, operator.itemgetter(1), None),
+    'max': (_max_step, operator.itemgetter(1), None),
+}
+
+
+def _aggregate(joined: Selection,
+               rows: Callable[[], Iterator[tsdb.Record]],
+               aggregation: _Aggregation,
+               fieldmap: Dict[str, tsdb.Field],
+               record_class: Optional[Type[_Record]]
+               ) -> Tuple[Selection, Callable[[], Iterator[tsdb.Record]]]:
+    """
+    Aggregate the rows of *joined* produced by *rows*.
+
+    Return a new selection for the aggregated columns and a function
+    that produces its rows. The rows are aggregated in a hash table
+    of the grouped values as they are produced, so only one row per
+    group is kept in memory. Groups are in the order of their first
+    rows. If no columns are grouped, there is exactly one group even
+    when there are no rows.
+
+    Both the rows produced by *rows* and the aggregated rows hold raw
+    (uncast) values: aggregated values are cast for the aggregate
+    functions and their results are formatted as raw values again.
+    """
+    selection = Selection(record_class=record_class)
+    key_indices = [joined._field_index[qname] for qname in aggregation.group]
+
+    # (row index or None, converter, step) for each aggregate
+    aggregates: List[Tuple[Optional[int],
+                           Optional[Callable[[str], tsdb.Value]],
+                           Optional[Callable]]] = []
+    # (group index or None, result function, datatype) for each column
+    outputs: List[Tuple[Optional[int], Optional[Callable], str]] = []
+    for i, (function, qname, name) in enumerate(aggregation.columns):
+        if function is None:
+            qname = typing_cast(str, qname)
+            field = fieldmap[qname]
+            outputs.append((aggregation.group.index(qname),
+                            None, field.datatype))
+            selection._field_index[qname] = i
+        else:
+            step, result, datatype = _aggregate_functions[function]
+            index = converter = None
+            if qname is not None:
+                field = fieldmap[qname]
+                index = joined._field_index[qname]
+                if step is not None:
+                    converter = tsdb._get_converter(field.datatype)
+                datatype = datatype or field.datatype
+            field = tsdb.Field(name, typing_cast(str, datatype))
+            aggregates.append((index, converter, step))
+            outputs.append((None, result, field.datatype))
+        selection.fields.append(field)
+        selection._field_index.setdefault(field.name, i)
+
+    def pipeline() -> Iterator[tsdb.Record]:
+        groups: Dict[Tuple[tsdb.RawValue, ...], List[list]] = {}
+        if not key_indices:
+            groups[()] = [[0, None] for _ in aggregates]
+        for selected in rows():
+            row = typing_cast(tsdb.RawRecord, selected)
+            key = tuple([row[idx] for idx in key_indices])
+            states = groups.get(key)
+            if states is None:
+                states = groups[key] = [[0, None] for _ in aggregates]
+            for (index, convert, step), state in zip(aggregates, states):
+                if index is None:
+                    state[0] += 1
+                    continue
+                raw = row[index]
+                value: tsdb.Value = raw
+                if raw is not None and convert is not None:
+                    value = convert(raw)
+                if value is not None:
+                    state[0] += 1
+                    if step is not None:
+                        step(state, value)
+
+        for key, states in groups.items():
+            results = iter(states)
+            record: List[tsdb.RawValue] = []
+            for group_index, result, datatype in outputs:
+                if group_index is not None:
+                    record.append(key[group_index])
+                else:
+                    assert result is not None
+                    value = result(next(results))
+                    record.append(None if value is None
+                                  else tsdb.format(datatype, value))
+            yield tuple(record)
+
+    return selection, pipeline
+
+
 # QUERY PARSING ###############################################################
 
 _year = r'[0-9]{4}'
@@ -558,12 +2389,16 @@ _dd_mm_yy = r'(?:{day}-)?{month}-{year}(?:{time})?'.format(
     year=_yr, month=_month, day=_day, time=_time)
 _id = r'[a-zA-Z][-_a-zA-Z0-9]*'
 _qid = r'{id}\.{id}'.format(id=_id)  # qualified id: "table.column"
+_end = r'(?![-_a-zA-Z0-9])'  # end of a keyword
 
 _TSQLLexer = util.Lexer(
     tokens=[
         (r'from', 'FROM:from'),
         (r'where', 'WHERE:where'),
         (r'report', 'REPORT:report'),
+        (r'group\s+by' + _end, 'GROUPBY:group by'),
+        (r'limit' + _end, 'LIMIT:limit'),
+        (r'offset' + _end, 'OFFSET:offset'),
         (r'\*', 'STAR:*'),
         (r'\.', 'DOT:.'),
         (r'==|=|!=|~|!~|<=|<|>=|>', 'OP:a comparison operator'),
@@ -577,6 +2412,8 @@ _TSQLLexer = util.Lexer(
         (_yyyy_mm_dd, 'YYYYMMDD:a YYYY-MM-DD date'),
         (_dd_mm_yy, 'DDMMYY: a DD-MM-YY date'),
         (r':today|now', "KWDATE:'now' or ':today'"),
+        (r'\?', 'PARAM:a parameter placeholder'),
+        (r':(' + _id + ')', 'NAMEDPARAM:a named parameter placeholder'),
         (r'[+-]?\d+', 'INT:an integer'),
         (_qid, 'QID:a qualified identifier'),
         (_id, 'ID:a simple identifier'),
@@ -588,6 +2425,9 @@ _TSQLLexer = util.Lexer(
 _FROM       = _TSQLLexer.tokentypes.FROM
 _WHERE      = _TSQLLexer.tokentypes.WHERE
 _REPORT     = _TSQLLexer.tokentypes.REPORT
+_GROUPBY    = _TSQLLexer.tokentypes.GROUPBY
+_LIMIT      = _TSQLLexer.tokentypes.LIMIT
+_OFFSET     = _TSQLLexer.tokentypes.OFFSET
 _STAR       = _TSQLLexer.tokentypes.STAR
 _DOT        = _TSQLLexer.tokentypes.DOT
 _OP         = _TSQLLexer.tokentypes.OP
@@ -601,6 +2441,8 @@ _SQSTRING   = _TSQLLexer.tokentypes.SQSTRING
 _YYYYMMDD   = _TSQLLexer.tokentypes.YYYYMMDD
 _DDMMYY     = _TSQLLexer.tokentypes.DDMMYY
 _KWDATE     = _TSQLLexer.tokentypes.KWDATE
+_PARAM      = _TSQLLexer.tokentypes.PARAM
+_NAMEDPARAM = _TSQLLexer.tokentypes.NAMEDPARAM
 _INT        = _TSQLLexer.tokentypes.INT
 _QID        = _TSQLLexer.tokentypes.QID
 _ID         = _TSQLLexer.tokentypes.ID
@@ -625,31 +2467,91 @@ def _parse_select(querystring: str) -> dict:
     projection = _parse_select_projection(lexer)
     relations = _parse_select_from(lexer)
     condition = _parse_select_where(lexer)
+    group = _parse_select_group(lexer)
+    limit, offset = _parse_select_limit(lexer)
     lexer.expect_type(_DOT)
 
     if projection == ['*'] and not relations:
         raise TSQLSyntaxError(
             "'select *' requires a 'from' clause",
             text=querystring)
+    if projection == ['*'] and group:
+        raise TSQLSyntaxError(
+            "'select *' cannot be grouped",
+            text=querystring)
 
-    return {'type': 'select',
-            'projection': projection,
-            'relations': relations,
-            'condition': condition}
+    parameters: List[Union[int, str]] = []
+    if condition:
+        placeholders = _condition_placeholders(condition)
+        positional = [ph for ph in placeholders if ph.key is None]
+        if positional and len(positional) < len(placeholders):
+            raise TSQLSyntaxError(
+                'cannot mix positional and named parameters',
+                text=querystring)
+        for i, placeholder in enumerate(positional):
+            placeholder.key = i
+        for placeholder in placeholders:
+            if (placeholder.key is not None
+                    and placeholder.key not in parameters):
+                parameters.append(placeholder.key)
+
+    result: Dict[str, Any] = {'type': 'select',
+                              'projection': projection,
+                              'relations': relations,
+                              'condition': condition}
+    if group:
+        result['group'] = group
+    if limit is not None:
+        result['limit'] = limit
+    if offset is not None:
+        result['offset'] = offset
+    if parameters:
+        result['parameters'] = parameters
+    return result
 
 
-def _parse_select_projection(lexer: util.LookaheadLexer) -> List[str]:
+def _condition_placeholders(condition: _Condition) -> List['_Placeholder']:
+    op, body = condition
+    if op in ('and', 'or'):
+        body = typing_cast(List[_Condition], body)
+        return [placeholder
+                for cond in body
+                for placeholder in _condition_placeholders(cond)]
+    elif op == 'not':
+        return _condition_placeholders(body)
+    elif isinstance(body[1], _Placeholder):
+        return [body[1]]
+    return []
+
+
+def _parse_select_projection(
+        lexer: util.LookaheadLexer) -> List[_Projected]:
     typ, col_id = lexer.choice_type(_STAR, _QID, _ID)
-    projection = []
+    projection: List[_Projected] = []
     if typ in (_QID, _ID):
         while col_id:
-            projection.append(col_id)
+            if lexer.accept_type(_LPAREN):
+                projection.append(_parse_aggregate(col_id, lexer))
+            else:
+                projection.append(col_id)
             col_id = lexer.accept_type(_QID) or lexer.accept_type(_ID)
     else:
         projection.append(col_id)
     return projection
 
 
+def _parse_aggregate(function: str,
+                     lexer: util.LookaheadLexer) -> _Aggregate:
+    if function not in _aggregate_functions:
+        raise TSQLSyntaxError(f'not an aggregate function: {function}')
+    if function == 'count':
+        _, column = lexer.choice_type(_STAR, _QID, _ID)
+    else:
+        _, column = lexer.choice_type(_QID, _ID)
+    lexer.expect_type(_RPAREN)
+    return (function, column)
+
+
 def _parse_select_from(lexer: util.LookaheadLexer) -> List[str]:
     relations = []
     if lexer.accept_type(_FROM):
@@ -673,6 +2575,39 @@ def _parse_select_where(
     return condition
 
 
+def _parse_select_group(lexer: util.LookaheadLexer) -> List[str]:
+    group = []
+    if lexer.accept_type(_GROUPBY):
+        _, column = lexer.choice_type(_QID, _ID)
+        while column:
+            group.append(column)
+            column = lexer.accept_type(_QID) or lexer.accept_type(_ID)
+    return group
+
+
+def _parse_select_limit(
+        lexer: util.LookaheadLexer) -> Tuple[Optional[int], Optional[int]]:
+    limit: Optional[int] = None
+    offset: Optional[int] = None
+    while True:
+        if limit is None and lexer.accept_type(_LIMIT):
+            limit = _parse_count(lexer)
+        elif offset is None and lexer.accept_type(_OFFSET):
+            offset = _parse_count(lexer)
+        else:
+            break
+    return limit, offset
+
+
+def _parse_count(lexer: util.LookaheadLexer) -> int:
+    _, token, lineno, offset, line = lexer.peek()
+    count = int(lexer.expect_type(_INT))
+    if count < 0:
+        raise TSQLSyntaxError('expected: a non-negative integer',
+                              lineno=lineno, offset=offset, text=line)
+    return count
+
+
 def _parse_condition_disjunction(
         lexer: util.LookaheadLexer) -> _Condition:
     conds = []
@@ -722,16 +2657,23 @@ def _parse_condition_statement(
         op = '=='  # normalize = to == (I think these are equivalent)
 
     if op in ('~', '!~'):
-        typ, value = lexer.choice_type(_DQSTRING, _SQSTRING)
+        typ, value = lexer.choice_type(_DQSTRING, _SQSTRING,
+                                       _PARAM, _NAMEDPARAM)
     elif op in ('<', '<=', '>', '>='):
-        typ, value = lexer.choice_type(_INT, _YYYYMMDD, _DDMMYY, _KWDATE)
+        typ, value = lexer.choice_type(_INT, _YYYYMMDD, _DDMMYY, _KWDATE,
+                                       _PARAM, _NAMEDPARAM)
     else:  # must be == or !=
         typ, value = lexer.choice_type(_INT, _DQSTRING, _SQSTRING,
-                                       _YYYYMMDD, _DDMMYY, _KWDATE)
+                                       _YYYYMMDD, _DDMMYY, _KWDATE,
+                                       _PARAM, _NAMEDPARAM)
 
     if typ == _INT:
         value = int(value)
     elif typ in (_YYYYMMDD, _DDMMYY, _KWDATE):
         value = tsdb.cast(':date', value)
+    elif typ == _PARAM:
+        value = _Placeholder(None)  # numbered after parsing
+    elif typ == _NAMEDPARAM:
+        value = _Placeholder(value)
 
     return (op, (column, value))
@@ -240,7 +240,7 @@ class TestSuiteServer:
             entry = self.index[name]
         except KeyError as e:
             raise falcon.HTTPNotFound() from e
-        ts = itsdb.TestSuite(entry['path'])
+        ts = itsdb.TestSuite(entry['path'], line_index=True)
         table_ = ts[table]
 
         limit = req.get_param_as_int('limit', default=len(table_))
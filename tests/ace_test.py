@@ -60,3 +60,54 @@ def test_start(ace_mismatch, tmp_path, monkeypatch):
             ace.ACEParser(str(grm))
         with pytest.raises(ace.ACEProcessError):
             ace.parse(str(grm), 'Dogs sleep.')
+
+
+def test_response_cache(tmp_path, monkeypatch):
+    popen = mock_popen(
+        pid=10,
+        returncode=None,
+        stdout=io.StringIO(),
+        stderr=io.StringIO())
+    grm = tmp_path / 'grm.dat'
+    grm.write_text('grammar')
+    cache = ace.ResponseCache(tmp_path / 'cache')
+    received = []
+
+    def receive(self):
+        received.append(self._p.stdin.getvalue())
+        return ace.interface.Response(
+            {'input': 'Dogs sleep.', 'results': [{'mrs': '[ ]'}]})
+
+    with monkeypatch.context() as m:
+        m.setattr(ace, 'Popen', popen)
+        m.setattr(ace, '_ace_version', lambda x: (0, 9, 34))
+        m.setattr(ace.ACEParser, '_tsdb_receive', receive)
+        with ace.ACEParser(str(grm), cache=cache) as parser:
+            r1 = parser.interact('Dogs sleep.')
+            r2 = parser.interact('Dogs sleep.')
+        assert len(received) == 1
+        assert r2['results'] == r1['results']
+        assert r2['run'] == parser.run_info
+        # different arguments do not share responses
+        with ace.ACEParser(str(grm), cmdargs=['-1'], cache=cache) as parser:
+            parser.interact('Dogs sleep.')
+        assert len(received) == 2
+        # a changed grammar image bypasses the stored responses
+        grm.write_text('new grammar')
+        with ace.ACEParser(str(grm), cache=cache) as parser:
+            parser.interact('Dogs sleep.')
+        assert len(received) == 3
+        cache.clear()
+        assert list((tmp_path / 'cache').iterdir()) == []
+
+
+def test_response_cache_eviction(tmp_path):
+    cache = ace.ResponseCache(tmp_path, max_bytes=200)
+    response = ace.interface.Response({'input': 'x' * 50})
+    cache._put('a', response)
+    cache._put('b', response)
+    assert cache._get('a') is not None  # mark 'a' as recently used
+    cache._put('c', response)
+    assert cache._get('a') is not None
+    assert cache._get('b') is None
+    assert cache._get('c') is not None
@@ -251,7 +251,7 @@ def test_process(mini_testsuite):
     # don't have a good way to mock ACE yet
 
 
-def test_select(mini_testsuite):
+def test_select(mini_testsuite, tmp_path):
     ts0 = mini_testsuite
     with pytest.raises(TypeError):
         select('result.mrs')
@@ -261,6 +261,15 @@ def test_select(mini_testsuite):
     select('parse.i-id result.mrs', ts0)
     from delphin import itsdb
     select('result.result-id mrs', ts0, record_class=itsdb.Row)
+    cache = tmp_path / 'cache'
+    expected = [('10',), ('20',), ('30',)]
+    assert list(select('i-id', ts0, cache=cache)) == expected
+    assert list(select('i-id', ts0, cache=cache)) == expected
+    plan = select('i-input where readings > 0', ts0, explain=True)
+    assert [step['operation'] for step in plan] == ['scan', 'join']
+    plan = select('i-input where readings > 0', ts0,
+                  explain=True, analyze=True)
+    assert [step['actual_rows'] for step in plan] == [2, 2]
 
 
 def test_compare(mini_testsuite):
@@ -1,9 +1,12 @@
+import gzip
 import pathlib
+import shutil
+import time
 from datetime import datetime
 
 import pytest
 
-from delphin import itsdb, tsdb
+from delphin import interface, itsdb, tsdb, tsql
 
 
 @pytest.fixture
@@ -96,6 +99,99 @@ class TestTestSuite:
         assert ts['result'][1]['parse-id'] == 0
         assert ts['result'][1]['result-id'] == 1
 
+    def test_process_concurrently(self, single_item_skeleton):
+        ts = itsdb.TestSuite(single_item_skeleton)
+        ts['item'].extend((i, f'Item {i}.') for i in range(1, 20))
+        ts.commit()
+        cpus = [_EchoParser(0.01), _EchoParser(0.001), _EchoParser(0)]
+        ts.process(cpus, buffer_size=5)
+        parses = list(ts['parse'].select('parse-id', 'i-id', 'run-id'))
+        assert [(p[0], p[1]) for p in parses] == [(i, i) for i in range(20)]
+        assert {p[2] for p in parses} <= {0, 1, 2}
+        assert sorted(r['run-id'] for r in ts['run']) == sorted(
+            {p[2] for p in parses})
+        assert [r['mrs'] for r in ts['result']] == [
+            'The dog barks.'] + [f'Item {i}.' for i in range(1, 20)]
+        with pytest.raises(itsdb.ITSDBError):
+            ts.process([])
+
+    def test_process_duck_typed(self, single_item_skeleton):
+        # processors need only the attributes used by process()
+        class Parser:
+            task = 'parse'
+            process_item = _EchoParser.process_item
+
+            def __init__(self):
+                _EchoParser.__init__(self)
+
+        ts = itsdb.TestSuite(single_item_skeleton)
+        ts.process(Parser())
+        assert [r['mrs'] for r in ts['result']] == ['The dog barks.']
+        ts = itsdb.TestSuite(single_item_skeleton)
+        ts.process((Parser(), Parser()))
+        assert [r['mrs'] for r in ts['result']] == ['The dog barks.']
+
+    def test_process_resume(self, single_item_skeleton):
+        ts = itsdb.TestSuite(single_item_skeleton)
+        ts['item'].extend((i, f'Item {i}.') for i in range(1, 20))
+        ts.commit()
+        checkpoint = single_item_skeleton / itsdb.CHECKPOINT_FILENAME
+        with pytest.raises(RuntimeError):
+            ts.process(_EchoParser(fail_on='Item 12.'), buffer_size=5)
+        assert checkpoint.is_file()
+        # simulate a commit that did not finish
+        with single_item_skeleton.joinpath('parse').open('a') as fh:
+            fh.write('99@0@')
+        ts = itsdb.TestSuite(single_item_skeleton)
+        assert ts['parse'][-1]['parse-id'] == 99
+        ts.process(_EchoParser(), resume=True)
+        assert not checkpoint.exists()
+        parses = list(ts['parse'].select('parse-id', 'i-id', 'run-id'))
+        assert [(p[0], p[1]) for p in parses] == [(i, i) for i in range(20)]
+        assert parses[0][2] == 0
+        assert parses[-1][2] == 1  # the resumed run
+        # the interrupted run is kept
+        assert [r['run-id'] for r in ts['run']] == [0, 1]
+        assert len(list(tsql.select('i-id run.run-id', ts))) == 20
+        assert [r['mrs'] for r in ts['result']] == [
+            'The dog barks.'] + [f'Item {i}.' for i in range(1, 20)]
+        # nothing is left to process
+        ts.process(_EchoParser(fail_on='The dog barks.'), resume=True)
+        assert len(ts['parse']) == 20
+
+    def test_process_resume_generation(self, single_item_skeleton, tmp_path):
+        source = itsdb.TestSuite(single_item_skeleton)
+        source['item'].extend((i, f'Item {i}.') for i in range(1, 10))
+        source.commit()
+        source.process(_EchoParser(nresults=2))
+        target = tmp_path / 'target'
+        target.mkdir()
+        for name in ('relations', 'item'):
+            shutil.copy(single_item_skeleton / name, target / name)
+        ts = itsdb.TestSuite(target)
+        # the last commit falls between the results of a parse
+        with pytest.raises(RuntimeError):
+            ts.process(_EchoParser(fail_on='Item 7.', fail_on_result=1),
+                       selector=('result', 'mrs'), source=source,
+                       buffer_size=5)
+        assert len(itsdb.TestSuite(target)['parse']) == 15
+        ts = itsdb.TestSuite(target)
+        ts.process(_EchoParser(), selector=('result', 'mrs'),
+                   source=source, resume=True)
+        assert [p['i-id'] for p in ts['parse']] == [
+            i // 2 for i in range(20)]
+        assert [r['mrs'] for r in ts['result']] == [
+            r['mrs'] for r in source['result']]
+
+    def test_select_from(self, mini_testsuite):
+        ts = itsdb.TestSuite(mini_testsuite)
+        assert list(ts.select_from('item', ['i-id'], cast=False)) == [
+            ('10',), ('20',), ('30',)]
+        assert list(ts.select_from(
+            'item', ['i-id'],
+            where=lambda values: values[0] == '1',
+            where_columns=['i-wf'])) == [[10], [30]]
+
     def test_processed_items(self, mini_testsuite):
         ts = itsdb.TestSuite(mini_testsuite)
         responses = list(ts.processed_items())
@@ -109,6 +205,54 @@ class TestTestSuite:
         assert len(responses[1].results()) == 0
         assert len(responses[2].results()) == 1
 
+    def test_processed_items_unordered(self, mini_testsuite):
+        expected = [
+            (r['i-id'], r['parse-id'], [res['mrs'] for res in r.results()])
+            for r in itsdb.TestSuite(mini_testsuite).processed_items()]
+        for name in ('parse', 'result'):
+            path = mini_testsuite / name
+            lines = path.read_text().splitlines(keepends=True)
+            path.write_text(''.join(reversed(lines)))
+        ts = itsdb.TestSuite(mini_testsuite)
+        assert expected == [
+            (r['i-id'], r['parse-id'], [res['mrs'] for res in r.results()])
+            for r in ts.processed_items()]
+        # gzipped tables that cannot be indexed
+        for name in ('parse', 'result'):
+            path = mini_testsuite / name
+            with gzip.open(str(path) + '.gz', 'wt') as fh:
+                fh.write(path.read_text())
+            path.unlink()
+        ts = itsdb.TestSuite(mini_testsuite)
+        assert expected == [
+            (r['i-id'], r['parse-id'], [res['mrs'] for res in r.results()])
+            for r in ts.processed_items()]
+
+
+class _EchoParser(interface.Processor):
+    task = 'parse'
+
+    def __init__(self, delay=0, fail_on=None, fail_on_result=0, nresults=1):
+        self.delay = delay
+        self.fail_on = fail_on
+        self.fail_on_result = fail_on_result
+        self.nresults = nresults
+        self.run = {'run-id': 0, 'run-comment': 'echo'}
+        self._seen = {}
+
+    def process_item(self, datum, keys=None):
+        time.sleep(self.delay)
+        seen = self._seen.get(datum, 0)
+        self._seen[datum] = seen + 1
+        if datum == self.fail_on and seen == self.fail_on_result:
+            raise RuntimeError(datum)
+        return interface.Response(
+            input=datum,
+            keys=keys,
+            run=self.run,
+            results=[{'result-id': i, 'mrs': datum}
+                     for i in range(self.nresults)])
+
 
 def test_Row(empty_alt_testsuite):
     ts = itsdb.TestSuite(str(empty_alt_testsuite))
@@ -136,6 +280,16 @@ def test_Row(empty_alt_testsuite):
     assert r['i-id'] == 0
     assert r['i-input'] is None
     assert r['i-date'] is None
+    assert r.data == ('0', '', '')
+    # values are formatted the same when accessed before the data
+    r = itsdb.Row(item.fields, [None, 'sentence', datetime(2009, 9, 7)])
+    assert r['i-id'] == -1
+    assert r[2] == datetime(2009, 9, 7)
+    assert r[1:] == ('sentence', datetime(2009, 9, 7))
+    assert r.data == ('-1', 'sentence', '7-sep-2009')
+    # the formatted data replaces the original values
+    assert r._values is r.data
+    assert r[2] == datetime(2009, 9, 7)
 
 
 class TestTable:
@@ -202,6 +356,14 @@ class TestTable:
         assert list(table.select('i-input', 'i-id')) == [
             ['The dog barks.', 0],
             ['The bear growls.', 1]]
+        # filter by raw values, including uncommitted rows
+        assert list(table.select(
+            'i-input', where=lambda values: values[0] == '1',
+            where_columns=['i-id'])) == [['The bear growls.']]
+        assert list(table.select(
+            'i-id', cast=False,
+            where=lambda values: values[1].startswith('The dog'))) == [
+                ('0',)]
 
     def test__iter__(self, single_item_table):
         table = single_item_table
@@ -229,6 +391,58 @@ class TestTable:
         assert table[::2] == [(0, 'The dog barks.')]
         assert table[::-1] == [(1, 'The bear growls.'), (0, 'The dog barks.')]
 
+    def test_line_index(self, mini_testsuite):
+        fields = tsdb.read_schema(mini_testsuite)['item']
+        table = itsdb.Table(mini_testsuite, 'item', fields, line_index=True)
+        assert pathlib.Path(mini_testsuite, 'item.idx').is_file()
+        assert len(table) == 3
+        assert table[1]['i-input'] == 'Rained.'
+        assert table[-1]['i-id'] == 30
+        assert [row['i-id'] for row in table[::-1]] == [30, 20, 10]
+        assert [row['i-id'] for row in table[1:]] == [20, 30]
+        table[1] = (25, 'It hailed.', 1, None)
+        table.append((40, 'It thundered.', 1, None))
+        assert [row['i-id'] for row in table[::2]] == [10, 30]
+        assert [row['i-id'] for row in table[1:]] == [25, 30, 40]
+        ts = itsdb.TestSuite(mini_testsuite, line_index=True)
+        assert ts['item'].line_index
+        assert ts['parse'][2]['parse-id'] == 30
+
+    def test_cache(self, mini_testsuite):
+        fields = tsdb.read_schema(mini_testsuite)['item']
+        table = itsdb.Table(mini_testsuite, 'item', fields, cache=True)
+        uncached = itsdb.Table(mini_testsuite, 'item', fields)
+        assert len(table) == 3
+        assert list(table) == list(uncached)
+        assert table[1]['i-input'] == 'Rained.'
+        assert table[-1]['i-id'] == 30
+        assert [row['i-id'] for row in table[::-1]] == [30, 20, 10]
+        assert list(table.select('i-id', cast=False)) == [
+            ('10',), ('20',), ('30',)]
+        table[1] = (25, 'It hailed.', 1, None)
+        table.append((40, 'It thundered.', 1, None))
+        assert [row['i-id'] for row in table] == [10, 25, 30, 40]
+        ts = itsdb.TestSuite(mini_testsuite, cache=True)
+        assert ts['item'].cache
+        assert ts['parse'][2]['parse-id'] == 30
+
+    def test_statistics(self, mini_testsuite):
+        fields = tsdb.read_schema(mini_testsuite)['item']
+        tsdb.write(mini_testsuite, 'item', [(10, 'It rained.', 1, None)],
+                   fields, append=True)
+        # the number of rows comes from the statistics written above
+        path = pathlib.Path(mini_testsuite, tsdb.STATISTICS_FILENAME)
+        assert not path.is_file()  # base statistics did not exist
+        tsdb.get_statistics(mini_testsuite, 'item')
+        table = itsdb.Table(mini_testsuite, 'item', fields)
+        assert len(table) == 4
+        ts = itsdb.TestSuite(mini_testsuite)
+        ts['item'].append((50, 'It hailed.', 1, None))
+        ts.commit()
+        assert tsdb.get_statistics(
+            mini_testsuite, 'item', build=False).rows == 5
+        assert len(ts['item']) == 5
+
     def test__setitem__(self, empty_item_table, single_item_table):
         table = empty_item_table
         with pytest.raises(IndexError):
@@ -271,6 +485,50 @@ def test_match_rows():
     ]
 
 
+def test_match_rows_stream(mini_testsuite, monkeypatch):
+    rows1 = [{'i-id': '20', 'i-input': 'b'}, {'i-id': '10', 'i-input': 'a'}]
+    rows2 = iter([{'i-id': '30', 'i-input': 'd'},
+                  {'i-id': '20', 'i-input': 'c'},
+                  {'i-id': '20', 'i-input': 'e'}])
+    expected = [
+        ('10', [{'i-id': '10', 'i-input': 'a'}], []),
+        ('20', [{'i-id': '20', 'i-input': 'b'}],
+               [{'i-id': '20', 'i-input': 'c'},
+                {'i-id': '20', 'i-input': 'e'}]),
+        ('30', [], [{'i-id': '30', 'i-input': 'd'}]),
+    ]
+    # spill sorted runs of two rows to disk
+    monkeypatch.setattr(itsdb, '_MATCH_RUN_SIZE', 2)
+    assert list(itsdb.match_rows(rows1, rows2, 'i-id', stream=True)) == (
+        expected)
+    # numerically equal but distinct values are not split
+    rows1 = [('1', 'x'), ('01', 'y'), ('1', 'z')]
+    rows2 = [('01', 'q')]
+    assert list(itsdb.match_rows(rows1, rows2, 0, stream=True)) == [
+        ('01', [('01', 'y')], [('01', 'q')]),
+        ('1', [('1', 'x'), ('1', 'z')], []),
+    ]
+    assert sorted(itsdb.match_rows(rows1, rows2, 0)) == sorted(
+        itsdb.match_rows(rows1, rows2, 0, stream=True))
+    assert list(itsdb.match_rows(
+        iter(rows1), iter(rows2), 0, stream=True)) == list(
+            itsdb.match_rows(rows1, rows2, 0, stream=True))
+    # ordered tables are read directly, unordered ones are spilled
+    ts = itsdb.TestSuite(mini_testsuite)
+    path = mini_testsuite / 'parse'
+    path.write_text(''.join(reversed(path.read_text().splitlines(True))))
+    ts.reload()
+    items, parses = ts['item'], ts['parse']
+    assert itsdb._is_key_ordered(items, 'i-id')
+    assert not itsdb._is_key_ordered(parses, 'i-id')
+    assert ([(val, list(map(tuple, left)), list(map(tuple, right)))
+             for val, left, right in itsdb.match_rows(
+                 items, parses, 'i-id', stream=True)]
+            == [(val, list(map(tuple, left)), list(map(tuple, right)))
+                for val, left, right in itsdb.match_rows(
+                    items, parses, 'i-id')])
+
+
 def test_bad_date_issue_279b(tmp_path, empty_alt_testsuite):
     tmp_ts = tmp_path.joinpath('test_bad_date_issue_279b')
     tmp_ts.mkdir()
@@ -299,3 +557,12 @@ def test_bad_date_issue_279b(tmp_path, empty_alt_testsuite):
     # ]
 
 
+
+
+def test__is_merge_ordered():
+    assert itsdb._is_merge_ordered([], [])
+    assert itsdb._is_merge_ordered([1, 2, 3], [])
+    assert itsdb._is_merge_ordered([1, 2, 3], [1, 1, 3])
+    assert itsdb._is_merge_ordered([3, 1, 2], [3, 1, 1, 2])
+    assert not itsdb._is_merge_ordered([1, 2, 3], [2, 1])
+    assert not itsdb._is_merge_ordered([1, 2, 3], [1, 4])
@@ -1,4 +1,5 @@
 
+import gzip
 import pathlib
 from collections import OrderedDict
 from datetime import date, datetime
@@ -24,6 +25,7 @@ def test_Field():
     assert f.default == '-1'
     f = tsdb.Field('i-wf', ':integer', (), '')
     assert f.default == '1'
+    assert hash(f) == hash(tsdb.Field('i-wf', ':integer', (), 'comment'))
 
 
 def test_read_schema(empty_testsuite):
@@ -134,6 +136,102 @@ class TestDatabase():
         ]
 
 
+    def test_select_from_projection(self, mini_testsuite):
+        db = tsdb.Database(mini_testsuite)
+        fields = db.schema['item']
+        records = [(1, 'a@b\\c\nd', None, None), (2, '', 0, None)]
+        tsdb.write(mini_testsuite, 'item', records, fields)
+        expected = [('a@b\\c\nd', '1'), (None, '0')]
+        assert list(db.select_from('item', ('i-input', 'i-wf'))) == expected
+        assert list(db._select_raw('item', ('i-input', 'i-wf'))) == expected
+        assert list(db.select_from('item', ('i-wf',), cast=True)) == [
+            (1,), (0,)]
+        assert list(db.select_from('item', ())) == [(), ()]
+        # gzipped files are read normally
+        tsdb.write(mini_testsuite, 'item', records, fields, gzip=True)
+        assert list(db.select_from('item', ('i-input', 'i-wf'))) == expected
+        # invalid lines
+        pathlib.Path(mini_testsuite, 'item.gz').unlink()
+        pathlib.Path(mini_testsuite, 'item').write_text('1@a\n')
+        with pytest.raises(tsdb.TSDBError):
+            list(db.select_from('item', ('i-wf',)))
+        pathlib.Path(mini_testsuite, 'item').write_text('1@a@1@d@e\n')
+        with pytest.raises(tsdb.TSDBError):
+            list(db.select_from('item', ('i-wf',)))
+        # encodings whose multibyte characters contain @ or \ bytes
+        db = tsdb.Database(mini_testsuite, encoding='shift_jis')
+        records = [(1, 'ァソ', 1, None)]
+        tsdb.write(mini_testsuite, 'item', records, fields,
+                   encoding='shift_jis')
+        assert list(db.select_from('item', ('i-input', 'i-wf'))) == [
+            ('ァソ', '1')]
+
+    def test_select_from_where(self, mini_testsuite):
+        for cache in (False, True):
+            db = tsdb.Database(mini_testsuite, cache=cache)
+            # predicates get raw values
+            assert list(db.select_from(
+                'item', ['i-input'],
+                where=lambda values: values[0] == '1',
+                where_columns=['i-wf'])) == [('It rained.',), ('It snowed.',)]
+            assert list(db.select_from(
+                'item', ['i-id'], cast=True,
+                where=lambda values: values[1] == 'Rained.')) == [(20,)]
+            assert list(db._select_raw(
+                'parse', ['parse-id'],
+                where=lambda values: int(values[0]) > 10,
+                where_columns=['i-id'])) == [('20',), ('30',)]
+            assert list(db.select_from(
+                'item', where=lambda values: False,
+                where_columns=[])) == []
+
+    def test_cache(self, mini_testsuite):
+        db = tsdb.Database(mini_testsuite, cache=True)
+        uncached = tsdb.Database(mini_testsuite)
+        for name in ('item', 'parse', 'result'):
+            for cast in (False, True):
+                assert (list(db.select_from(name, cast=cast))
+                        == list(uncached.select_from(name, cast=cast)))
+            assert list(db._select_raw(name)) == list(
+                uncached._select_raw(name))
+        assert list(db.select_from('item', ('i-id',), cast=True)) == [
+            (10,), (20,), (30,)]
+        assert list(db.select_from('item', ())) == [(), (), ()]
+        # integers that do not round-trip are kept as they are
+        fields = db.schema['parse']
+        tsdb.write(mini_testsuite, 'parse',
+                   [('010', 10, None), (20, 20, 0)], fields)
+        assert list(db.select_from('parse')) == [
+            ('010', '10', '-1'), ('20', '20', '0')]
+        assert list(db.select_from('parse', cast=True)) == [
+            (10, 10, -1), (20, 20, 0)]
+        tsdb.write(mini_testsuite, 'item',
+                   [(10, None, None, None)], db.schema['item'])
+        assert list(db._select_raw('item')) == [('10', None, '1', None)]
+
+    def test_shared_cache(self, mini_testsuite):
+        tsdb.clear_relation_cache()
+        db1 = tsdb.Database(mini_testsuite, cache=True)
+        db2 = tsdb.Database(mini_testsuite, cache=True)
+        assert db1._get_columns('item') is db2._get_columns('item')
+        # changed files are decoded again
+        tsdb.write(mini_testsuite, 'item',
+                   [(10, None, None, None)], db1.schema['item'])
+        assert list(db2._select_raw('item')) == [('10', None, '1', None)]
+        assert db1._get_columns('item') is db2._get_columns('item')
+        # relations larger than the cache are not kept
+        tsdb.set_relation_cache_size(0)
+        try:
+            assert db1._get_columns('item') is not db2._get_columns('item')
+            assert list(db1._select_raw('item')) == [
+                ('10', None, '1', None)]
+            with pytest.raises(ValueError):
+                tsdb.set_relation_cache_size(-1)
+        finally:
+            tsdb.set_relation_cache_size(256 * 1024 * 1024)
+            tsdb.clear_relation_cache()
+
+
 def test_escape():
     assert tsdb.escape('') == ''
     assert tsdb.escape('abc') == 'abc'
@@ -166,8 +264,17 @@ def test_split(empty_testsuite):
     assert tsdb.split('one@@three') == ('one', None, 'three')
     assert (tsdb.split('one\\s@\\\\two\\nabc')
             == ('one@', '\\two\nabc'))
+    assert tsdb.split('one@\\\\s\n') == ('one', '\\s')
     rels = tsdb.read_schema(empty_testsuite)
     assert tsdb.split('10@one', fields=rels['item']) == (10, 'one')
+    assert tsdb.split('@a\\sb', fields=rels['item']) == (None, 'a@b')
+    with pytest.raises(tsdb.TSDBError):
+        tsdb.split('10', fields=rels['item'])
+    # invalid datatypes only fail when a value is cast
+    fields = [tsdb.Field('x', ':y')]
+    assert tsdb.split('', fields=fields) == (None,)
+    with pytest.raises(tsdb.TSDBError):
+        tsdb.split('1', fields=fields)
 
 
 def test_join():
@@ -177,6 +284,8 @@ def test_join():
     assert tsdb.join(['one', 'two']) == 'one@two'
     assert tsdb.join(['one', None, 'three']) == 'one@@three'
     assert tsdb.join(['one@', '\\two\nabc']) == 'one\\s@\\\\two\\nabc'
+    assert tsdb.join(['one@two']) == 'one\\stwo'
+    assert tsdb.join(['one', '@']) == 'one@\\s'
 
 
 def test_make_record(empty_testsuite):
@@ -189,6 +298,33 @@ def test_make_record(empty_testsuite):
                             r['item']) == (100, None)
 
 
+def test_get_codec(empty_testsuite):
+    fields = tsdb.read_schema(empty_testsuite)['item']
+    codec = tsdb.get_codec(fields)
+    assert tsdb.get_codec(fields) is codec
+    assert tsdb.get_codec(list(fields)) is codec
+    assert len(codec) == 2
+    assert codec.decode(['10', 'one']) == (10, 'one')
+    assert codec.decode([None, '']) == (None, None)
+    with pytest.raises(tsdb.TSDBError):
+        codec.decode(['10'])
+    assert codec.encode((10, 'a@b')) == '10@a\\sb'
+    assert codec.encode((None, None)) == '-1@'
+    with pytest.raises(tsdb.TSDBError):
+        codec.encode((10,))
+    assert codec.make_record({'i-input': 'one', 'i-id': 1, 'x': 2}) == (
+        1, 'one')
+    # modifying the fields changes the codec
+    fields.append(tsdb.Field('i-wf', ':integer'))
+    codec = tsdb.get_codec(fields)
+    assert codec.format((None, None, None)) == ['-1', '', '1']
+    assert codec.format((None, None, None), defaults=False) == [
+        '-1', '', '-1']
+    date_codec = tsdb.get_codec([tsdb.Field('d', ':date')])
+    assert date_codec.format((datetime(1999, 9, 8),)) == ['8-sep-1999']
+    assert date_codec.cast(('8-sep-1999',)) == (datetime(1999, 9, 8),)
+
+
 def test_cast():
     assert tsdb.cast(':integer', None) is None
     assert tsdb.cast(':float', None) is None
@@ -236,6 +372,198 @@ def test_open(single_item_skeleton, gzipped_single_item_skeleton):
         assert list(fh) == ['0@The dog barks.\n']
 
 
+def test_get_line_index(mini_testsuite, gzipped_single_item_skeleton):
+    dir = pathlib.Path(mini_testsuite)
+    idx_path = dir.joinpath('item.idx')
+    assert tsdb.get_line_index(dir, 'item', build=False) is None
+    assert not idx_path.exists()
+    offsets = tsdb.get_line_index(dir, 'item')
+    assert list(offsets) == [0, 33, 64]
+    assert idx_path.is_file()
+    assert list(tsdb.get_line_index(dir, 'item', build=False)) == [0, 33, 64]
+    # changing the relation invalidates the index
+    fields = tsdb.read_schema(dir)['item']
+    tsdb.write(dir, 'item', [(1, 'a', 1, None), (2, 'b', 1, None)], fields)
+    assert list(tsdb.get_line_index(dir, 'item')) == [0, 7]
+    # gzipped relations not written by tsdb.write() are not indexed
+    assert tsdb.get_line_index(gzipped_single_item_skeleton, 'item') is None
+    with pytest.raises(tsdb.TSDBError):
+        tsdb.get_line_index(dir, 'not-a-relation')
+
+
+def test_get_line_index_gzip(empty_testsuite):
+    dir = pathlib.Path(empty_testsuite)
+    fields = tsdb.read_schema(dir)['item']
+    records = [(i, 'x' * 1000) for i in range(200)]
+    tsdb.write(dir, 'item', records, fields, gzip=True)
+    offsets = tsdb.get_line_index(dir, 'item')
+    assert len(offsets) == 200
+    blocks = sorted(set(offset >> 16 for offset in offsets))
+    assert len(blocks) > 1  # multiple gzip members
+    assert blocks[0] == 0
+    assert all(offset & 0xffff == 0 for offset in offsets[::65])
+    lines = list(tsdb.read_lines(dir, 'item', [199, 0, 100]))
+    assert [tsdb.split(line)[0] for line in lines] == ['199', '0', '100']
+    tsdb.write(dir, 'item', [(200, 'y')], fields, append=True)
+    assert len(tsdb.get_line_index(dir, 'item')) == 201
+    assert list(tsdb.read_lines(dir, 'item', [200])) == ['200@y\n']
+    # blocks that cannot be read are errors, not empty lines
+    path = tsdb.get_path(dir, 'item')
+    bad = [(offsets[0] >> 16) + 1 << 16]
+    with pytest.raises(tsdb.TSDBError):
+        list(tsdb._seek_block_lines(path, bad, [0], 'utf-8'))
+    with pytest.raises(tsdb.TSDBError):
+        list(tsdb._seek_block_lines(path, [0xffff], [0], 'utf-8'))
+
+
+def test_read_lines(mini_testsuite, gzipped_single_item_skeleton):
+    dir = pathlib.Path(mini_testsuite)
+    assert list(tsdb.read_lines(dir, 'parse', [2, 0, 1, 2])) == [
+        '30@30@1\n', '10@10@1\n', '20@20@0\n', '30@30@1\n']
+    assert list(tsdb.read_lines(dir, 'parse', [])) == []
+    with pytest.raises(IndexError):
+        list(tsdb.read_lines(dir, 'parse', [3]))
+    skel = gzipped_single_item_skeleton
+    assert list(tsdb.read_lines(skel, 'item', [0])) == ['0@The dog barks.\n']
+    with pytest.raises(IndexError):
+        list(tsdb.read_lines(skel, 'item', [1]))
+
+
+def test_get_key_index(mini_testsuite):
+    dir = pathlib.Path(mini_testsuite)
+    kdx_path = dir.joinpath('parse.i-id.kdx')
+    assert tsdb.get_key_index(dir, 'parse', 'i-id', build=False) is None
+    index = tsdb.get_key_index(dir, 'parse', 'i-id')
+    assert kdx_path.is_file()
+    assert len(index) == 3
+    assert index.lookup(20) == [1]
+    assert index.lookup(25) == []
+    assert index.range(20) == [1, 2]
+    assert index.range(None, 20, include_high=False) == [0]
+    assert index.range(10, 30, include_low=False, include_high=False) == [1]
+    with pytest.raises(tsdb.TSDBError):
+        tsdb.get_key_index(dir, 'parse', 'readings')  # not a key
+    with pytest.raises(tsdb.TSDBError):
+        tsdb.get_key_index(dir, 'item', 'i-input')
+    # existing key indexes are updated when writing
+    fields = tsdb.read_schema(dir)['parse']
+    tsdb.write(dir, 'parse', [(40, 10, 2), (50, None, 0)], fields,
+               append=True)
+    index = tsdb.get_key_index(dir, 'parse', 'i-id', build=False)
+    assert index.lookup(10) == [0, 3]
+    assert index.lines == 5
+    assert len(index) == 4  # empty keys are not indexed
+    tsdb.write(dir, 'parse', [(60, 30, 1)], fields, gzip=True)
+    assert not kdx_path.exists()
+    index = tsdb.get_key_index(dir, 'parse', 'i-id', build=False)
+    assert list(index.keys) == [30]
+    assert list(tsdb.read_lines(dir, 'parse', index.lookup(30))) == [
+        '60@30@1\n']
+    # files modified otherwise invalidate the index
+    tsdb.write(dir, 'parse', [(70, 10, 1)], fields)
+    assert tsdb.get_key_index(dir, 'parse', 'i-id').lookup(10) == [0]
+    with dir.joinpath('parse').open('a') as fh:
+        fh.write('80@10@1\n')
+    assert tsdb.get_key_index(dir, 'parse', 'i-id', build=False) is None
+    assert tsdb.get_key_index(dir, 'parse', 'i-id').lookup(10) == [0, 1]
+
+
+def test_get_statistics(mini_testsuite):
+    dir = pathlib.Path(mini_testsuite)
+    stats_path = dir.joinpath(tsdb.STATISTICS_FILENAME)
+    assert tsdb.get_statistics(dir, 'parse', build=False) is None
+    stats = tsdb.get_statistics(dir, 'parse')
+    assert stats_path.is_file()
+    assert stats.rows == 3
+    assert stats.ranges == {'parse-id': (10, 30), 'i-id': (10, 30)}
+    assert stats.distinct('i-id') == 3
+    with pytest.raises(KeyError):
+        stats.distinct('readings')  # not a key
+    # statistics are updated when writing
+    fields = tsdb.read_schema(dir)['parse']
+    tsdb.write(dir, 'parse', [(40, 10, 2), (50, None, 0)], fields,
+               append=True)
+    stats = tsdb.get_statistics(dir, 'parse', build=False)
+    assert stats.rows == 5
+    assert stats.ranges['parse-id'] == (10, 50)
+    assert stats.distinct('i-id') == 3  # empty values are not counted
+    tsdb.write(dir, 'item', [(5, 'Hi.', 1, None)],
+               tsdb.read_schema(dir)['item'], gzip=True)
+    stats = tsdb.get_statistics(dir, 'item', build=False)
+    assert stats.rows == 1
+    assert stats.ranges == {'i-id': (5, 5)}
+    # files modified otherwise invalidate the statistics
+    with dir.joinpath('parse').open('a') as fh:
+        fh.write('80@10@1\n')
+    assert tsdb.get_statistics(dir, 'parse', build=False) is None
+    assert tsdb.get_statistics(dir, 'parse').rows == 6
+    # distinct values are estimated for many values
+    records = [(i, i % 1000, 1) for i in range(5000)]
+    tsdb.write(dir, 'parse', records, fields)
+    stats = tsdb.get_statistics(dir, 'parse')
+    assert stats.ranges['parse-id'] == (0, 4999)
+    assert 4000 < stats.distinct('parse-id') < 6000
+    assert 800 < stats.distinct('i-id') < 1200
+
+
+def test_get_trigram_index(mini_testsuite):
+    dir = pathlib.Path(mini_testsuite)
+    tgx_path = dir.joinpath('item.i-input.tgx')
+    assert tsdb.get_trigram_index(dir, 'item', 'i-input', build=False) is None
+    index = tsdb.get_trigram_index(dir, 'item', 'i-input')
+    assert tgx_path.is_file()
+    assert index.lines == 3
+    assert index.lookup('ain') == [0, 1]
+    assert index.lookup('xyz') == []
+    assert index.candidates(['ained']) == [0, 1]
+    assert index.candidates(['It ', 'ained']) == [0]
+    assert index.candidates(['snow', 'rain']) == []
+    assert index.candidates(['It']) is None
+    with pytest.raises(tsdb.TSDBError):
+        tsdb.get_trigram_index(dir, 'item', 'i-id')  # not a string
+    # existing trigram indexes are updated when writing
+    fields = tsdb.read_schema(dir)['item']
+    records = [(40, 'Rain fell.', 1, None), (50, None, 1, None)]
+    tsdb.write(dir, 'item', records, fields, append=True)
+    index = tsdb.get_trigram_index(dir, 'item', 'i-input', build=False)
+    assert index.candidates(['fell']) == [3]
+    assert index.candidates(['ain']) == [0, 1, 3]
+    assert index.lines == 5
+    tsdb.write(dir, 'item', [(60, 'It hailed.', 1, None)], fields)
+    index = tsdb.get_trigram_index(dir, 'item', 'i-input', build=False)
+    assert index.candidates(['ail']) == [0]
+    assert index.candidates(['ain']) == []
+    # files modified otherwise invalidate the index
+    with dir.joinpath('item').open('a') as fh:
+        fh.write('70@It rained.@1@\n')
+    assert tsdb.get_trigram_index(dir, 'item', 'i-input', build=False) is None
+    index = tsdb.get_trigram_index(dir, 'item', 'i-input')
+    assert index.candidates(['ained']) == [1]
+    tsdb.write(dir, 'item', [(80, 'It hailed.', 1, None)], fields, gzip=True)
+    assert not tgx_path.exists()
+    index = tsdb.get_trigram_index(dir, 'item', 'i-input', build=False)
+    assert index.candidates(['hail']) == [0]
+
+
+def test_sample_lines(mini_testsuite, gzipped_single_item_skeleton):
+    dir = pathlib.Path(mini_testsuite)
+    assert tsdb.sample_lines(dir, 'parse') == (
+        ['10@10@1\n', '20@20@0\n', '30@30@1\n'], 1.0)
+    lines, share = tsdb.sample_lines(dir, 'parse', size=10)
+    assert lines == ['10@10@1\n', '20@20@0\n']
+    assert share == 16 / 24
+    assert tsdb.sample_lines(gzipped_single_item_skeleton, 'item') == (
+        ['0@The dog barks.\n'], 1.0)
+    fields = tsdb.read_schema(dir)['parse']
+    records = [(i, i, 1) for i in range(10000)]
+    tsdb.write(dir, 'parse', records, fields, gzip=True)
+    lines, share = tsdb.sample_lines(dir, 'parse', size=1000)
+    assert lines[0] == '0@0@1\n'
+    assert 5000 < len(lines) / share < 20000
+    tsdb.write(dir, 'parse', [], fields)
+    assert tsdb.sample_lines(dir, 'parse') == ([], 1.0)
+
+
 def test_write(single_item_skeleton):
     dir = pathlib.Path(single_item_skeleton)
     fields = tsdb.read_schema(dir)['item']
@@ -246,15 +574,27 @@ def test_write(single_item_skeleton):
     tsdb.write(dir, 'item', [(1, 'The wolf howls.')], fields, append=True)
     with tsdb.open(dir, 'item') as fh:
         assert list(fh) == ['0@The cat meows.\n', '1@The wolf howls.\n']
-    # cannot append and gzip at same time
-    with pytest.raises(NotImplementedError):
-        tsdb.write(dir, 'item', [], fields, gzip=True, append=True)
+    # appending with gzip compresses the existing data
+    tsdb.write(dir, 'item', [(2, 'The cow moos.')], fields,
+               gzip=True, append=True)
+    assert not path.with_suffix('').exists()
+    assert path.with_suffix('.gz').exists()
+    with tsdb.open(dir, 'item') as fh:
+        assert list(fh) == ['0@The cat meows.\n',
+                            '1@The wolf howls.\n',
+                            '2@The cow moos.\n']
     tsdb.write(dir, 'item', [(0, 'The cat meows.')], fields, gzip=True)
     assert not path.with_suffix('').exists()
     assert path.with_suffix('.gz').exists()
-    # cannot append to existing gzipped file
-    with pytest.raises(NotImplementedError):
-        tsdb.write(dir, 'item', [], fields, append=True)
+    # appending to a gzipped file keeps it gzipped
+    tsdb.write(dir, 'item', [(1, 'The wolf howls.')], fields, append=True)
+    tsdb.write(dir, 'item', [], fields, append=True)
+    assert not path.with_suffix('').exists()
+    with tsdb.open(dir, 'item') as fh:
+        assert list(fh) == ['0@The cat meows.\n', '1@The wolf howls.\n']
+    # the result is still a regular gzip file
+    assert gzip.decompress(path.with_suffix('.gz').read_bytes()) == (
+        b'0@The cat meows.\n1@The wolf howls.\n')
     tsdb.write(dir, 'item', [(0, 'The cat meows.')], fields)
     assert path.with_suffix('').exists()
     assert not path.with_suffix('.gz').exists()
@@ -1,9 +1,10 @@
 
+import shutil
 from datetime import datetime
 
 import pytest
 
-from delphin import itsdb, tsql
+from delphin import itsdb, tsdb, tsql
 
 
 def test_inspect_query():
@@ -140,6 +141,108 @@ def test_select(mini_testsuite):
     # assert list(tsql.select('* from item', ts, cast=True)) == list(ts['item'])
 
 
+def test_inspect_query_plan(mini_testsuite):
+    db = tsdb.Database(mini_testsuite)
+    plan = tsql.inspect_query('select i-input', db)['plan']
+    assert plan == [{'operation': 'scan',
+                     'relation': 'item',
+                     'columns': ['i-input', 'i-id'],
+                     'condition': None,
+                     'rows': 3}]
+    # the smaller relation is scanned first
+    plan = tsql.inspect_query('select i-input mrs', db)['plan']
+    assert [step['relation'] for step in plan] == ['result', 'parse', 'item']
+    assert [step['rows'] for step in plan] == [2, 2, 2]
+    # the selection is hashed when it is smaller than the relation
+    assert [step.get('build') for step in plan] == [None, 'selection',
+                                                     'selection']
+    plan = tsql.inspect_query('select i-input where readings > 0', db)['plan']
+    assert [step['relation'] for step in plan] == ['parse', 'item']
+    assert plan[1]['build'] == 'selection'
+    assert list(tsql.select('i-input where readings > 0', db)) == [
+        ('It rained.',), ('It snowed.',)]
+    # no plan without a database or for other queries
+    assert 'plan' not in tsql.inspect_query('select i-input')
+
+
+def test_explain(mini_testsuite):
+    db = tsdb.Database(mini_testsuite)
+    plan = tsql.explain('select i-input where readings > 0', db)
+    assert plan == tsql.inspect_query(
+        'select i-input where readings > 0', db)['plan']
+    assert plan == tsql.explain('i-input where readings > 0', db)
+    plan = tsql.explain('i-input where readings > 0', db, analyze=True)
+    assert [(step['operation'], step['relation']) for step in plan] == [
+        ('scan', 'parse'), ('join', 'item')]
+    assert [(step['read'], step['actual_rows'], step['hashed'])
+            for step in plan] == [(3, 2, 0), (3, 2, 2)]
+    assert all(step['time'] >= 0 for step in plan)
+    plan = tsql.explain(
+        'i-wf count(*) where i-wf = ? | i-input ~ "snow" group by i-wf '
+        'limit 1', db, analyze=True, params=[0])
+    assert [(step['operation'], step['actual_rows']) for step in plan] == [
+        ('scan', 2), ('aggregate', 1), ('limit', 1)]
+    plan = tsql.explain('i-input readings where i-wf = 1 | readings = 0',
+                        db, analyze=True)
+    assert [(step['operation'], step['actual_rows']) for step in plan] == [
+        ('scan', 3), ('join', 3), ('filter', 3)]
+
+
+def test_relation_stats(empty_testsuite):
+    fields = tsdb.read_schema(empty_testsuite)['parse']
+    records = [(i, 1, i // 4) for i in range(20000)]
+    tsdb.write(empty_testsuite, 'parse', records, fields)
+    db = tsdb.Database(empty_testsuite)
+    # relation statistics give exact counts
+    stats = tsql._relation_stats(db, 'parse')
+    assert stats.rows == 20000
+    assert 0.9 < stats.distinct['parse-id'] < 1.1
+    assert stats.distinct['run-id'] < 0.01
+    assert 0.2 < stats.distinct['i-id'] < 0.3
+    # otherwise the statistics are estimated from a sample
+    stats = tsql._sample_relation_stats(db, 'parse')
+    assert 15000 < stats.rows < 25000
+    assert stats.distinct['parse-id'] == 1.0
+    assert stats.distinct['run-id'] < 0.01
+    assert 0.2 < stats.distinct['i-id'] < 0.3
+    # line indexes give exact counts
+    tsdb.get_line_index(empty_testsuite, 'parse')
+    tsdb.write(empty_testsuite, 'parse', records[:10000], fields)
+    tsdb.get_line_index(empty_testsuite, 'parse')
+    assert tsql._sample_relation_stats(db, 'parse').rows == 10000
+    # as do small files
+    tsdb.write(empty_testsuite, 'parse', records[:10], fields, gzip=True)
+    assert tsql._sample_relation_stats(db, 'parse').rows == 10
+    assert tsql._relation_stats(db, 'parse').rows == 10
+
+
+def test_select_stream(mini_testsuite):
+    db = tsdb.Database(mini_testsuite)
+    expected = [('10', 'It rained.'), ('30', 'It snowed.')]
+    selection = tsql.select('i-id i-input where readings > 0', db,
+                            stream=True)
+    rows = iter(selection)
+    assert next(rows) == expected[0]
+    assert list(rows) == expected[1:]
+    assert list(selection) == expected  # the query is run again
+    # columns only used by pushed-down conditions are not joined
+    assert selection.data == [('10', '10', 'It rained.'),
+                              ('30', '30', 'It snowed.')]
+    assert list(tsql.query('select i-id i-input where readings > 0', db,
+                           stream=True)) == expected
+    # errors in the query are raised before iteration
+    with pytest.raises(tsql.TSQLError):
+        tsql.select('i-id where i-input = 1', db, stream=True)
+
+
+def test_select_cached(mini_testsuite):
+    db = tsdb.Database(mini_testsuite, cache=True)
+    assert list(tsql.select('i-id mrs', db)) == list(
+        tsql.select('i-id mrs', tsdb.Database(mini_testsuite)))
+    assert list(tsql.select('i-input where readings > 0', db)) == [
+        ('It rained.',), ('It snowed.',)]
+
+
 def test_select_where(mini_testsuite):
     ts = itsdb.TestSuite(mini_testsuite)
     assert list(tsql.select('i-input where i-input ~ "It"', ts)) == [
@@ -150,6 +253,384 @@ def test_select_where(mini_testsuite):
         ('It rained.',), ('Rained.',), ('It snowed.',)]
     assert list(tsql.select('i-input where readings > 0', ts)) == [
         ('It rained.',), ('It snowed.',)]
+    # regular expressions must be strings
+    with pytest.raises(tsql.TSQLError):
+        tsql._process_condition_function(
+            ('~', ('i-wf', 1)), {'i-wf': 0},
+            [tsdb.Field('i-wf', ':integer')])
+
+
+def test_select_where_pushdown(mini_testsuite):
+    ts = itsdb.TestSuite(mini_testsuite)
+    db = tsdb.Database(mini_testsuite)
+    # conditions on a single relation filter its scan
+    plan = tsql.inspect_query(
+        'select i-input where i-wf = 1 & readings > 0', db)['plan']
+    assert sorted((step['relation'], step['condition']) for step in plan) == [
+        ('item', ('==', ('item.i-wf', 1))),
+        ('parse', ('>', ('parse.readings', 0)))]
+    # conditions across relations are applied after joining
+    plan = tsql.inspect_query(
+        'select i-input where i-wf = 1 | readings > 0', db)['plan']
+    assert [step['condition'] for step in plan] == [
+        None, None, ('or', [('==', ('item.i-wf', 1)),
+                            ('>', ('parse.readings', 0))])]
+    for source in (ts, db):
+        assert list(tsql.select(
+            'i-input where i-wf = 1 & readings > 0', source)) == [
+                ('It rained.',), ('It snowed.',)]
+        assert list(tsql.select(
+            'i-input where i-id = 20 | readings > 0', source)) == [
+                ('It rained.',), ('Rained.',), ('It snowed.',)]
+        assert list(tsql.select(
+            'i-id where i-input ~ "^It" & !(i-id = 10 | readings = 0)',
+            source)) == [('30',)]
+        assert list(tsql.select(
+            'mrs where i-input !~ "snow" & readings > 0 & result-id = 0',
+            source)) == [(ts['result'][0]['mrs'],)]
+
+
+def test_parse_select_aggregate():
+    assert tsql.inspect_query(
+        'select i-wf count(*) avg(item.i-id) group by i-wf') == {
+            'type': 'select',
+            'projection': ['i-wf', ('count', '*'), ('avg', 'item.i-id')],
+            'relations': [],
+            'condition': None,
+            'group': ['i-wf']}
+    with pytest.raises(tsql.TSQLSyntaxError):
+        tsql.inspect_query('select foo(i-id)')
+    with pytest.raises(tsql.TSQLSyntaxError):
+        tsql.inspect_query('select sum(*)')
+    with pytest.raises(tsql.TSQLSyntaxError):
+        tsql.inspect_query('select i-id group by')
+    with pytest.raises(tsql.TSQLSyntaxError):
+        tsql.inspect_query('select * from item group by i-id')
+
+
+def test_select_aggregate(mini_testsuite):
+    ts = itsdb.TestSuite(mini_testsuite)
+    db = tsdb.Database(mini_testsuite)
+    for source in (ts, db):
+        assert list(tsql.select(
+            'count(*) sum(i-wf) avg(i-id) min(i-input) max(i-date)',
+            source)) == [('3', '2', '20.0', 'It rained.',
+                  '1-feb-2018 15:00:00')]
+        assert list(tsql.select(
+            'i-wf count(*) max(i-id) group by i-wf', source)) == [
+                ('1', '2', '30'), ('0', '1', '20')]
+    # empty values are not counted
+    assert list(tsql.select('count(*) count(mrs) from result', db)) == [
+        ('2', '2')]
+    # without groups there is a row even when nothing is selected
+    assert list(tsql.select('count(*) sum(i-wf) where i-id > 30', db)) == [
+        ('0', None)]
+    assert list(tsql.select(
+        'i-wf count(*) where i-id > 30 group by i-wf', db)) == []
+    # grouping without aggregates selects distinct rows
+    assert list(tsql.select('i-wf group by i-wf', db)) == [('1',), ('0',)]
+    # grouped columns need not be selected
+    assert list(tsql.select('count(*) where readings > 0 group by i-wf',
+                            db)) == [('2',)]
+    selection = tsql.select('readings count(*) group by readings', db,
+                            record_class=itsdb.Row, stream=True)
+    assert [f.name for f in selection.fields] == ['readings', 'count(*)']
+    assert list(selection) == [(1, 2), (0, 1)]
+    plan = tsql.inspect_query('select readings count(*) group by readings',
+                              db)['plan']
+    assert plan[-1] == {'operation': 'aggregate',
+                        'group': ['parse.readings'],
+                        'columns': ['parse.readings', 'count(*)']}
+    with pytest.raises(tsql.TSQLError):
+        tsql.select('i-id count(*)', db)
+    with pytest.raises(tsql.TSQLError):
+        tsql.select('sum(i-input)', db)
+
+
+def test_prepare(mini_testsuite):
+    ts = itsdb.TestSuite(mini_testsuite)
+    db = tsdb.Database(mini_testsuite)
+    q = tsql.prepare('i-input where i-id = ?')
+    assert q.parameters == [0]
+    assert list(q.select(ts, [10])) == [('It rained.',)]
+    assert list(q.select(db, (20,))) == [('Rained.',)]
+    assert list(q.select(db, [40])) == []
+    q = tsql.prepare('i-id where i-input ~ :pat | i-id = :id & readings > 0')
+    assert q.parameters == ['pat', 'id']
+    assert list(q.select(db, {'pat': 'snow', 'id': 10})) == [
+        ('10',), ('30',)]
+    assert list(q.select(db, {'pat': '^R', 'id': 30}, stream=True)) == [
+        ('20',), ('30',)]
+    assert list(tsql.select('i-id where i-wf = ?', db, params=[1])) == [
+        ('10',), ('30',)]
+    assert list(tsql.query('select i-id where i-wf = :wf', db,
+                           params={'wf': 0})) == [('20',)]
+    assert tsql.inspect_query('select i-id where i-wf = ? & i-id > ?') == {
+        'type': 'select',
+        'projection': ['i-id'],
+        'relations': [],
+        'condition': ('and', [('==', ('i-wf', tsql._Placeholder(0))),
+                              ('>', ('i-id', tsql._Placeholder(1)))]),
+        'parameters': [0, 1]}
+    # syntax errors are raised when preparing
+    with pytest.raises(tsql.TSQLSyntaxError):
+        tsql.prepare('i-id where')
+    with pytest.raises(tsql.TSQLSyntaxError):
+        tsql.prepare('i-id where i-id = ? | i-wf = :wf')
+    # values are checked when they are bound
+    q = tsql.prepare('i-id where i-id < ?')
+    with pytest.raises(tsql.TSQLError):
+        q.select(db)
+    with pytest.raises(tsql.TSQLError):
+        q.select(db, [1, 2])
+    with pytest.raises(tsql.TSQLError):
+        q.select(db, ['10'])
+    with pytest.raises(tsql.TSQLError):
+        tsql.prepare('i-id where i-input ~ ?').select(db, [1])
+    with pytest.raises(tsql.TSQLError):
+        tsql.prepare('i-id where i-wf = :wf').select(db, {'id': 1})
+    with pytest.raises(tsql.TSQLError):
+        tsql.prepare('i-id where x-id = ?').select(db, [1])
+
+
+def test_plan_cache(mini_testsuite):
+    db = tsdb.Database(mini_testsuite)
+    tsql._plan_cache.clear()
+    q = tsql.prepare('i-input where i-id = ?')
+    for i in (10, 20, 30):
+        q.select(db, [i])
+    tsql.select('i-input where i-id = ?', db, params=[10])
+    assert len(tsql._plan_cache) == 1
+    # the cache is shared by databases with the same schema
+    q.select(tsdb.Database(mini_testsuite), [10])
+    assert len(tsql._plan_cache) == 1
+    tsql.select('i-id', db)
+    assert len(tsql._plan_cache) == 2
+    # least recently used queries are evicted
+    for i in range(tsql._PLAN_CACHE_SIZE):
+        tsql.select(f'i-id where i-id = {i}', db)
+    assert len(tsql._plan_cache) == tsql._PLAN_CACHE_SIZE
+    assert ('i-id', tsql._schema_key(db.schema)) not in tsql._plan_cache
+
+
+def test_select_key_index(mini_testsuite, monkeypatch):
+    expected = {
+        'i-input where i-id = 20': [('Rained.',)],
+        'i-input where i-id >= 20 & i-wf = 1': [('It snowed.',)],
+        'i-input where i-id < 15 | i-id > 25': [
+            ('It rained.',), ('It snowed.',)],
+        'mrs where i-id = 10 | i-id = 20': [
+            (itsdb.TestSuite(mini_testsuite)['result'][0]['mrs'],)],
+    }
+    db = tsdb.Database(mini_testsuite, key_indexes=True)
+    for query, rows in expected.items():
+        assert list(tsql.select(query, db)) == rows
+    plan = tsql.inspect_query('select mrs where i-id = 10', db)['plan']
+    assert [step.get('build') for step in plan] == [None, 'index', 'index']
+    # the relations are not scanned when the key indexes can be used
+    monkeypatch.setattr(tsql, '_INDEX_SELECTIVITY', 1.0)
+
+    def no_scan(*args, **kwargs):
+        raise AssertionError('relation was scanned')
+
+    monkeypatch.setattr(tsdb, '_select_lines', no_scan)
+    monkeypatch.setattr(tsdb, '_select_mapped', no_scan)
+    for query, rows in expected.items():
+        assert list(tsql.select(query, tsdb.Database(mini_testsuite))) == rows
+    with pytest.raises(AssertionError):
+        list(tsql.select('i-input where i-wf = 1', db))
+
+
+def test_regex_literals():
+    assert tsql._regex_literals('dog') == ['dog']
+    assert tsql._regex_literals('the dogs? ran') == ['the dog', ' ran']
+    assert tsql._regex_literals(r'\bcat\.') == ['cat.']
+    assert tsql._regex_literals('[Dd]ogs{0,2}') == ['og']
+    assert tsql._regex_literals('big (dog|cat)+ food') == ['big ', ' food']
+    assert tsql._regex_literals('dog|cat') == []
+    assert tsql._regex_literals('(?i)dog') == []
+    assert tsql._regex_literals(r'\x41dog') == []
+
+
+def test_select_trigram_index(mini_testsuite, monkeypatch):
+    expected = {
+        'i-input where i-input ~ "ained"': [
+            ('It rained.',), ('Rained.',)],
+        'i-id where i-input ~ "^It (rain|snow)ed"': [('10',), ('30',)],
+        'i-id where i-input ~ "ained" & i-wf = 0': [('20',)],
+        'i-id where i-input ~ "rained" | i-input ~ "snowed"': [
+            ('10',), ('30',)],
+        'i-id readings where i-input ~ "snowed"': [('30', '1')],
+    }
+    db = tsdb.Database(mini_testsuite)
+    tsdb.get_trigram_index(mini_testsuite, 'item', 'i-input')
+    # the relations are not scanned when the trigram index can be used
+    monkeypatch.setattr(tsql, '_INDEX_SELECTIVITY', 1.0)
+
+    def no_scan(*args, **kwargs):
+        raise AssertionError('relation was scanned')
+
+    select_lines = tsdb._select_lines
+    monkeypatch.setattr(tsdb, '_select_mapped', no_scan)
+    monkeypatch.setattr(
+        tsdb, '_select_lines',
+        lambda dir, name, *args: (no_scan() if name == 'item'
+                                  else select_lines(dir, name, *args)))
+    for query, rows in expected.items():
+        assert list(tsql.select(query, db)) == rows
+    with pytest.raises(AssertionError):
+        list(tsql.select('i-input where i-input ~ "[Ii]t"', db))
+    with pytest.raises(AssertionError):
+        list(tsql.select('i-input where i-input !~ "rained"', db))
+
+
+def test_select_limit(mini_testsuite, monkeypatch):
+    db = tsdb.Database(mini_testsuite)
+    assert tsql.inspect_query('select i-id limit 2 offset 1') == {
+        'type': 'select',
+        'projection': ['i-id'],
+        'relations': [],
+        'condition': None,
+        'limit': 2,
+        'offset': 1}
+    with pytest.raises(tsql.TSQLSyntaxError):
+        tsql.inspect_query('select i-id limit -1')
+    with pytest.raises(tsql.TSQLSyntaxError):
+        tsql.inspect_query('select i-id limit 1 limit 2')
+    assert list(tsql.select('i-id limit 2', db)) == [('10',), ('20',)]
+    assert list(tsql.select('i-id offset 1', db)) == [('20',), ('30',)]
+    assert list(tsql.select('i-id limit 1 offset 1', db)) == [('20',)]
+    assert list(tsql.select('i-id offset 1 limit 1', db)) == [('20',)]
+    assert list(tsql.select('i-id limit 0', db)) == []
+    assert list(tsql.select('i-id where i-wf = 1 limit 1 offset 1',
+                            db, stream=True)) == [('30',)]
+    # keyword arguments take precedence
+    assert list(tsql.select('i-id limit 1', db, limit=2, offset=1)) == [
+        ('20',), ('30',)]
+    assert list(tsql.query('select i-id', db, limit=1)) == [('10',)]
+    assert list(tsql.prepare('i-id where i-wf = ?').select(
+        db, [1], offset=1)) == [('30',)]
+    assert list(tsql.select('i-wf count(*) group by i-wf limit 1',
+                            db)) == [('1', '2')]
+    with pytest.raises(tsql.TSQLError):
+        tsql.select('i-id', db, limit=-1)
+    plan = tsql.inspect_query('select i-id limit 5', db)['plan']
+    assert plan[-1] == {'operation': 'limit', 'limit': 5, 'offset': 0}
+
+    # scanning stops when enough rows are selected
+    read = []
+    select_raw = tsdb.Database._select_raw
+
+    def counting_select_raw(self, *args, **kwargs):
+        for row in select_raw(self, *args, **kwargs):
+            read.append(row)
+            yield row
+
+    monkeypatch.setattr(tsdb.Database, '_select_raw', counting_select_raw)
+    assert list(tsql.select('i-input limit 1', db)) == [('It rained.',)]
+    assert len(read) == 1
+    # limited joins use key indexes to stop early
+    db = tsdb.Database(mini_testsuite, key_indexes=True)
+    plan = tsql.inspect_query('select i-input readings limit 1', db)['plan']
+    assert [step.get('build') for step in plan] == [None, 'index', None]
+    monkeypatch.setattr(tsql, '_INDEX_BATCH_SIZE', 1)
+    monkeypatch.setattr(tsql, '_INDEX_SELECTIVITY', 1.0)
+    read.clear()
+    assert list(tsql.select('i-input readings limit 1', db)) == [
+        ('It rained.', '1')]
+    assert len(read) == 2
+
+
+def test_select_result_cache(mini_testsuite, tmp_path, monkeypatch):
+    db = tsdb.Database(mini_testsuite)
+    read = []
+    select_raw = tsdb.Database._select_raw
+
+    def counting_select_raw(self, *args, **kwargs):
+        for row in select_raw(self, *args, **kwargs):
+            read.append(row)
+            yield row
+
+    monkeypatch.setattr(tsdb.Database, '_select_raw', counting_select_raw)
+    cache = tsql.ResultCache(maxsize=2, path=tmp_path / 'cache')
+    q = 'i-id i-input where readings > 0'
+    expected = [('10', 'It rained.'), ('30', 'It snowed.')]
+    assert list(tsql.select(q, db, cache=cache)) == expected
+    assert read
+    assert len(cache) == 1
+    read.clear()
+    assert list(tsql.select(q, db, cache=cache)) == expected
+    assert list(tsql.select(q, db, cache=cache, stream=True)) == expected
+    assert list(tsql.query('select ' + q, db, cache=cache)) == expected
+    assert read == []
+    # different parameters, limits, and functions are different queries
+    prepared = tsql.prepare('i-id where i-wf = ?')
+    assert list(prepared.select(db, [1], cache=cache)) == [('10',), ('30',)]
+    assert list(prepared.select(db, [0], cache=cache)) == [('20',)]
+    assert list(tsql.select(q, db, cache=cache, limit=1)) == expected[:1]
+    assert list(tsql.select('count(*) from item', db, cache=cache)) == [('3',)]
+    assert len(cache) == 2
+    # results are also read from disk
+    read.clear()
+    cache = tsql.ResultCache(path=tmp_path / 'cache')
+    assert list(tsql.select(q, db, cache=cache)) == expected
+    assert read == []
+    # writing a relation invalidates the results that read it
+    tsdb.write(db.path, 'item',
+               [(10, 'It rained.', 1, None), (20, 'Rained.', 0, None)],
+               db.schema['item'])
+    assert list(tsql.select(q, db, cache=cache)) == [
+        ('10', 'It rained.')]
+    assert read
+    cache.clear()
+    assert len(cache) == 0
+    assert list((tmp_path / 'cache').iterdir()) == []
+    # large results are not cached
+    cache = tsql.ResultCache(max_rows=1)
+    list(tsql.select('i-id', db, cache=cache, stream=True))
+    assert len(cache) == 0
+
+
+def test_select_many(mini_testsuite, tmp_path):
+    ts1 = tmp_path / 'ts1'
+    shutil.copytree(mini_testsuite, ts1)
+    db0 = tsdb.Database(mini_testsuite)
+    db1 = tsdb.Database(ts1)
+    # more items without parses change the join order
+    items = [(i, 'Snowed.', 0, None) for i in range(40, 90)]
+    tsdb.write(ts1, 'item', items, db1.schema['item'], append=True)
+    q = 'i-id where readings = 0'
+    assert list(tsql.select_many(q, [db0, db1])) == [
+        (db0, ('20',)), (db1, ('20',))]
+    assert list(tsql.select_many('i-id', [db0, db1], limit=1, offset=1,
+                                 workers=1)) == [
+        (db0, ('20',)), (db1, ('20',))]
+    assert list(tsql.select_many('i-id', [])) == []
+    with pytest.raises(tsql.TSQLError):
+        tsql.select_many('i-id', [db0, db1], limit=-1)
+
+    q = 'i-input readings'
+    assert (tsql.inspect_query('select ' + q, db0)['plan'][0]['relation']
+            != tsql.inspect_query('select ' + q, db1)['plan'][0]['relation'])
+    rows = list(tsql.select(q, db0))
+    assert list(tsql.select_union(q, [db0, db1])) == rows + rows
+    assert list(tsql.select_union(q, [db0, db1], stream=True,
+                                  limit=2, offset=2)) == rows[2:] + rows[:1]
+    assert list(tsql.select_union(
+        'i-wf count(*) sum(readings) group by i-wf', [db0, db1])) == [
+        ('1', '4', '4'), ('0', '2', '0')]
+    assert list(tsql.select_union('count(*) from item limit 1',
+                                  [db0, db1])) == [('56',)]
+    assert list(tsql.select_union(
+        'i-id where i-id > ? limit 1 offset 1', [db0, db1],
+        params=[80])) == [('82',)]
+    with pytest.raises(tsql.TSQLError):
+        tsql.select_union('i-id', [])
+    # errors in the concurrent queries are raised when iterating
+    with ts1.joinpath('parse').open('a') as fh:
+        fh.write('90@90\n')
+    with pytest.raises(tsdb.TSDBError):
+        list(tsql.select_many('readings', [db0, db1]))
 
 
 def test_select_where_types_issue_261(mini_testsuite):